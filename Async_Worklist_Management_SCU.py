@@ -0,0 +1,64 @@
+"""
+Query the worklists for several scanners at once from asyncio, without
+wrapping each query in a thread of our own.
+"""
+import asyncio
+
+from pydicom.dataset import Dataset
+
+from pynetdicom import AE
+from pynetdicom.sop_class import ModalityWorklistInformationFind
+
+from async_client import associate
+
+
+async def query_worklist(ae, station_aet):
+    """Print the worklist for the scanner with AE title `station_aet`."""
+    # Create our Identifier (query) dataset
+    ds = Dataset()
+    ds.PatientName = '*'
+    ds.ScheduledProcedureStepSequence = [Dataset()]
+    item = ds.ScheduledProcedureStepSequence[0]
+    item.ScheduledStationAETitle = station_aet
+    item.ScheduledProcedureStepStartDate = '20181005'
+    item.Modality = 'CT'
+
+    # Associate with peer AE at IP 127.0.0.1 and port 11112
+    assoc = await associate(ae, '127.0.0.1', 11112)
+
+    if assoc.is_established:
+        # Use the C-FIND service to send the identifier
+        responses = assoc.send_c_find(ds, ModalityWorklistInformationFind)
+
+        async for (status, identifier) in responses:
+            if status:
+                print('{}: C-FIND query status: 0x{:04x}'.format(
+                    station_aet, status.Status
+                ))
+
+                # If the status is 'Pending' then identifier is the C-FIND response
+                if status.Status in (0xFF00, 0xFF01):
+                    print(identifier)
+            else:
+                print('Connection timed out, was aborted or received invalid response')
+
+        # Release the association
+        await assoc.release()
+    else:
+        print('Association rejected, aborted or never connected')
+
+
+async def main():
+    # Initialise the Application Entity
+    ae = AE()
+
+    # Add a requested presentation context
+    ae.add_requested_context(ModalityWorklistInformationFind)
+
+    # Run the queries concurrently
+    await asyncio.gather(
+        *[query_worklist(ae, aet) for aet in ['CTSCANNER', 'CTSCANNER2']]
+    )
+
+
+asyncio.run(main())
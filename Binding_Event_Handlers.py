@@ -8,14 +8,12 @@ LOGGER = logging.getLogger('pynetdicom')
 
 def handle_open(event):
     """Print the remote's (host, port) when connected."""
-    msg = 'Connected with remote at ({})'.format(event.address)
-    LOGGER.info(msg)
+    LOGGER.info('Connected with remote at (%s)', event.address)
 
 
 def handle_close(event):
     """Print the remote's (host, port) when disconnected"""
-    msg = 'Disconnected from remote at ({})'.format(event.address)
-    LOGGER.info(msg)
+    LOGGER.info('Disconnected from remote at (%s)', event.address)
 
 
 handlers = [(evt.EVT_CONN_OPEN, handle_open)]
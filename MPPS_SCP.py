@@ -1,9 +1,15 @@
-from pydicom.dataset import Dataset
-
 from pynetdicom import AE, evt
 from pynetdicom.sop_class import ModalityPerformedProcedureStepSOPClass
 
-managed_instances = {}
+from mpps_store import MPPSStore
+from worklist_store import WorklistStore
+
+# The managed SOP Instances, shared by all the association threads and
+#   persisted so they survive a restart
+managed_instances = MPPSStore('mpps.sqlite')
+
+# The Modality Worklist SCP's scheduled procedure steps
+worklist = WorklistStore('worklist.sqlite')
 
 
 # Implement the evt.EVT_N_CREATE handler
@@ -33,17 +39,18 @@ def handle_create(event):
 
     # Create a Modality Performed Procedure Step SOP Class Instance
     # DICOM Standard, Part 3, Annex B.17
-    ds = Dataset()
+    # The requested attributes are used as-is rather than copied
+    ds = attr_list
 
     # Add the SOP Common module elements (Annex C.12.1)
     ds.SOPClassUID = ModalityPerformedProcedureStepSOPClass
     ds.SOPInstanceUID = req.AffectedSOPInstanceUID
 
-    # Update with the requested attributes
-    ds.update(attr_list)
-
-    # Add the dataset to the managed SOP Instances
-    managed_instances[ds.SOPInstanceUID] = ds
+    # Add the dataset to the managed SOP Instances, unless another
+    #   association has created it in the meantime
+    if not managed_instances.create(ds):
+        # Failed - duplicate SOP Instance
+        return 0x0111, None
 
     # Return status, datset
     return 0x0000, ds
@@ -56,17 +63,30 @@ def handle_set(event):
         # Failure - SOP Instance not recognised
         return 0x0112, None
 
-    ds = managed_instances[req.RequestedSOPInstanceUID]
-
     # The N-SET request's *Modification List* dataset
     mod_list = event.attribute_list
 
     # Skip other test...
 
-    ds.update(mod_list)
-
-    # Return status, dataset
-    return 0x0000, ds
+    # Keep the instance, it's no longer held in memory once it's finished
+    instance = managed_instances.get(req.RequestedSOPInstanceUID)
+
+    # Only the modifications are applied and stored, the rest of the
+    #   SOP Instance is left untouched
+    modified = managed_instances.update(req.RequestedSOPInstanceUID, mod_list)
+    if modified is None:
+        # Failure - the procedure step is COMPLETED or DISCONTINUED and
+        #   may no longer be updated
+        return 0x0110, None
+
+    # The scheduled procedure steps that have been performed are removed
+    #   from the worklist
+    status = instance.get('PerformedProcedureStepStatus', '')
+    if str(status).upper() == 'COMPLETED':
+        worklist.complete(instance)
+
+    # Return status and just the modified attributes
+    return 0x0000, modified
 
 
 handlers = [(evt.EVT_N_CREATE, handle_create), (evt.EVT_N_SET, handle_set)]
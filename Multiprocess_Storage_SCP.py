@@ -0,0 +1,75 @@
+"""
+A Storage SCP that ingests on all cores: the same handler as Storage_SCP.py,
+but run by several worker processes that all accept associations on port
+11112, each with its own writer threads and index connection.
+"""
+import queue
+
+from pynetdicom import AE, evt, StoragePresentationContexts
+
+from archive_index import ArchiveIndex
+from multiproc_server import MultiprocessServer
+from storage_layout import HashedLayout
+from storage_writer import StorageWriter, write_raw
+
+
+# Shared by all the workers
+archive = '/path/to/directory'
+db_path = 'archive_index.sqlite'
+
+# Created by each worker in setup()
+index = None
+layout = None
+writer = None
+
+
+# Implement a handler evt.EVT_C_STORE
+def handle_store(event):
+    """Handle a C-STORE request event."""
+    req = event.request
+    file_meta = event.file_meta
+
+    # Queue the dataset to be saved using the SOP Instance UID as the
+    #   filename, if too many writes are already queued then give up
+    fpath = layout.path_for(req.AffectedSOPInstanceUID)
+    try:
+        written = writer.submit(
+            fpath,
+            lambda fp: write_raw(fp, file_meta, req.DataSet),
+            timeout=10
+        )
+    except queue.Full:
+        # Failure - Out of Resources
+        return 0xA700
+
+    # Only return 'Success' once the file is safely on disk
+    written.result()
+
+    # Add the new SOP Instance to the index, each worker has its own
+    #   connection to the database
+    index.add(fpath)
+
+    # Return a 'Success' status
+    return 0x0000
+
+
+def setup(worker):
+    """Create the AE and handlers for a worker process."""
+    global index, layout, writer
+
+    index = ArchiveIndex(db_path)
+    layout = HashedLayout(archive, depth=2, width=2)
+    writer = StorageWriter(workers=4, max_queue=64)
+
+    # Initialise the Application Entity
+    ae = AE()
+
+    # Add the supported presentation contexts
+    ae.supported_contexts = StoragePresentationContexts
+
+    return ae, [(evt.EVT_C_STORE, handle_store)]
+
+
+# Start a worker per CPU listening for incoming association requests
+server = MultiprocessServer(('', 11112), setup)
+server.serve_forever()
@@ -1,10 +1,23 @@
-import os
-from pydicom import dcmread
 from pydicom.dataset import Dataset
 
 from pynetdicom import AE, StoragePresentationContexts, evt
 from pynetdicom.sop_class import PatientRootQueryRetrieveInformationModelGet
 
+from admission import AdmissionControl
+from archive_index import ArchiveIndex
+from dataset_loader import iter_instances
+from matching import compile_query
+from transcode import TranscodeCache
+from transport_profiles import TransportTuner
+
+
+# The stored SOP Instances and the index of their key attributes
+fdir = '/path/to/directory'
+index = ArchiveIndex('archive_index.sqlite')
+
+# Instances decompressed for peers that can't accept them as stored
+transcoder = TranscodeCache('/path/to/transcoded', max_bytes=10 * 1024**3)
+
 
 # Implement the handler for evt.EVT_C_GET
 def handle_get(event):
@@ -15,42 +28,61 @@ def handle_get(event):
         yield 0xC000, None
         return
 
-    # Import stored SOP Instance
-    instances = []
-    matching = []
-    fdir = '/path/to/directory'
-    for fpath in os.listdir(fdir):
-        instances.append(dcmread(os.path.join(fdir, fpath)))
-
-    if ds.QueryRetrieveLevel == 'PATIENT':
-        if 'PatientID' in ds:
-            matching = [
-                inst for inst in instances if inst.PatientID == ds.PatientID
-            ]
-
-        # Skip the other possible attributes..
+    try:
+        plan = compile_query(ds)
+    except ValueError:
+        # Failure - Identifier does not match SOP Class
+        yield 0xA900, None
+        return
 
-    # Skip the other QR levels..
+    # Match against the index, no stored SOP Instances are read yet
+    matching = [fpath for fpath, _ in index.query(plan)]
 
     # Yield the total number of C-STORE sub-operations required
-    yield len(instances)
+    yield len(matching)
+
+    # Instances that can't be sent with any of the accepted transfer
+    #   syntaxes are converted (or taken from the cache if they have been
+    #   before)
+    paths = transcoder.iter_paths(matching, event.assoc.accepted_contexts)
 
-    # Yield the matching instances
-    for instance in matching:
+    # Yield the matching instances, each one is read from file just
+    #   before it's needed so only a few are ever held in memory
+    instances = iter_instances(paths)
+    for instance in instances:
         # Check if C-CANCEL has been received
         if event.is_cancelled:
+            instances.close()
             yield (0xFE00, None)
             return
 
-        # Pending
+        # Pending, a file that couldn't be read is yielded as the exception
+        #   instead, which counts as a failed sub-operation
         yield (0xFF00, instance)
 
 
+# Limit the concurrent associations, those over the limit wait briefly
+#   and are then rejected with 'temporary congestion'
+admission = AdmissionControl(max_associations=20, max_per_aet=4)
+
 handlers = [(evt.EVT_C_GET, handle_get)]
+handlers += admission.handlers()
+
+# The PDU size and socket buffers used for each peer are chosen from how
+#   its previous associations went
+transport = TransportTuner()
+handlers += transport.handlers()
+
+# Index any SOP Instances added, changed or removed since the last run
+index.sync(fdir)
 
 # Create application entity
 ae = AE()
 
+# pynetdicom's own limit must also cover the requests waiting to be
+#   admitted, or it rejects them once they are
+ae.maximum_associations = admission.ae_maximum_associations
+
 # Add the supported presentation contexts (Storage SCU)
 ae.supported_contexts = StoragePresentationContexts
 
@@ -1,3 +1,5 @@
+import os
+
 from pydicom.dataset import Dataset
 
 from pynetdicom import(
@@ -10,32 +12,35 @@ from pynetdicom.sop_class import (
     CTImageStorage
 )
 
+from storage_layout import HashedLayout
+from storage_writer import write_raw
+
+
+# Spread the retrieved SOP Instances over subdirectories
+layout = HashedLayout('/path/to/directory', depth=2, width=2)
+
 
 # Implement the handler for evt.EVT_C_STORE
 def handle_store(event):
     """Handle a C-STORE request event."""
-    ds = event.dataset
+    # The *Data Set* is written as it was received, without decoding it
+    req = event.request
     context = event.context
 
-    # Add the DICOM File Meta Information
+    # Create the DICOM File Meta Information from the request
     meta = Dataset()
-    meta.MediaStorageSOPClassUID = ds.SOPClassUID
-    meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    meta.MediaStorageSOPClassUID = req.AffectedSOPClassUID
+    meta.MediaStorageSOPInstanceUID = req.AffectedSOPInstanceUID
     meta.ImplementationClassUID = PYNETDICOM_IMPLEMENTATION_UID
     meta.ImplementationVersionName = PYNETDICOM_IMPLEMENTATION_VERSION
+    # The transfer syntax the dataset was encoded with
     meta.TransferSyntaxUID = context.transfer_syntax
 
-    # Add the file meta to the dataset
-    ds.file_meta = meta
-
-    # Set the transfer syntax attributes of the dataset
-    ds.is_little_endian = context.transfer_syntax.is_little_endian
-    ds.is_implicit_VR = context.transfer_syntax.is_implicit_VR
-
     # Save the dataset using the SOP Instance UID as the filename
-    # write_like_original : if True(default) preserves information from Dataset
-    # and may result in a non-conformant file.
-    ds.save_as(ds.SOPInstanceUID, write_like_original=False)
+    fpath = layout.path_for(req.AffectedSOPInstanceUID)
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'wb') as fp:
+        write_raw(fp, meta, req.DataSet)
 
     # Return a 'Success' status
     return 0x0000
@@ -1,11 +1,27 @@
-import os
-
-from pydicom import dcmread
 from pydicom.dataset import Dataset
 
-from pynetdicom import AE, StoragePresentationContexts, evt
+from pynetdicom import StoragePresentationContexts, evt
 from pynetdicom.sop_class import PatientRootQueryRetrieveInformationModelMove
 
+from admission import AdmissionControl
+from ae_registry import AERegistry
+from archive_index import ArchiveIndex
+from dataset_loader import iter_instances
+from matching import compile_query
+from move_scheduler import SchedulingAE
+from transcode import TranscodeCache
+
+
+# The stored SOP Instances and the index of their key attributes
+fdir = '/path/to/directory'
+index = ArchiveIndex('archive_index.sqlite')
+
+# The known move destinations, reloaded whenever the file is changed
+registry = AERegistry('destinations.json')
+
+# Instances decompressed for destinations that can't accept them as stored
+transcoder = TranscodeCache('/path/to/transcoded', max_bytes=10 * 1024**3)
+
 
 # Implement the evt.EVT_C_MOVE handler
 def handle_move(event):
@@ -17,55 +33,67 @@ def handle_move(event):
         yield 0xC000, None
         return
 
-    # get_known_aet() is here to represent a user-implemented method of
-    #   getting known AEs, for this example it returns a dict with the
-    #   AE titles as keys
-    known_aet_dict = get_known_aet()
     try:
-        (addr, port) = known_aet_dict[event.move_destination]
-    except KeyError:
+        plan = compile_query(ds)
+    except ValueError:
+        # Failure - Identifier does not match SOP Class
+        yield 0xA900, None
+        return
+
+    # Look up the destination's address and port by its AE title
+    destination = registry.lookup(event.move_destination)
+    if destination is None:
         # Unknown destination AE
         yield (None,None)
         return
 
-    # Yield the IP address listen port of the destination AE
-    yield (addr, port)
-
-    # Import stored SOP Instances
-    instances = []
-    matching = []
-    fdir = '/path/to/directory'
-    for fpath in os.listdir(fdir):
-        instances.append(dcmread(os.path.join(fdir, fpath)))
+    (addr, port) = destination
 
-    if ds.QueryRetrieveLevel == 'PATIENT':
-        if 'PatientID' in ds:
-            matching = [
-                inst for inst in instances if inst.PatientID == ds.PatientID
-            ]
+    # The sub-association is given back to the scheduler afterwards, even
+    #   if the sub-operations fail part way through
+    with ae.scheduler.moving():
+        # Yield the IP address listen port of the destination AE, the
+        #   sub-association is scheduled according to the request's priority
+        yield (addr, port, {'priority': event.request.Priority})
 
-        # Skip the other possible attributes...
+        # Match against the index, no stored SOP Instances are read yet
+        matching = [fpath for fpath, _ in index.query(plan)]
 
-    # Skip the other QR levels..
+        # Yield the total number of C-STORE sub-operations required
+        yield len(matching)
 
-    # Yield the total number of C-STORE sub-operations required
-    yield len(matching)
+        # Yield the matching instances, each one is read from file just
+        #   before it's needed so only a few are ever held in memory
+        instances = iter_instances(matching)
+        for instance in instances:
+            # Check if C-CANCEL has been received
+            if event.is_cancelled:
+                instances.close()
+                yield (0xFE00, None)
+                return
 
-    # Yield the matching instances
-    for instance in matching:
-        # Check if C-CANCEL has been received
-        if event.is_cancelled:
-            yield (0xFE00, None)
-            return
+            # Pending, a file that couldn't be read is yielded as the
+            #   exception instead, which counts as a failed sub-operation
+            yield (0xFF00, instance)
 
-        # Pending
-        yield (0xFF00, instance)
 
+# Limit the concurrent associations, those over the limit wait briefly
+#   and are then rejected with 'temporary congestion'
+admission = AdmissionControl(max_associations=20, max_per_aet=4)
 
 handlers = [(evt.EVT_C_MOVE, handle_move)]
+handlers += admission.handlers()
+
+# Index any SOP Instances added, changed or removed since the last run
+index.sync(fdir)
+
+# Create application entity, no more than two associations are made with
+#   each move destination at a time and they're reused between requests
+ae = SchedulingAE(max_per_destination=2, transcoder=transcoder)
 
-# Create application entity
-ae = AE()
+# pynetdicom's own limit must also cover the requests waiting to be
+#   admitted, or it rejects them once they are
+ae.maximum_associations = admission.ae_maximum_associations
 
 # Add the requested presentation contexts (Storage SCU)
 ae.requested_contexts = StoragePresentationContexts
@@ -1,65 +1,101 @@
-import os
-
-from pydicom import dcmread
-from pydicom.dataset import Dataset
-
 from pynetdicom import AE, evt
 from pynetdicom.sop_class import PatientRootQueryRetrieveInformationModelFind
 
+from admission import AdmissionControl
+from archive_index import ArchiveIndex
+from find_cache import FindCache, pre_encode
+from matching import compile_query
+from metrics import Metrics
+from transport_profiles import TransportTuner, LOW_LATENCY
+
+
+# The stored SOP Instances and the index of their key attributes
+fdir = '/path/to/directory'
+index = ArchiveIndex('archive_index.sqlite')
+
+# The encoded responses to recent queries
+cache = FindCache(maxsize=256, ttl=30)
+
 
 # Implement the handler for evt.EVT_C_FIND
 def handle_find(event):
     """Handle a C-FIND request event."""
     ds = event.identifier
 
-    # Import stored SOP Instance
-    instance = []
-    fdir = '/path/to/directory'
-    for fpath in os.listdir(fdir):
-        instance.append(dcmread(os.path.join(fdir, fpath)))
-
     if 'QueryRetrieveLevel' not in ds:
         # Failure
         yield 0xC000, None
         return
 
-    if ds.QueryRetrieveLevel == 'PATIENT':
-        if 'PatientName' in ds:
-            if ds.PatientName not in ['*', '', '?']:
-                matching = [
-                    inst for inst in instance if inst.PatientName == ds.PatientName
-                ]
-
-                # Skip the other possible values
-
-            # Skip the other possible attributes
-
-        # Skip the other QR levels
-
-        for instance in matching:
-            # Check if C-CANCEL has been received
-            # 만약 event가 취소 됐다면, yield를 통해 값을 반환하고 종료한다.
-            if event.is_canceled:
-                yield (0xFE00, None)
-                return
-
-            identifier = Dataset()
-            identifier.PatientName = instance.PatientName
-            identifier.QueryRetrieveLevel = ds.QueryRetrieveLevel
-
-            # Pending
-            yield (0xFF00, identifier)
-
+    # Compile the Identifier into a query plan, the selective keys are
+    #   looked up in the index rather than reading every stored SOP Instance
+    try:
+        plan = compile_query(ds)
+    except ValueError:
+        # Failure - Identifier does not match SOP Class
+        yield 0xA900, None
+        return
 
-handlers = [(evt.EVT_C_FIND, handle_find)]
+    # Repeated queries are answered with the responses already encoded in
+    #   the transfer syntax of the presentation context
+    transfer_syntax = event.context.transfer_syntax
+
+    def build():
+        matching = index.query(
+            plan, distinct=True, keywords=plan.return_keys
+        )
+        return (
+            pre_encode(plan.response(instance), transfer_syntax)
+            for _, instance in matching
+        )
+
+    # New responses are only cached if the index doesn't change while
+    #   they're being made, any that can't be encoded are left out
+    responses = cache.responses(
+        cache.key(ds, transfer_syntax), index.generation, build,
+        lambda: index.generation
+    )
+    for response in responses:
+        # Check if C-CANCEL has been received
+        # 만약 event가 취소 됐다면, yield를 통해 값을 반환하고 종료한다.
+        if event.is_cancelled:
+            yield (0xFE00, None)
+            return
+
+        # Pending
+        yield (0xFF00, response)
+
+
+# Limit the concurrent associations, those over the limit wait briefly
+#   and are then rejected with 'temporary congestion'
+admission = AdmissionControl(max_associations=40, max_per_aet=8)
+
+# Record latencies and throughput, scraped from http://127.0.0.1:9102/
+metrics = Metrics()
+
+handlers = [(evt.EVT_C_FIND, metrics.timed(evt.EVT_C_FIND, handle_find))]
+handlers += admission.handlers()
+handlers += metrics.handlers()
+
+# Queries and their responses are small, so don't delay sending them
+transport = TransportTuner(LOW_LATENCY)
+handlers += transport.handlers()
+
+# Index any SOP Instances added, changed or removed since the last run
+index.sync(fdir)
 
 # Initialise the Application Entity and specify the listen port
 ae = AE()
 
+# pynetdicom's own limit must also cover the requests waiting to be
+#   admitted, or it rejects them once they are
+ae.maximum_associations = admission.ae_maximum_associations
+
 # Add the supported presentation context
 ae.add_supported_context(PatientRootQueryRetrieveInformationModelFind)
 
-# Start listening for incoming association requests
+# Start the metrics endpoint and listen for incoming association requests
+metrics.serve(('127.0.0.1', 9102))
 ae.start_server(('', 11112), evt_handlers=handlers)
 
 
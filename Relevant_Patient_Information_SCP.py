@@ -1,26 +1,24 @@
-import os
-
-from pydicom import dcmread
 from pydicom.dataset import Dataset
 
 from pynetdicom import AE, evt
 from pynetdicom.sop_class import GeneralRelevantPatientInformationQuery
 
+from dataset_loader import iter_headers
+
 
 # Implement the evt.EVT_C_FIND handler
 def handle_find(event):
     """Handle a C-FIND service request"""
     ds = event.identifier
 
-    # Import stored SOP Instances
-    instances = []
+    # Import the headers of the stored SOP Instances, the template is
+    #   built from header attributes so the Pixel Data is never read
     fdir = '/path/to/directory'
-    for fpath in os.listdir(fdir):
-        instances.append(dcmread(os.path.join(fdir, fpath)))
+    instances = [inst for _, inst in iter_headers(fdir)]
 
     # Not a good example of how to match
     matching = [
-        inst for inst in instances if instances.PatientID == ds.PatientID
+        inst for inst in instances if inst.get('PatientID') == ds.PatientID
     ]
 
     # There must either be no match or 1 match, everything else
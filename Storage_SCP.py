@@ -1,4 +1,4 @@
-from pydicom.dataset import Dataset
+import queue
 
 from pynetdicom import(
     AE, evt,
@@ -7,31 +7,115 @@ from pynetdicom import(
     PYNETDICOM_IMPLEMENTATION_VERSION
 )
 
+from admission import AdmissionControl
+from archive_index import ArchiveIndex, INDEX_KEYS
+from event_log import EventLog
+from metrics import Metrics
+from offload import read_keys
+from pdv_receiver import PDVReceiver, encoded_dataset
+from storage_layout import HashedLayout
+from storage_writer import StorageWriter, write_raw
+from transport_profiles import TransportTuner
+
+
+# Keep the index used by the Query/Retrieve SCPs up to date
+index = ArchiveIndex('archive_index.sqlite')
+
+# Spread the stored SOP Instances over subdirectories of the archive
+layout = HashedLayout('/path/to/directory', depth=2, width=2)
+
+# The writes from all associations are shared by a pool of writer threads
+writer = StorageWriter(workers=4, max_queue=64)
+
+# The attributes stored in the index
+keywords = [keyword for _, keyword, _ in INDEX_KEYS]
+
 
 # Implement a handler evt.EVT_C_STORE
 def handle_store(event):
     """Handle a C-STORE request event."""
-    # Decode the C-STORE request's *Data Set* parameter to a pydicom Dataset
-    ds = event.dataset
+    # The C-STORE request's *Data Set* parameter is saved exactly as it
+    #   was received, it's never decoded to a pydicom Dataset
+    req = event.request
+
+    # The File Meta Information
+    file_meta = event.file_meta
+
+    # Queue the dataset to be saved using the SOP Instance UID as the
+    #   filename, if too many writes are already queued then give up
+    fpath = layout.path_for(req.AffectedSOPInstanceUID)
+    try:
+        written = writer.submit(
+            fpath,
+            lambda fp: write_raw(fp, file_meta, req.DataSet),
+            timeout=10
+        )
+    except queue.Full:
+        # Failure - Out of Resources
+        return 0xA700
+
+    # Meanwhile decode the indexed attributes from the received dataset,
+    #   only its header is parsed so there's nothing to gain from doing
+    #   this in another process
+    keys = read_keys(
+        encoded_dataset(event), event.context.transfer_syntax, keywords
+    )
 
-    # Add the File Meta Information
-    ds.file_meta = event.file_meta
+    # Only return 'Success' once the file is safely on disk
+    written.result()
 
-    # Save the dataset using the SOP Instance UID and the filename
-    ds.save_as(ds.SOPInstanceUID, write_like_original=False)
+    # Add the new SOP Instance to the index
+    index.add(fpath, keys)
 
     # Return a 'Success' status
     return 0x0000
 
 
-handlers = [(evt.EVT_C_STORE, handle_store)]
+# Limit the concurrent associations, those over the limit wait briefly
+#   and are then rejected with 'temporary congestion'
+admission = AdmissionControl(
+    max_associations=40, max_per_aet=8, memory_limit=2 * 1024**3
+)
+
+# Record latencies and throughput, scraped from http://127.0.0.1:9102/
+metrics = Metrics()
+
+handlers = [(evt.EVT_C_STORE, metrics.timed(evt.EVT_C_STORE, handle_store))]
+handlers += admission.handlers()
+handlers += metrics.handlers()
+
+# A sampled event log, configured while running by editing event_log.json.
+#   pynetdicom's standard handlers still format a debug message for every
+#   PDU and DIMSE message even when they're not logged. If the event log is
+#   all that's needed they can be turned off with
+#   `pynetdicom._config.LOG_HANDLER_LEVEL = 'none'`, but that's left to the
+#   user as it applies to every AE in the process
+event_log = EventLog(
+    'events.jsonl', control='event_log.json', sample_rate=0.1
+)
+handlers += event_log.handlers()
+
+# Use large PDUs and socket buffers with peers that send a lot of data,
+#   chosen from how each peer's previous associations went
+transport = TransportTuner()
+handlers += transport.handlers()
+
+# Receive each dataset straight from the socket into one buffer, rather
+#   than copying it fragment by fragment
+receiver = PDVReceiver()
+handlers += receiver.handlers()
 
 # Initialise the Application Entity
 ae = AE()
 
+# pynetdicom's own limit must also cover the requests waiting to be
+#   admitted, or it rejects them once they are
+ae.maximum_associations = admission.ae_maximum_associations
+
 # Add the supported presentation contexts
 ae.supported_contexts = StoragePresentationContexts
 
-# Start listening for incoming association requests
+# Start the metrics endpoint and listen for incoming association requests
+metrics.serve(('127.0.0.1', 9102))
 ae.start_server(('', 11112), evt_handlers=handlers)
 
@@ -3,6 +3,8 @@ from pydicom import dcmread
 from pynetdicom import AE
 from pynetdicom.sop_class import CTImageStorage
 
+from transport_profiles import TransportTuner, LAN_BULK
+
 # Initialise the Application Entity
 ae = AE()
 
@@ -12,8 +14,10 @@ ae.add_requested_context(CTImageStorage)
 # Read in our DICOM CT dataset
 ds = dcmread('path/to/dataset')
 
-# Associate with peer AE at IP 127.0.0.1 and port 11112
-assoc = ae.associate('127.0.0.1', 11112)
+# Associate with peer AE at IP 127.0.0.1 and port 11112, with large PDUs
+#   and socket buffers for sending images over the local network
+transport = TransportTuner(LAN_BULK)
+assoc = transport.associate(ae, '127.0.0.1', 11112)
 
 if assoc.is_established:
     # Use the C-STORE service to send the dataset
@@ -0,0 +1,89 @@
+"""
+The Modality Worklist SCP answers the worklist queries sent by
+Worklist_Management_SCU.py. The scheduled procedure steps are kept in an
+indexed store so a modality's poll is an index lookup rather than a scan,
+and steps are removed by the MPPS SCP once they've been completed.
+"""
+import logging
+import os
+
+from pydicom import dcmread
+
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import ModalityWorklistInformationFind
+
+from find_cache import FindCache, pre_encode
+from matching import QueryPlan
+from storage_layout import iter_files
+from worklist_store import WorklistStore
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# The scheduled procedure steps, shared with MPPS_SCP.py
+worklist = WorklistStore('worklist.sqlite')
+
+# New worklist items are dropped into this directory by the RIS
+wdir = '/path/to/worklist'
+
+# The encoded responses to recent polls
+cache = FindCache(maxsize=256, ttl=30)
+
+
+# Implement the handler for evt.EVT_C_FIND
+def handle_find(event):
+    """Handle a Modality Worklist C-FIND request event."""
+    ds = event.identifier
+
+    # A worklist query isn't hierarchical so there's no Query/Retrieve Level
+    plan = QueryPlan(ds)
+
+    # Modalities repeat the same poll every few seconds, so answer it from
+    #   the cache until the worklist changes
+    transfer_syntax = event.context.transfer_syntax
+
+    def build():
+        return (
+            pre_encode(plan.response(item), transfer_syntax)
+            for item in worklist.query(plan)
+        )
+
+    # New responses are only cached if the worklist doesn't change while
+    #   they're being made, any that can't be encoded are left out
+    responses = cache.responses(
+        cache.key(ds, transfer_syntax), worklist.generation, build,
+        lambda: worklist.generation
+    )
+    for response in responses:
+        # Check if C-CANCEL has been received
+        if event.is_cancelled:
+            yield (0xFE00, None)
+            return
+
+        # Pending
+        yield (0xFF00, response)
+
+
+handlers = [(evt.EVT_C_FIND, handle_find)]
+
+# Move the worklist items waiting in the directory into the store, so
+#   completed steps aren't added again on the next start. A file is only
+#   removed once it's been committed, any that can't be added are left
+#   where they are to be tried again
+for path in iter_files(wdir):
+    try:
+        worklist.add(dcmread(path))
+    except Exception as exc:
+        LOGGER.error("Unable to add the worklist item '%s': %s", path, exc)
+        continue
+
+    os.remove(path)
+
+# Initialise the Application Entity and specify the listen port
+ae = AE()
+
+# Add the supported presentation context
+ae.add_supported_context(ModalityWorklistInformationFind)
+
+# Start listening for incoming association requests
+ae.start_server(('', 11112), evt_handlers=handlers)
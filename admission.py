@@ -0,0 +1,211 @@
+"""
+Admission control for SCPs.
+
+Without a limit an SCP accepts every association it's asked for, so a burst
+of associations from one modality can use up the threads, memory and disk
+bandwidth that everyone else needs. ``AdmissionControl`` binds to
+``evt.EVT_REQUESTED`` and only lets an association be negotiated if:
+
+* fewer than `max_associations` admitted associations are in progress,
+* fewer than `max_per_aet` of them are from the same calling AE title, and
+* the process is using less than `memory_limit` bytes of memory.
+
+Otherwise the request waits for up to `queue_timeout` seconds for one of the
+associations in progress to end, and if it's still not possible (or more
+than `max_queued` requests are already waiting) the association is rejected
+with "temporary congestion", so the requestor knows to try again later.
+
+    admission = AdmissionControl(max_associations=40, max_per_aet=8)
+    handlers = [(evt.EVT_C_STORE, handle_store)] + admission.handlers()
+"""
+import logging
+import os
+import threading
+import time
+
+from pynetdicom import evt
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# A-ASSOCIATE-RJ: rejected transient, DUL service provider (presentation
+#   related), temporary congestion
+CONGESTION = (0x02, 0x03, 0x01)
+
+# The minimum number of seconds between checks of the memory used
+_MEMORY_INTERVAL = 1
+
+
+def _memory_used():
+    """Return the resident memory of this process in bytes, if known."""
+    try:
+        with open('/proc/self/statm', 'r') as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class AdmissionControl(object):
+    """Limits the associations accepted by an SCP.
+
+    Parameters
+    ----------
+    max_associations : int, optional
+        The maximum number of concurrent associations (default ``50``).
+    max_per_aet : int, optional
+        The maximum number of concurrent associations from a single calling
+        AE title (default ``10``).
+    max_queued : int, optional
+        The maximum number of association requests waiting to be admitted
+        (default ``20``).
+    queue_timeout : float, optional
+        The number of seconds a request waits to be admitted before it's
+        rejected (default ``5``).
+    memory_limit : int, optional
+        If used then associations aren't admitted while the process' resident
+        memory is more than this many bytes (Linux only).
+    """
+    def __init__(self, max_associations=50, max_per_aet=10, max_queued=20,
+                 queue_timeout=5, memory_limit=None):
+        self.max_associations = max_associations
+        self.max_per_aet = max_per_aet
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.memory_limit = memory_limit
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # {assoc: calling AE title}
+        self._admitted = {}
+        # {calling AE title: number of admitted associations}
+        self._per_aet = {}
+        self._queued = 0
+        self.rejected = 0
+
+        self._memory = 0
+        self._memory_checked = 0
+
+    def handlers(self):
+        """Return the event handlers to bind to the SCP."""
+        return [
+            (evt.EVT_REQUESTED, self._on_requested),
+            (evt.EVT_RELEASED, self._on_finished),
+            (evt.EVT_ABORTED, self._on_finished),
+            (evt.EVT_REJECTED, self._on_finished),
+            (evt.EVT_CONN_CLOSE, self._on_finished),
+        ]
+
+    @property
+    def ae_maximum_associations(self):
+        """Return the lowest ``AE.maximum_associations`` that can be used.
+
+        Requests waiting to be admitted are still in ``evt.EVT_REQUESTED``,
+        so pynetdicom counts them as active associations and would reject
+        the one admitted when a slot is freed if its limit didn't cover
+        them as well.
+        """
+        return self.max_associations + self.max_queued
+
+    @property
+    def active(self):
+        """Return the number of admitted associations in progress."""
+        with self._lock:
+            return len(self._admitted)
+
+    def _on_requested(self, event):
+        """Admit or reject the association request."""
+        assoc = event.assoc
+        aet = assoc.requestor.primitive.calling_ae_title
+        if self._admit(assoc, aet):
+            return
+
+        LOGGER.warning(
+            "Rejecting association from '%s': temporary congestion", aet
+        )
+        assoc.acse.send_reject(*CONGESTION)
+        evt.trigger(assoc, evt.EVT_REJECTED, {})
+        assoc.kill()
+
+    def _admit(self, assoc, aet):
+        """Return ``True`` once the association has been admitted."""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._lock:
+            self._purge()
+            if self._can_admit(aet):
+                self._add(assoc, aet)
+                return True
+
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                return False
+
+            self._queued += 1
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+
+                    # Memory isn't freed with a notification, so check again
+                    #   every so often
+                    self._changed.wait(min(remaining, _MEMORY_INTERVAL))
+                    self._purge()
+                    if self._can_admit(aet):
+                        self._add(assoc, aet)
+                        return True
+            finally:
+                self._queued -= 1
+
+    def _can_admit(self, aet):
+        """Return ``True`` if an association from `aet` can be admitted.
+
+        Must be called with the lock held.
+        """
+        if len(self._admitted) >= self.max_associations:
+            return False
+
+        if self._per_aet.get(aet, 0) >= self.max_per_aet:
+            return False
+
+        if self.memory_limit is None:
+            return True
+
+        now = time.monotonic()
+        if now - self._memory_checked > _MEMORY_INTERVAL:
+            self._memory_checked = now
+            self._memory = _memory_used() or 0
+
+        return self._memory < self.memory_limit
+
+    def _add(self, assoc, aet):
+        """Record `assoc` as admitted, must be called with the lock held."""
+        self._admitted[assoc] = aet
+        self._per_aet[aet] = self._per_aet.get(aet, 0) + 1
+
+    def _remove(self, assoc):
+        """Free the slot used by `assoc`, must be called with the lock held."""
+        aet = self._admitted.pop(assoc, None)
+        if aet is None:
+            return
+
+        self._per_aet[aet] -= 1
+        if not self._per_aet[aet]:
+            del self._per_aet[aet]
+
+        self._changed.notify_all()
+
+    def _purge(self):
+        """Free the slots of associations that ended without an event.
+
+        Must be called with the lock held.
+        """
+        for assoc in [aa for aa in self._admitted if not aa.is_alive()]:
+            self._remove(assoc)
+
+    def _on_finished(self, event):
+        """Free the slot used by the association."""
+        with self._lock:
+            self._remove(event.assoc)
@@ -0,0 +1,123 @@
+"""
+A registry of the known move destinations, loaded from a JSON file.
+
+The file maps each AE title to the destination's address and listen port::
+
+    {
+        "STORESCP": {"address": "192.168.1.20", "port": 11113},
+        "WORKSTATION1": {"address": "192.168.1.31", "port": 104}
+    }
+
+Lookups are a dict access. The file is reloaded when it's changed, without
+restarting the server, but it's only checked for changes every
+`check_interval` seconds. An AE title that isn't in the registry also
+triggers a check (so a newly added destination is found at once), after
+which the title is remembered as unknown for `negative_ttl` seconds so a
+misconfigured peer repeating its request doesn't cause a check every time.
+"""
+import json
+import os
+import threading
+import time
+
+
+def _normalise(ae_title):
+    """Return `ae_title` as a :class:`str` without padding."""
+    if isinstance(ae_title, bytes):
+        ae_title = ae_title.decode('ascii', errors='replace')
+
+    return ae_title.strip()
+
+
+class AERegistry(object):
+    """The known AEs, indexed by AE title.
+
+    Parameters
+    ----------
+    path : str
+        The path to the JSON file.
+    check_interval : float, optional
+        The minimum number of seconds between checks for changes to the file
+        (default ``5``).
+    negative_ttl : float, optional
+        The number of seconds an unknown AE title is remembered for (default
+        ``60``).
+    """
+    def __init__(self, path, check_interval=5, negative_ttl=60):
+        self.path = path
+        self.check_interval = check_interval
+        self.negative_ttl = negative_ttl
+
+        self._lock = threading.Lock()
+        self._aets = {}
+        self._unknown = {}
+        self._mtime = None
+        self._checked = 0
+        self._check(force=True)
+
+    def lookup(self, ae_title):
+        """Return the (address, port) for `ae_title` or ``None`` if unknown.
+
+        Parameters
+        ----------
+        ae_title : bytes or str
+            The AE title, such as a C-MOVE request's *Move Destination*.
+        """
+        ae_title = _normalise(ae_title)
+        self._check()
+        destination = self._aets.get(ae_title)
+        if destination is not None:
+            return destination
+
+        now = time.monotonic()
+        with self._lock:
+            expires = self._unknown.get(ae_title)
+            if expires is not None and now < expires:
+                return None
+
+        # The destination may have just been added
+        self._check(force=True)
+        destination = self._aets.get(ae_title)
+        if destination is None:
+            with self._lock:
+                self._unknown[ae_title] = now + self.negative_ttl
+
+        return destination
+
+    def __contains__(self, ae_title):
+        return self.lookup(ae_title) is not None
+
+    def _check(self, force=False):
+        """Reload the file if it has changed since it was last loaded."""
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                # Keep using the last good configuration
+                return
+
+            if mtime == self._mtime:
+                return
+
+            try:
+                with open(self.path, 'r') as fp:
+                    config = json.load(fp)
+
+                aets = {
+                    _normalise(aet): (str(dest['address']), int(dest['port']))
+                    for aet, dest in config.items()
+                }
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                # The file may be part way through being written, try again
+                #   at the next check
+                return
+
+            # Replace the registry as a whole so lookups don't need the lock
+            self._aets = aets
+            self._unknown = {}
+            self._mtime = mtime
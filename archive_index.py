@@ -0,0 +1,305 @@
+"""
+A persistent index of the Patient/Study/Series/Image key attributes of the
+SOP Instances stored in an archive directory.
+
+The index is kept in a SQLite database so it survives restarts. It is built
+once by scanning the archive and after that only files that are new, changed
+or removed are (re)read, so a C-FIND doesn't have to ``dcmread`` the whole
+archive to find the matching instances.
+
+Every change to the index increments its ``generation``, so anything derived
+from it (such as cached C-FIND responses) can tell when it's out of date,
+even if the change was made by another process.
+"""
+import os
+import sqlite3
+import threading
+
+from pydicom.errors import InvalidDicomError
+
+from dataset_loader import read_header
+from matching import UNIQUE_KEYS
+from storage_layout import iter_files
+
+
+# The attributes stored in the index as (column, keyword, QR level)
+INDEX_KEYS = [
+    ('patient_id', 'PatientID', 'PATIENT'),
+    ('patient_name', 'PatientName', 'PATIENT'),
+    ('patient_birth_date', 'PatientBirthDate', 'PATIENT'),
+    ('patient_sex', 'PatientSex', 'PATIENT'),
+    ('study_instance_uid', 'StudyInstanceUID', 'STUDY'),
+    ('study_date', 'StudyDate', 'STUDY'),
+    ('study_time', 'StudyTime', 'STUDY'),
+    ('accession_number', 'AccessionNumber', 'STUDY'),
+    ('study_id', 'StudyID', 'STUDY'),
+    ('study_description', 'StudyDescription', 'STUDY'),
+    ('series_instance_uid', 'SeriesInstanceUID', 'SERIES'),
+    ('series_number', 'SeriesNumber', 'SERIES'),
+    ('modality', 'Modality', 'SERIES'),
+    ('sop_instance_uid', 'SOPInstanceUID', 'IMAGE'),
+    ('sop_class_uid', 'SOPClassUID', 'IMAGE'),
+    ('instance_number', 'InstanceNumber', 'IMAGE'),
+]
+
+# Columns that get a SQLite index so equality lookups don't scan the table
+_INDEXED_COLUMNS = [
+    'patient_id', 'patient_name', 'study_instance_uid',
+    'series_instance_uid', 'study_date', 'accession_number', 'modality'
+]
+
+_KEYWORDS = [keyword for _, keyword, _ in INDEX_KEYS]
+
+# The column for each indexed keyword
+_COLUMNS = {keyword: col for col, keyword, _ in INDEX_KEYS}
+
+# The columns of an index entry, in the order returned by ``_row()``
+_ROW_COLUMNS = ['path', 'mtime'] + [col for col, _, _ in INDEX_KEYS]
+
+
+def _as_text(value):
+    """Return an element value as the text stored in the index."""
+    if value is None:
+        return ''
+
+    return str(value)
+
+
+class ArchiveIndex(object):
+    """A SQLite index of the key attributes of an archive's SOP Instances.
+
+    The index may be shared between processes (e.g. a Storage SCP adding
+    instances and a Query/Retrieve SCP searching them), each opening its own
+    ``ArchiveIndex`` on the same database file.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+
+        with self._lock, self._conn:
+            # WAL lets readers in other processes carry on while we write
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            columns = ', '.join(
+                '{} TEXT'.format(col) for col, _, _ in INDEX_KEYS
+                if col != 'sop_instance_uid'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS instances ('
+                'path TEXT PRIMARY KEY, mtime REAL, '
+                'sop_instance_uid TEXT UNIQUE, {})'.format(columns)
+            )
+            for col in _INDEXED_COLUMNS:
+                self._conn.execute(
+                    'CREATE INDEX IF NOT EXISTS ix_{0} ON instances ({0})'
+                    .format(col)
+                )
+
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta '
+                '(key TEXT PRIMARY KEY, value INTEGER)'
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('generation', 0)"
+            )
+
+    @property
+    def generation(self):
+        """Return the number of changes made to the index."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+
+        return row['value']
+
+    def _changed(self):
+        """Increment the generation, must be called within a transaction."""
+        self._conn.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+        )
+
+    @staticmethod
+    def _row(path, ds=None):
+        """Return the values of the index entry for the file at `path`."""
+        path = os.path.abspath(path)
+        # Before reading, so a change made while it's read is seen by the
+        #   next sync
+        mtime = os.path.getmtime(path)
+        if ds is None:
+            ds = read_header(path, _KEYWORDS)
+
+        values = [_as_text(ds.get(keyword)) for _, keyword, _ in INDEX_KEYS]
+        return [path, mtime] + values
+
+    def _insert(self, rows):
+        """Add or replace entries, must be called within a transaction."""
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO instances ({}) VALUES ({})'.format(
+                ', '.join(_ROW_COLUMNS), ', '.join('?' * len(_ROW_COLUMNS))
+            ),
+            rows
+        )
+
+    def add(self, path, ds=None):
+        """Add or replace the index entry for the file at `path`.
+
+        If `ds` is not supplied the file header is read, the Pixel Data is
+        never loaded.
+        """
+        row = self._row(path, ds)
+        with self._lock, self._conn:
+            self._insert([row])
+            self._changed()
+
+    def remove(self, path):
+        """Remove the index entry for the file at `path`."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM instances WHERE path = ?', (os.path.abspath(path),)
+            )
+            self._changed()
+
+    def sync(self, fdir):
+        """Bring the index up to date with the files stored below `fdir`.
+
+        Only files that are new or have been modified since they were last
+        indexed are read, entries for files that no longer exist are removed.
+        All the changes are made in a single transaction, so the generation
+        is only incremented once however many files changed. Returns the
+        number of (added or updated, removed) entries.
+        """
+        with self._lock:
+            indexed = dict(
+                self._conn.execute('SELECT path, mtime FROM instances')
+            )
+
+        # The files are read without holding the lock, only the (small)
+        #   index entries are kept until they're written
+        rows = []
+        for path in iter_files(fdir):
+            path = os.path.abspath(path)
+            mtime = indexed.pop(path, None)
+            if mtime is not None and mtime == os.path.getmtime(path):
+                continue
+
+            try:
+                rows.append(self._row(path))
+            except (InvalidDicomError, OSError):
+                # Not a DICOM file, skip it
+                continue
+
+        # Anything left over has been removed from the archive
+        removed = [(path, ) for path in indexed]
+        if rows or removed:
+            with self._lock, self._conn:
+                self._insert(rows)
+                self._conn.executemany(
+                    'DELETE FROM instances WHERE path = ?', removed
+                )
+                self._changed()
+
+        return len(rows), len(removed)
+
+    def search(self, **kwargs):
+        """Return the index rows whose columns equal the supplied values.
+
+        For example ``index.search(patient_id='1234567')``. Values are
+        compared as stored, with no wildcard or range matching.
+        """
+        clauses = []
+        params = []
+        for col, value in kwargs.items():
+            clauses.append('{} = ?'.format(col))
+            params.append(_as_text(value))
+
+        sql = 'SELECT * FROM instances'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def query(self, plan, distinct=False, keywords=None):
+        """Yield (path, candidate) for the indexed instances matching `plan`.
+
+        The keys of `plan` that the index can match are run as a single SQL
+        query, any others are checked against each result, reading the file
+        header only if the index doesn't hold the required attributes.
+
+        Parameters
+        ----------
+        plan : matching.QueryPlan
+            The compiled query.
+        distinct : bool, optional
+            If ``True`` then only yield one candidate per value of the Unique
+            Key for the query level (as needed for C-FIND), otherwise yield
+            every matching instance (as needed for C-GET and C-MOVE).
+        keywords : list of str, optional
+            Attributes that `candidate` must have if present in the instance
+            (such as the return keys for a C-FIND response).
+
+        Yields
+        ------
+        str, dict or pydicom.dataset.Dataset
+            The path to the matching instance and the candidate it was matched
+            against, which is either a {keyword: value} dict of the indexed
+            attributes or the file's header.
+        """
+        clauses, residual = plan.split(_COLUMNS)
+        needed = set(keywords or []) | set(kw for kw, _ in residual)
+        read_headers = bool(needed - set(_COLUMNS))
+
+        sql = 'SELECT * FROM instances'
+        params = []
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(cc for cc, _ in clauses)
+            for _, pp in clauses:
+                params.extend(pp)
+
+        unique_column = _COLUMNS.get(plan.unique_key)
+        if distinct and unique_column and not residual:
+            # Let SQLite remove the duplicates
+            sql += ' GROUP BY {}'.format(unique_column)
+            distinct = False
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        seen = set()
+        for row in rows:
+            if read_headers:
+                try:
+                    candidate = read_header(row['path'])
+                except (InvalidDicomError, OSError):
+                    continue
+            else:
+                candidate = {kw: row[col] for kw, col in _COLUMNS.items()}
+
+            if residual and not plan.matches(candidate):
+                continue
+
+            if distinct:
+                key = str(candidate.get(plan.unique_key))
+                if key in seen:
+                    continue
+
+                seen.add(key)
+
+            yield row['path'], candidate
+
+    def lookup(self, sop_instance_uid):
+        """Return the path of the SOP Instance with `sop_instance_uid`."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT path FROM instances WHERE sop_instance_uid = ?',
+                (sop_instance_uid, )
+            ).fetchone()
+
+        return row['path'] if row else None
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
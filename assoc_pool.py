@@ -0,0 +1,234 @@
+"""
+A pool of established associations for SCUs that make repeated requests.
+
+Negotiating an association can take longer than the request itself, so
+rather than associating and releasing for every operation an SCU can take an
+association from the pool and give it back afterwards. Associations are
+pooled by (peer address, port, AE title, presentation contexts), checked
+before being handed out if they've been idle for a while, released once
+they've been idle for too long and replaced if they've been aborted.
+
+The check is a C-ECHO if a Verification context was accepted. One is added
+to the requested contexts when there's room, but if the contexts already
+fill all 128 slots the check falls back to making sure the association's
+thread is running and its socket hasn't been closed by the peer.
+
+    pool = AssociationPool(ae)
+    with pool.association('127.0.0.1', 11112) as assoc:
+        if assoc.is_established:
+            status = assoc.send_c_echo()
+"""
+from contextlib import contextmanager
+import socket
+import threading
+import time
+
+from pynetdicom import build_context
+from pynetdicom.sop_class import VerificationSOPClass
+
+
+# The maximum number of presentation contexts in an association request
+MAX_CONTEXTS = 128
+
+
+def _contexts_key(contexts):
+    """Return a hashable key for a list of presentation contexts."""
+    return tuple(sorted(
+        (cx.abstract_syntax, tuple(cx.transfer_syntax)) for cx in contexts
+    ))
+
+
+def _is_connected(assoc):
+    """Return ``True`` if the association's socket is still connected."""
+    sock = assoc.dul.socket
+    if sock is None or sock.socket is None:
+        return False
+
+    try:
+        # Peek so the data is left for the association's reactor, an empty
+        #   read means the peer has closed the connection
+        data = sock.socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        # Nothing waiting to be read, but still connected
+        return True
+    except ValueError:
+        # TLS sockets don't take flags, so rely on the reactor instead
+        return True
+    except OSError:
+        return False
+
+    return data != b''
+
+
+class AssociationPool(object):
+    """A pool of established associations.
+
+    Parameters
+    ----------
+    ae : ae.ApplicationEntity
+        The AE used to request new associations.
+    max_idle : int, optional
+        The maximum number of idle associations kept for each peer and set
+        of contexts (default ``2``).
+    idle_timeout : float, optional
+        The number of seconds after which an idle association is released
+        (default ``60``).
+    check_after : float, optional
+        The number of seconds an association may be idle before it's checked
+        when taken from the pool (default ``10``).
+    """
+    def __init__(self, ae, max_idle=2, idle_timeout=60, check_after=10):
+        self.ae = ae
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+
+        self._lock = threading.Lock()
+        # {key: [(assoc, time returned to the pool), ...]}
+        self._idle = {}
+        # {assoc: key}, for the associations currently in use
+        self._keys = {}
+
+        self._closed = threading.Event()
+        reaper = threading.Thread(target=self._reap, name='AssociationReaper')
+        reaper.daemon = True
+        reaper.start()
+
+    def acquire(self, addr, port, ae_title=b'ANY-SCP', contexts=None):
+        """Return an association with the peer, reusing an idle one if any.
+
+        Parameters
+        ----------
+        addr : str
+            The peer's IP address.
+        port : int
+            The peer's listen port.
+        ae_title : bytes, optional
+            The peer's AE title (default ``b'ANY-SCP'``).
+        contexts : list of presentation.PresentationContext, optional
+            The presentation contexts to request, if not used then the AE's
+            requested contexts are used (default). A Verification context is
+            added if there isn't one (and there's room for it) so the
+            association can be checked.
+
+        Returns
+        -------
+        association.Association
+            The association, which like ``AE.associate()`` may not have been
+            established.
+        """
+        contexts = list(contexts or self.ae.requested_contexts)
+        if (
+            VerificationSOPClass not in [cx.abstract_syntax for cx in contexts]
+            and len(contexts) < MAX_CONTEXTS
+        ):
+            contexts.append(build_context(VerificationSOPClass))
+
+        key = (addr, port, ae_title, _contexts_key(contexts))
+        while True:
+            with self._lock:
+                idle = self._idle.get(key, [])
+                if not idle:
+                    break
+
+                assoc, since = idle.pop()
+
+            if self._is_usable(assoc, since):
+                with self._lock:
+                    self._keys[assoc] = key
+
+                return assoc
+
+        assoc = self.ae.associate(
+            addr, port, contexts=contexts, ae_title=ae_title
+        )
+        if assoc.is_established:
+            with self._lock:
+                self._keys[assoc] = key
+
+        return assoc
+
+    def release(self, assoc):
+        """Return `assoc` to the pool.
+
+        If the association is no longer established (or the pool is full) it's
+        not kept, so the next ``acquire()`` will request a new one.
+        """
+        with self._lock:
+            key = self._keys.pop(assoc, None)
+            if (key is not None and assoc.is_established
+                    and not self._closed.is_set()):
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append((assoc, time.time()))
+                    return
+
+        if assoc.is_established:
+            assoc.release()
+
+    @contextmanager
+    def association(self, addr, port, ae_title=b'ANY-SCP', contexts=None):
+        """Context manager for ``acquire()`` and ``release()``."""
+        assoc = self.acquire(addr, port, ae_title, contexts)
+        try:
+            yield assoc
+        finally:
+            self.release(assoc)
+
+    def close(self):
+        """Release all the idle associations and stop pooling."""
+        self._closed.set()
+        with self._lock:
+            idle = [aa for items in self._idle.values() for aa, _ in items]
+            self._idle = {}
+
+        for assoc in idle:
+            if assoc.is_established:
+                assoc.release()
+
+    def _is_usable(self, assoc, since):
+        """Return ``True`` if the idle `assoc` can be handed out again."""
+        if not assoc.is_established:
+            return False
+
+        idle_for = time.time() - since
+        if idle_for > self.idle_timeout:
+            assoc.release()
+            return False
+
+        if idle_for <= self.check_after:
+            return True
+
+        accepted = [cx.abstract_syntax for cx in assoc.accepted_contexts]
+        if VerificationSOPClass in accepted:
+            status = assoc.send_c_echo()
+            usable = bool(status) and status.Status == 0x0000
+        else:
+            # No C-ECHO is possible, so check the connection instead
+            usable = assoc.is_alive() and _is_connected(assoc)
+
+        if not usable:
+            # The peer has gone away or isn't responding properly
+            assoc.abort()
+
+        return usable
+
+    def _reap(self):
+        """Release associations that have been idle for too long."""
+        while not self._closed.wait(max(self.idle_timeout / 2, 1)):
+            now = time.time()
+            expired = []
+            with self._lock:
+                for key, idle in self._idle.items():
+                    keep = []
+                    for assoc, since in idle:
+                        if now - since > self.idle_timeout:
+                            expired.append(assoc)
+                        elif assoc.is_established:
+                            keep.append((assoc, since))
+
+                    idle[:] = keep
+
+            for assoc in expired:
+                if assoc.is_established:
+                    assoc.release()
@@ -0,0 +1,170 @@
+"""
+An asyncio interface to the pynetdicom SCU services.
+
+pynetdicom's associations are blocking, so each ``AsyncAssociation`` runs its
+association's requests on a thread of its own and hands the results back to
+the event loop. Requests on the same association are run one at a time, in
+the order they're made, but any number of associations can be in use at once
+without blocking the loop.
+
+    assoc = await associate(ae, '127.0.0.1', 11112)
+    if assoc.is_established:
+        status = await assoc.send_c_echo()
+        async for status, identifier in assoc.send_c_find(ds, query_model):
+            ...
+        await assoc.release()
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+
+# Marks the end of the responses from a C-FIND, C-GET or C-MOVE
+_DONE = object()
+
+
+async def associate(ae, addr, port, **kwargs):
+    """Request an association with a peer and return an ``AsyncAssociation``.
+
+    Takes the same parameters as ``AE.associate()``, the returned association
+    may not have been established.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+    try:
+        assoc = await loop.run_in_executor(
+            executor, functools.partial(ae.associate, addr, port, **kwargs)
+        )
+    except BaseException:
+        executor.shutdown(wait=False)
+        raise
+
+    # Nothing more can be sent if the association was rejected, aborted or
+    #   never connected, so don't keep its thread around
+    if not assoc.is_established:
+        executor.shutdown(wait=False)
+
+    return AsyncAssociation(assoc, executor)
+
+
+class AsyncAssociation(object):
+    """An association whose requests can be awaited.
+
+    Parameters
+    ----------
+    assoc : association.Association
+        The association to wrap.
+    executor : concurrent.futures.ThreadPoolExecutor, optional
+        The single thread executor to run the association's requests on.
+    """
+    def __init__(self, assoc, executor=None):
+        self.assoc = assoc
+        self._executor = executor or ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def is_established(self):
+        """Return ``True`` if the association is established."""
+        return self.assoc.is_established
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call on the association's thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _iterate(self, func, *args, **kwargs):
+        """Yield the responses of a blocking generator as they arrive."""
+        loop = asyncio.get_running_loop()
+        responses = asyncio.Queue()
+
+        def _drain():
+            # The remaining responses must still be read even if the
+            #   consumer stops early, otherwise the association is left
+            #   in an unusable state
+            try:
+                for rsp in func(*args, **kwargs):
+                    loop.call_soon_threadsafe(responses.put_nowait, rsp)
+            except Exception as exc:
+                loop.call_soon_threadsafe(responses.put_nowait, exc)
+
+            loop.call_soon_threadsafe(responses.put_nowait, _DONE)
+
+        self._executor.submit(_drain)
+        while True:
+            rsp = await responses.get()
+            if rsp is _DONE:
+                return
+
+            if isinstance(rsp, Exception):
+                raise rsp
+
+            yield rsp
+
+    async def release(self):
+        """Release the association."""
+        if self.assoc.is_established:
+            await self._run(self.assoc.release)
+
+        self._executor.shutdown(wait=False)
+
+    async def abort(self):
+        """Abort the association."""
+        if self.assoc.is_established:
+            await self._run(self.assoc.abort)
+
+        self._executor.shutdown(wait=False)
+
+    # DIMSE-C services
+    async def send_c_echo(self, **kwargs):
+        """Send a C-ECHO request and return the response status."""
+        return await self._run(self.assoc.send_c_echo, **kwargs)
+
+    async def send_c_store(self, dataset, **kwargs):
+        """Send a C-STORE request and return the response status."""
+        return await self._run(self.assoc.send_c_store, dataset, **kwargs)
+
+    def send_c_find(self, dataset, query_model, **kwargs):
+        """Send a C-FIND request, yields (status, identifier) responses."""
+        return self._iterate(
+            self.assoc.send_c_find, dataset, query_model, **kwargs
+        )
+
+    def send_c_get(self, dataset, query_model, **kwargs):
+        """Send a C-GET request, yields (status, identifier) responses."""
+        return self._iterate(
+            self.assoc.send_c_get, dataset, query_model, **kwargs
+        )
+
+    def send_c_move(self, dataset, move_aet, query_model, **kwargs):
+        """Send a C-MOVE request, yields (status, identifier) responses."""
+        return self._iterate(
+            self.assoc.send_c_move, dataset, move_aet, query_model, **kwargs
+        )
+
+    # DIMSE-N services
+    async def send_n_action(self, *args, **kwargs):
+        """Send an N-ACTION request, returns (status, action reply)."""
+        return await self._run(self.assoc.send_n_action, *args, **kwargs)
+
+    async def send_n_create(self, *args, **kwargs):
+        """Send an N-CREATE request, returns (status, attribute list)."""
+        return await self._run(self.assoc.send_n_create, *args, **kwargs)
+
+    async def send_n_delete(self, *args, **kwargs):
+        """Send an N-DELETE request and return the response status."""
+        return await self._run(self.assoc.send_n_delete, *args, **kwargs)
+
+    async def send_n_event_report(self, *args, **kwargs):
+        """Send an N-EVENT-REPORT request, returns (status, event reply)."""
+        return await self._run(
+            self.assoc.send_n_event_report, *args, **kwargs
+        )
+
+    async def send_n_get(self, *args, **kwargs):
+        """Send an N-GET request, returns (status, attribute list)."""
+        return await self._run(self.assoc.send_n_get, *args, **kwargs)
+
+    async def send_n_set(self, *args, **kwargs):
+        """Send an N-SET request, returns (status, attribute list)."""
+        return await self._run(self.assoc.send_n_set, *args, **kwargs)
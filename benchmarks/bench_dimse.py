@@ -0,0 +1,652 @@
+"""
+Benchmark the DIMSE services over loopback with synthetic datasets.
+
+Each benchmark starts an SCP with the same handler and helpers as the
+matching example SCP, then times an SCU using it on 127.0.0.1:
+
+* ``c_echo``: C-ECHO requests on a single association, and associations
+  opened and released per second
+* ``c_store``: instances and MB stored per second, by `--associations`
+  concurrent SCUs, written and indexed as by Storage_SCP.py
+* ``c_find_*``: C-FIND responses per second against an index of each of the
+  `--archive` sizes, both with the response cache cleared before every
+  query and with it warm, as by Query_Retrive_SCP.py
+* ``c_get``: the end-to-end time to retrieve all the instances stored by
+  the ``c_store`` benchmark, as by Query_Retrieve_GET_SCP.py
+
+pynetdicom's standard debug logging handlers are turned off so they don't
+dominate the timings. The results can be saved as JSON and compared with a
+previous run, any rate that's worse by more than `--threshold` percent is
+reported as a regression and the exit status is 1.
+
+Usage::
+
+    python benchmarks/bench_dimse.py --output baseline.json
+    python benchmarks/bench_dimse.py --archive 10000 1000000 \\
+        --compare baseline.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import queue
+import sys
+import tempfile
+import threading
+import time
+
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, PYDICOM_ROOT_UID
+
+import pynetdicom
+from pynetdicom import (
+    AE, evt, build_role, StoragePresentationContexts, _config
+)
+from pynetdicom.dsutils import encode
+from pynetdicom.sop_class import (
+    CTImageStorage,
+    PatientRootQueryRetrieveInformationModelFind,
+    PatientRootQueryRetrieveInformationModelGet,
+    VerificationSOPClass,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive_index import ArchiveIndex, INDEX_KEYS
+from dataset_loader import iter_instances
+from find_cache import FindCache, pre_encode
+from matching import compile_query
+from offload import read_keys
+from storage_layout import HashedLayout
+from storage_writer import StorageWriter, write_raw
+
+
+# The stored instances all belong to this patient, study and series
+PATIENT_ID = 'BENCH'
+STUDY_UID = PYDICOM_ROOT_UID + '1.1'
+SERIES_UID = PYDICOM_ROOT_UID + '1.1.1'
+
+# The attributes stored in the index
+KEYWORDS = [keyword for _, keyword, _ in INDEX_KEYS]
+
+
+def build_instance(size):
+    """Return a CT Image with about `size` bytes of Pixel Data."""
+    side = max(1, int(math.sqrt(size // 2)))
+
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = PYDICOM_ROOT_UID + '1.1.1.0'
+    ds.PatientName = 'BENCH^Patient'
+    ds.PatientID = PATIENT_ID
+    ds.StudyInstanceUID = STUDY_UID
+    ds.StudyDate = '20200101'
+    ds.SeriesInstanceUID = SERIES_UID
+    ds.Modality = 'CT'
+    ds.InstanceNumber = 1
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.Rows = side
+    ds.Columns = side
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = os.urandom(side * side * 2)
+
+    return ds
+
+
+def start_scp(ae, handlers):
+    """Start `ae` listening on a free loopback port.
+
+    Returns the server and the port it's listening on.
+    """
+    server = ae.start_server(
+        ('127.0.0.1', 0), block=False, evt_handlers=handlers
+    )
+    return server, server.server_address[1]
+
+
+def make_ae(args):
+    """Return an AE with the maximum PDU size to use."""
+    ae = AE()
+    ae.maximum_pdu_size = args.max_pdu
+    return ae
+
+
+def _check(assoc):
+    """Raise ``RuntimeError`` if `assoc` wasn't established."""
+    if not assoc.is_established:
+        raise RuntimeError('Association rejected, aborted or never connected')
+
+
+# C-ECHO
+def bench_echo(args):
+    """Return the C-ECHO and association results."""
+    scp = make_ae(args)
+    scp.add_supported_context(VerificationSOPClass)
+    server, port = start_scp(scp, [])
+
+    scu = make_ae(args)
+    scu.add_requested_context(VerificationSOPClass)
+    try:
+        assoc = scu.associate('127.0.0.1', port)
+        _check(assoc)
+        start = time.perf_counter()
+        for _ in range(args.echoes):
+            status = assoc.send_c_echo()
+            if status.Status != 0x0000:
+                raise RuntimeError('C-ECHO failed')
+
+        echo = time.perf_counter() - start
+        assoc.release()
+
+        nr_assocs = max(10, args.echoes // 10)
+        start = time.perf_counter()
+        for _ in range(nr_assocs):
+            assoc = scu.associate('127.0.0.1', port)
+            _check(assoc)
+            assoc.release()
+
+        setup = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    return {
+        'c_echo': {
+            'seconds': echo,
+            'ops_per_s': args.echoes / echo,
+        },
+        'association': {
+            'seconds': setup,
+            'ops_per_s': nr_assocs / setup,
+        },
+    }
+
+
+# C-STORE
+def bench_store(args, tdir):
+    """Return the C-STORE results and the index of the stored instances."""
+    index = ArchiveIndex(os.path.join(tdir, 'archive_index.sqlite'))
+    layout = HashedLayout(os.path.join(tdir, 'archive'), depth=2, width=2)
+    writer = StorageWriter(workers=4, max_queue=64)
+
+    def handle_store(event):
+        req = event.request
+        file_meta = event.file_meta
+        fpath = layout.path_for(req.AffectedSOPInstanceUID)
+        try:
+            written = writer.submit(
+                fpath,
+                lambda fp: write_raw(fp, file_meta, req.DataSet),
+                timeout=10
+            )
+        except queue.Full:
+            # Failure - Out of Resources
+            return 0xA700
+
+        keys = read_keys(
+            req.DataSet.getbuffer(), event.context.transfer_syntax, KEYWORDS
+        )
+        written.result()
+        index.add(fpath, keys)
+
+        return 0x0000
+
+    scp = make_ae(args)
+    scp.maximum_associations = max(10, args.associations)
+    scp.supported_contexts = StoragePresentationContexts
+    server, port = start_scp(scp, [(evt.EVT_C_STORE, handle_store)])
+
+    template = build_instance(args.size * 1024)
+    nr_bytes = len(encode(template, False, True))
+    failures = []
+
+    def send(first, last):
+        ds = build_instance(args.size * 1024)
+        scu = make_ae(args)
+        scu.add_requested_context(CTImageStorage, ExplicitVRLittleEndian)
+        assoc = scu.associate('127.0.0.1', port)
+        if not assoc.is_established:
+            failures.append('association')
+            return
+
+        for nr in range(first, last):
+            ds.SOPInstanceUID = '{}1.1.1.{}'.format(PYDICOM_ROOT_UID, nr + 1)
+            ds.InstanceNumber = nr + 1
+            status = assoc.send_c_store(ds)
+            if not status or status.Status != 0x0000:
+                failures.append(nr)
+
+        assoc.release()
+
+    # Split the instances between the SCUs
+    bounds = [
+        args.count * ii // args.associations
+        for ii in range(args.associations + 1)
+    ]
+    threads = [
+        threading.Thread(target=send, args=(first, last))
+        for first, last in zip(bounds[:-1], bounds[1:])
+    ]
+    try:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        writer.shutdown()
+
+    if failures:
+        raise RuntimeError(
+            '{} C-STORE operations failed'.format(len(failures))
+        )
+
+    return {
+        'c_store': {
+            'seconds': elapsed,
+            'instances_per_s': args.count / elapsed,
+            'mb_per_s': args.count * nr_bytes / elapsed / 1024**2,
+        },
+    }, index
+
+
+# C-FIND
+def populate_index(index, nr_instances, per_study):
+    """Add `nr_instances` entries to `index` without creating any files.
+
+    The instances are `per_study` to a study, with one patient per study.
+    """
+    columns = ['path', 'mtime'] + [col for col, _, _ in INDEX_KEYS]
+    sql = 'INSERT INTO instances ({}) VALUES ({})'.format(
+        ', '.join(columns), ', '.join('?' * len(columns))
+    )
+
+    def rows(first, last):
+        for nr in range(first, last):
+            study, image = divmod(nr, per_study)
+            keys = {
+                'PatientID': 'P{:07d}'.format(study),
+                'PatientName': 'BENCH^{:07d}'.format(study),
+                'PatientBirthDate': '19700101',
+                'PatientSex': 'O',
+                'StudyInstanceUID': '{}2.{}'.format(PYDICOM_ROOT_UID, study),
+                'StudyDate': '2020{:02d}{:02d}'.format(
+                    study % 12 + 1, study % 28 + 1
+                ),
+                'StudyTime': '120000',
+                'AccessionNumber': 'A{:07d}'.format(study),
+                'StudyID': str(study),
+                'StudyDescription': 'Benchmark',
+                'SeriesInstanceUID': '{}2.{}.1'.format(
+                    PYDICOM_ROOT_UID, study
+                ),
+                'SeriesNumber': '1',
+                'Modality': 'CT',
+                'SOPInstanceUID': '{}2.{}.1.{}'.format(
+                    PYDICOM_ROOT_UID, study, image
+                ),
+                'SOPClassUID': CTImageStorage,
+                'InstanceNumber': str(image + 1),
+            }
+            yield (
+                ['/nonexistent/{}.dcm'.format(nr), 0]
+                + [keys[keyword] for keyword in KEYWORDS]
+            )
+
+    # Insert in batches so the whole archive is never held in memory
+    batch = 50000
+    for first in range(0, nr_instances, batch):
+        last = min(first + batch, nr_instances)
+        with index._lock, index._conn:
+            index._conn.executemany(sql, rows(first, last))
+            index._changed()
+
+
+def bench_find(args, tdir, nr_instances):
+    """Return the C-FIND results for an archive of `nr_instances`."""
+    db_path = os.path.join(tdir, 'find_{}.sqlite'.format(nr_instances))
+    index = ArchiveIndex(db_path)
+    populate_index(index, nr_instances, args.per_study)
+    cache = FindCache()
+
+    def handle_find(event):
+        ds = event.identifier
+        plan = compile_query(ds)
+        transfer_syntax = event.context.transfer_syntax
+
+        def build():
+            matching = index.query(
+                plan, distinct=True, keywords=plan.return_keys
+            )
+            return (
+                pre_encode(plan.response(instance), transfer_syntax)
+                for _, instance in matching
+            )
+
+        responses = cache.responses(
+            cache.key(ds, transfer_syntax), index.generation, build,
+            lambda: index.generation
+        )
+        for response in responses:
+            if event.is_cancelled:
+                yield (0xFE00, None)
+                return
+
+            yield (0xFF00, response)
+
+    scp = make_ae(args)
+    scp.add_supported_context(PatientRootQueryRetrieveInformationModelFind)
+    server, port = start_scp(scp, [(evt.EVT_C_FIND, handle_find)])
+
+    scu = make_ae(args)
+    scu.add_requested_context(PatientRootQueryRetrieveInformationModelFind)
+
+    def find(assoc, ds):
+        """Return the number of matches for the query `ds`."""
+        nr_matches = 0
+        responses = assoc.send_c_find(
+            ds, PatientRootQueryRetrieveInformationModelFind
+        )
+        for status, _ in responses:
+            if not status:
+                raise RuntimeError('C-FIND timed out or was aborted')
+
+            if status.Status in (0xFF00, 0xFF01):
+                nr_matches += 1
+            elif status.Status != 0x0000:
+                raise RuntimeError('C-FIND failed')
+
+        return nr_matches
+
+    def timed(queries, clear):
+        """Return the (seconds, responses) to run `queries`."""
+        assoc = scu.associate('127.0.0.1', port)
+        _check(assoc)
+        elapsed = 0
+        nr_responses = 0
+        for ds in queries:
+            if clear:
+                cache.clear()
+
+            start = time.perf_counter()
+            nr_responses += find(assoc, ds)
+            elapsed += time.perf_counter() - start
+
+        assoc.release()
+        return elapsed, nr_responses
+
+    # Every study, matched by wildcard
+    studies = Dataset()
+    studies.QueryRetrieveLevel = 'STUDY'
+    studies.PatientName = 'BENCH^*'
+    studies.PatientID = ''
+    studies.StudyInstanceUID = ''
+    studies.StudyDate = ''
+    studies.AccessionNumber = ''
+
+    # Every image of a different study each time
+    nr_studies = max(1, nr_instances // args.per_study)
+    images = []
+    for ii in range(args.repeats):
+        study = ii * nr_studies // args.repeats
+        ds = Dataset()
+        ds.QueryRetrieveLevel = 'IMAGE'
+        ds.PatientID = 'P{:07d}'.format(study)
+        ds.StudyInstanceUID = '{}2.{}'.format(PYDICOM_ROOT_UID, study)
+        ds.SeriesInstanceUID = '{}2.{}.1'.format(PYDICOM_ROOT_UID, study)
+        ds.SOPInstanceUID = ''
+        ds.InstanceNumber = ''
+        images.append(ds)
+
+    results = {}
+    try:
+        for name, queries, clear in [
+            ('c_find_studies', [studies] * args.repeats, True),
+            ('c_find_studies_cached', [studies] * args.repeats, False),
+            ('c_find_images', images, True),
+        ]:
+            elapsed, nr_responses = timed(queries, clear)
+            results['{}_{}'.format(name, nr_instances)] = {
+                'seconds': elapsed,
+                'responses_per_s': nr_responses / elapsed,
+            }
+    finally:
+        server.shutdown()
+        index.close()
+
+    return results
+
+
+# C-GET
+def bench_get(args, index):
+    """Return the C-GET results for retrieving the stored instances."""
+    def handle_get(event):
+        plan = compile_query(event.identifier)
+        matching = [fpath for fpath, _ in index.query(plan)]
+        yield len(matching)
+
+        instances = iter_instances(matching)
+        for instance in instances:
+            if event.is_cancelled:
+                instances.close()
+                yield (0xFE00, None)
+                return
+
+            yield (0xFF00, instance)
+
+    scp = make_ae(args)
+    scp.supported_contexts = StoragePresentationContexts
+    for cx in scp.supported_contexts:
+        cx.scp_role = True
+        cx.scu_role = False
+
+    scp.add_supported_context(PatientRootQueryRetrieveInformationModelGet)
+    server, port = start_scp(scp, [(evt.EVT_C_GET, handle_get)])
+
+    # The retrieved instances are counted but not kept
+    received = [0, 0]
+
+    def handle_store(event):
+        received[0] += 1
+        received[1] += len(event.request.DataSet.getbuffer())
+        return 0x0000
+
+    scu = make_ae(args)
+    scu.add_requested_context(PatientRootQueryRetrieveInformationModelGet)
+    scu.add_requested_context(CTImageStorage, ExplicitVRLittleEndian)
+    role = build_role(CTImageStorage, scp_role=True)
+
+    ds = Dataset()
+    ds.QueryRetrieveLevel = 'SERIES'
+    ds.PatientID = PATIENT_ID
+    ds.StudyInstanceUID = STUDY_UID
+    ds.SeriesInstanceUID = SERIES_UID
+
+    try:
+        assoc = scu.associate(
+            '127.0.0.1', port, ext_neg=[role],
+            evt_handlers=[(evt.EVT_C_STORE, handle_store)]
+        )
+        _check(assoc)
+        start = time.perf_counter()
+        responses = assoc.send_c_get(
+            ds, PatientRootQueryRetrieveInformationModelGet
+        )
+        for status, _ in responses:
+            if not status:
+                raise RuntimeError('C-GET timed out or was aborted')
+
+        elapsed = time.perf_counter() - start
+        assoc.release()
+    finally:
+        server.shutdown()
+
+    if received[0] != args.count:
+        raise RuntimeError(
+            'Only {} of {} instances were retrieved'.format(
+                received[0], args.count
+            )
+        )
+
+    return {
+        'c_get': {
+            'seconds': elapsed,
+            'instances_per_s': received[0] / elapsed,
+            'mb_per_s': received[1] / elapsed / 1024**2,
+        },
+    }
+
+
+# Reporting
+def is_rate(metric):
+    """Return ``True`` if a higher value of `metric` is better."""
+    return metric.endswith('_per_s')
+
+
+def compare(results, previous, threshold):
+    """Print the change from `previous` and return any regressions."""
+    regressions = []
+    print('')
+    print('{:<32} {:>18} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'metric', 'previous', 'current', 'change'
+    ))
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            before = previous.get(name, {}).get(metric)
+            if not is_rate(metric) or not before:
+                continue
+
+            change = (value - before) / before * 100
+            flag = ''
+            if change < -threshold:
+                flag = ' *'
+                regressions.append((name, metric, change))
+
+            print('{:<32} {:>18} {:>12.1f} {:>12.1f} {:>+7.1f}%{}'.format(
+                name, metric, before, value, change, flag
+            ))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the DIMSE services over loopback'
+    )
+    parser.add_argument(
+        '--echoes', type=int, default=1000,
+        help='the number of C-ECHO requests (default 1000)'
+    )
+    parser.add_argument(
+        '--count', type=int, default=200,
+        help='the number of instances stored and retrieved (default 200)'
+    )
+    parser.add_argument(
+        '--size', type=int, default=512,
+        help='the size of each instance in KiB (default 512)'
+    )
+    parser.add_argument(
+        '--associations', type=int, default=1,
+        help='the number of concurrent C-STORE SCUs (default 1)'
+    )
+    parser.add_argument(
+        '--archive', type=int, nargs='+', default=[10000],
+        help='the number of indexed instances to C-FIND (default 10000)'
+    )
+    parser.add_argument(
+        '--per-study', type=int, default=100,
+        help='the number of instances per study in the archive (default 100)'
+    )
+    parser.add_argument(
+        '--repeats', type=int, default=5,
+        help='the number of times each C-FIND query is run (default 5)'
+    )
+    parser.add_argument(
+        '--max-pdu', type=int, default=16382,
+        help='the maximum PDU size of both AEs (default 16382)'
+    )
+    parser.add_argument(
+        '--only', nargs='+', choices=['echo', 'store', 'find', 'get'],
+        help='only run these benchmarks (get also runs store)'
+    )
+    parser.add_argument('--output', help='save the results to this file')
+    parser.add_argument(
+        '--compare', help='compare the results with this previous output'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=10,
+        help='the percentage slowdown reported as a regression (default 10)'
+    )
+    args = parser.parse_args(argv)
+    only = set(args.only or ['echo', 'store', 'find', 'get'])
+
+    # Don't time pynetdicom's debug logging
+    _config.LOG_HANDLER_LEVEL = 'none'
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tdir:
+        if 'echo' in only:
+            results.update(bench_echo(args))
+
+        if only & {'store', 'get'}:
+            store, index = bench_store(args, tdir)
+            results.update(store)
+            if 'get' in only:
+                results.update(bench_get(args, index))
+
+            index.close()
+
+        if 'find' in only:
+            for nr_instances in args.archive:
+                results.update(bench_find(args, tdir, nr_instances))
+
+    for name, metrics in sorted(results.items()):
+        print('{:<32} {}'.format(name, '  '.join(
+            '{} {:.2f}'.format(metric, value)
+            for metric, value in sorted(metrics.items())
+        )))
+
+    if args.output:
+        output = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'pydicom': pydicom.__version__,
+            'pynetdicom': pynetdicom.__version__,
+            'parameters': vars(args),
+            'results': results,
+        }
+        with open(args.output, 'w') as fp:
+            json.dump(output, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            previous = json.load(fp)['results']
+
+        regressions = compare(results, previous, args.threshold)
+        if regressions:
+            print('')
+            print('{} regression(s) of more than {}%'.format(
+                len(regressions), args.threshold
+            ))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
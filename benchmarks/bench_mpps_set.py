@@ -0,0 +1,92 @@
+"""
+Benchmark the cost of an MPPS N-SET as the procedure step grows.
+
+A procedure step is created with a Performed Series Sequence referencing an
+increasing number of images, then a small N-SET is applied to it. With the
+delta-based store the time per N-SET should stay the same however many
+images are referenced, unlike applying the N-SET and rewriting (and
+returning) the whole instance.
+
+Usage::
+
+    python benchmarks/bench_mpps_set.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+from pydicom.dataset import Dataset
+from pydicom.uid import generate_uid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mpps_store import MPPSStore, _encode
+
+
+# The number of N-SETs timed for each size
+REPEATS = 20
+
+# The number of referenced images in the Performed Series Sequence
+SIZES = [10, 100, 1000, 5000]
+
+
+def build_instance(nr_images):
+    """Return an in-progress MPPS instance referencing `nr_images` images."""
+    ds = Dataset()
+    ds.SOPClassUID = '1.2.840.10008.3.1.2.3.3'
+    ds.SOPInstanceUID = generate_uid()
+    ds.PerformedProcedureStepStatus = 'IN PROGRESS'
+    ds.PerformedSeriesSequence = [Dataset()]
+    series = ds.PerformedSeriesSequence[0]
+    series.SeriesInstanceUID = generate_uid()
+    series.ReferencedImageSequence = []
+    for _ in range(nr_images):
+        item = Dataset()
+        item.ReferencedSOPClassUID = '1.2.840.10008.5.1.4.1.1.2'
+        item.ReferencedSOPInstanceUID = generate_uid()
+        series.ReferencedImageSequence.append(item)
+
+    return ds
+
+
+def build_mod_list():
+    """Return a small N-SET *Modification List*."""
+    ds = Dataset()
+    ds.PerformedProcedureStepDescription = 'Some description'
+    return ds
+
+
+def time_delta_store(store, uid):
+    """Return the mean seconds for an N-SET using the delta-based store."""
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        store.update(uid, build_mod_list())
+
+    return (time.perf_counter() - start) / REPEATS
+
+
+def time_full_rewrite(ds):
+    """Return the mean seconds for an N-SET that re-encodes the instance."""
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        ds.update(build_mod_list())
+        # Written to the store and encoded again for the response
+        _encode(ds)
+        _encode(ds)
+
+    return (time.perf_counter() - start) / REPEATS
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tdir:
+        store = MPPSStore(os.path.join(tdir, 'mpps.sqlite'))
+        print('{:>8}  {:>14}  {:>14}'.format('images', 'delta (ms)', 'full (ms)'))
+        for nr_images in SIZES:
+            ds = build_instance(nr_images)
+            store.create(ds)
+            delta = time_delta_store(store, ds.SOPInstanceUID)
+            full = time_full_rewrite(build_instance(nr_images))
+            print('{:>8}  {:>14.3f}  {:>14.3f}'.format(
+                nr_images, delta * 1000, full * 1000
+            ))
@@ -0,0 +1,296 @@
+"""
+Send a directory (or list) of DICOM files to a Storage SCP over several
+concurrent associations.
+
+The files are first grouped by SOP Class and Transfer Syntax so that only the
+presentation contexts that are actually needed are requested, one for each
+group as the peer only accepts one transfer syntax per context. If that's
+more than can be requested in one association then the groups are sent in
+batches, each over its own associations. The files are then shared between
+`associations` worker threads, each with its own association to the peer.
+Each worker reads the next file while the current one is being sent, failed
+instances are retried (on a new association if the old one was aborted) and
+a throughput summary is returned at the end.
+
+Usage::
+
+    python bulk_store.py /path/to/directory 127.0.0.1 11112 -n 4
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pydicom.errors import InvalidDicomError
+
+from pynetdicom import AE, build_context
+from pynetdicom.status import code_to_category
+
+from dataset_loader import read_header, read_instance
+from storage_layout import iter_files
+
+
+# The maximum number of presentation contexts in an association request
+MAX_CONTEXTS = 128
+
+
+def group_files(paths):
+    """Return the files in `paths` grouped by (SOP Class, Transfer Syntax).
+
+    Returns
+    -------
+    dict
+        {(SOP Class UID, Transfer Syntax UID): [path, ...]}, files that aren't
+        DICOM are left out.
+    """
+    groups = {}
+    for path in paths:
+        try:
+            ds = read_header(path, ['SOPClassUID'])
+        except (InvalidDicomError, OSError):
+            continue
+
+        key = (ds.SOPClassUID, ds.file_meta.TransferSyntaxUID)
+        groups.setdefault(key, []).append(path)
+
+    return groups
+
+
+def build_contexts(groups):
+    """Return the presentation contexts needed to send `groups`.
+
+    Each (SOP Class, Transfer Syntax) group gets its own context, so the
+    peer can accept or reject each transfer syntax separately.
+
+    Raises ``ValueError`` if more than 128 contexts would be needed.
+    """
+    if len(groups) > MAX_CONTEXTS:
+        raise ValueError(
+            "The files need {} presentation contexts, the maximum is {}"
+            .format(len(groups), MAX_CONTEXTS)
+        )
+
+    return [
+        build_context(sop_class, transfer_syntax)
+        for sop_class, transfer_syntax in sorted(groups)
+    ]
+
+
+def split_groups(groups):
+    """Return `groups` split into batches that each fit one association.
+
+    Returns
+    -------
+    list of dict
+        The groups split so that each needs at most 128 presentation
+        contexts.
+    """
+    keys = sorted(groups)
+    return [
+        {key: groups[key] for key in keys[ii:ii + MAX_CONTEXTS]}
+        for ii in range(0, len(keys), MAX_CONTEXTS)
+    ]
+
+
+class BulkSender(object):
+    """Send files to a Storage SCP over several concurrent associations.
+
+    Parameters
+    ----------
+    addr : str
+        The peer's IP address.
+    port : int
+        The peer's listen port.
+    ae_title : bytes, optional
+        The peer's AE title (default ``b'ANY-SCP'``).
+    associations : int, optional
+        The number of concurrent associations (default ``4``).
+    retries : int, optional
+        The number of times a failed instance is resent (default ``2``).
+    """
+    def __init__(self, addr, port, ae_title=b'ANY-SCP', associations=4,
+                 retries=2):
+        self.addr = addr
+        self.port = port
+        self.ae_title = ae_title
+        self.associations = associations
+        self.retries = retries
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._sent = 0
+        self._bytes = 0
+        self._failed = []
+
+    def send(self, paths):
+        """Send the files in `paths` and return a summary of the transfer.
+
+        Parameters
+        ----------
+        paths : str or list of str
+            A directory containing the files to send (searched recursively)
+            or a list of file paths.
+
+        Returns
+        -------
+        dict
+            The number of instances ``sent``, the ``failed`` paths, the
+            ``bytes`` sent, the ``seconds`` taken and the ``instances_per_s``
+            and ``mb_per_s`` throughput.
+        """
+        if isinstance(paths, str):
+            paths = list(iter_files(paths))
+
+        # The summary is of this call only
+        self._sent = 0
+        self._bytes = 0
+        self._failed = []
+
+        start = time.time()
+        for groups in split_groups(group_files(paths)):
+            self._send_groups(groups)
+
+        elapsed = max(time.time() - start, 1e-6)
+
+        return {
+            'sent': self._sent,
+            'failed': self._failed,
+            'bytes': self._bytes,
+            'seconds': elapsed,
+            'instances_per_s': self._sent / elapsed,
+            'mb_per_s': self._bytes / elapsed / 1024 / 1024,
+        }
+
+    def _send_groups(self, groups):
+        """Send the files in `groups` over up to `associations` workers."""
+        ae = AE()
+        ae.requested_contexts = build_contexts(groups)
+
+        for group in groups.values():
+            for path in group:
+                self._queue.put((path, 0))
+                self._remaining += 1
+
+        workers = [
+            threading.Thread(target=self._run, args=(ae, ))
+            for _ in range(min(self.associations, self._remaining))
+        ]
+        for thread in workers:
+            thread.start()
+
+        for thread in workers:
+            thread.join()
+
+    def _take(self, block=True):
+        """Return the next (path, attempt) or ``None`` when all are done.
+
+        If `block` is ``False`` then return ``None`` if nothing is queued.
+        """
+        while True:
+            with self._lock:
+                if self._remaining == 0:
+                    return None
+
+            try:
+                return self._queue.get(block, timeout=0.1)
+            except queue.Empty:
+                if not block:
+                    return None
+
+    def _done(self, path, attempt, success):
+        """Record the result of sending `path`, requeueing it on failure."""
+        with self._lock:
+            if success:
+                self._sent += 1
+                self._bytes += os.path.getsize(path)
+            elif attempt < self.retries:
+                self._queue.put((path, attempt + 1))
+                return
+            else:
+                self._failed.append(path)
+
+            self._remaining -= 1
+
+    def _run(self, ae):
+        """Send files over one association until there are none left."""
+        reader = ThreadPoolExecutor(max_workers=1)
+        assoc = None
+
+        item = self._take()
+        future = reader.submit(read_instance, item[0]) if item else None
+        while item:
+            # Start reading the next file while this one is sent
+            next_item = self._take(block=False)
+            next_future = None
+            if next_item:
+                next_future = reader.submit(read_instance, next_item[0])
+
+            path, attempt = item
+            try:
+                ds = future.result()
+
+                # (Re-)associate if we have no association or it was aborted
+                if assoc is None or not assoc.is_established:
+                    assoc = ae.associate(
+                        self.addr, self.port, ae_title=self.ae_title
+                    )
+
+                status = None
+                if assoc.is_established:
+                    status = assoc.send_c_store(ds)
+            except Exception:
+                status = None
+
+            success = bool(status) and (
+                code_to_category(status.Status) in ['Success', 'Warning']
+            )
+            self._done(path, attempt, success)
+
+            # Wait for any retries or the last files still being sent
+            if next_item is None:
+                next_item = self._take()
+                if next_item:
+                    next_future = reader.submit(read_instance, next_item[0])
+
+            item, future = next_item, next_future
+
+        if assoc is not None and assoc.is_established:
+            assoc.release()
+
+        reader.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Send DICOM files to a Storage SCP in bulk'
+    )
+    parser.add_argument('path', help='directory of files to send')
+    parser.add_argument('addr', help="the peer's IP address")
+    parser.add_argument('port', type=int, help="the peer's listen port")
+    parser.add_argument('-aec', '--called-aet', default='ANY-SCP')
+    parser.add_argument('-n', '--associations', type=int, default=4)
+    parser.add_argument('-r', '--retries', type=int, default=2)
+    args = parser.parse_args()
+
+    sender = BulkSender(
+        args.addr,
+        args.port,
+        ae_title=args.called_aet.encode('ascii'),
+        associations=args.associations,
+        retries=args.retries
+    )
+    summary = sender.send(args.path)
+
+    print(
+        'Sent {} instances ({:.1f} MB) in {:.1f} s: {:.1f} instances/s, '
+        '{:.1f} MB/s'.format(
+            summary['sent'], summary['bytes'] / 1024 / 1024,
+            summary['seconds'], summary['instances_per_s'],
+            summary['mb_per_s']
+        )
+    )
+    for path in summary['failed']:
+        print('Failed: {}'.format(path))
@@ -0,0 +1,125 @@
+"""
+Loading of stored SOP Instances for the Query/Retrieve SCPs.
+
+Matching a query only needs a handful of header attributes, so instances are
+first read without their Pixel Data (and with any other large values deferred
+until accessed). The full dataset, bulk data included, is only read when an
+instance is actually sent in a C-STORE sub-operation.
+"""
+import logging
+import queue
+import threading
+
+from pydicom import dcmread
+from pydicom.errors import InvalidDicomError
+
+from storage_layout import iter_files
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# Element values larger than this are left in the file until accessed
+DEFER_SIZE = '64 KB'
+
+# The number of complete datasets read ahead of the one being sent
+READ_AHEAD = 2
+
+# The attributes the Query/Retrieve SCPs match against
+MATCH_KEYWORDS = [
+    'QueryRetrieveLevel', 'SpecificCharacterSet',
+    'PatientID', 'PatientName', 'PatientBirthDate', 'PatientSex',
+    'StudyInstanceUID', 'StudyDate', 'StudyTime', 'AccessionNumber',
+    'StudyID', 'StudyDescription', 'SeriesInstanceUID', 'SeriesNumber',
+    'Modality', 'SOPInstanceUID', 'SOPClassUID', 'InstanceNumber',
+]
+
+
+def read_header(path, keywords=None):
+    """Return the dataset at `path` without its Pixel Data.
+
+    If `keywords` is used then only those elements are read.
+    """
+    return dcmread(
+        path,
+        stop_before_pixels=True,
+        defer_size=DEFER_SIZE,
+        specific_tags=keywords
+    )
+
+
+def read_instance(path):
+    """Return the complete dataset at `path`, including the bulk data."""
+    return dcmread(path)
+
+
+def iter_instances(paths, read_ahead=READ_AHEAD):
+    """Yield the complete dataset for each file in `paths`, in order.
+
+    The files are read one at a time by a background thread that stays at
+    most `read_ahead` datasets ahead of the consumer, so memory use doesn't
+    depend on how many paths there are and the first dataset is available as
+    soon as it's been read.
+
+    A file that can't be read doesn't stop the others being yielded, the
+    exception raised when reading it is yielded in place of its dataset.
+    pynetdicom counts anything yielded for a sub-operation that isn't a
+    dataset as a failed sub-operation.
+    """
+    buffer = queue.Queue(maxsize=max(read_ahead, 1))
+    stop = threading.Event()
+
+    def _put(item):
+        """Return ``False`` if the consumer went away before `item` fit."""
+        # Don't block forever if the consumer has gone away
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _reader():
+        try:
+            for path in paths:
+                try:
+                    ds = read_instance(path)
+                except Exception as exc:
+                    LOGGER.error("Unable to read '%s': %s", path, exc)
+                    ds = exc
+
+                if not _put(ds):
+                    return
+        except Exception as exc:
+            # Getting the next path failed, end with what's been read
+            LOGGER.error('Unable to get the instances to read: %s', exc)
+
+        _put(None)
+
+    thread = threading.Thread(target=_reader, name='ReadAhead')
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            ds = buffer.get()
+            if ds is None:
+                return
+
+            yield ds
+    finally:
+        # Closing the generator (e.g. after a C-CANCEL) stops the reader
+        stop.set()
+
+
+def iter_headers(fdir, keywords=None):
+    """Yield (path, header) for each DICOM file stored below `fdir`.
+
+    Files that aren't DICOM are skipped.
+    """
+    for path in iter_files(fdir):
+        try:
+            yield path, read_header(path, keywords)
+        except (InvalidDicomError, OSError):
+            continue
@@ -0,0 +1,375 @@
+"""
+A sampled, structured log of association events for busy SCPs.
+
+Logging each event as text means formatting a message on the thread that's
+handling the association, and pynetdicom's own debug logging of PDUs and
+DIMSE messages (``_config.LOG_HANDLER_LEVEL``) can only be on or off for
+everything. ``EventLog.handlers()`` instead returns notification event
+handlers that append a small tuple for each event to a fixed size ring
+buffer, and a background thread writes the records out as JSON lines every
+`flush_interval` seconds. Nothing is formatted by the handlers, and if the
+writer falls behind the oldest records are overwritten and counted as
+dropped rather than the associations being slowed down.
+
+Which records are kept can be changed while the SCP is running, either by
+calling ``configure()`` or by editing the JSON `control` file, which is
+checked for changes every time the records are written::
+
+    {
+        "events": ["EVT_ACCEPTED", "EVT_DIMSE_RECV", "EVT_ABORTED"],
+        "peers": ["192.168.1.20", "CT_SCANNER"],
+        "sample_rate": 0.1
+    }
+
+* `events`: the names of the events to log, or ``null`` for all of them
+* `peers`: the IP addresses and AE titles to log, or ``null`` for all peers
+* `sample_rate`: the fraction of associations that are logged. Whole
+  associations are sampled rather than single events, so the records for an
+  association that's logged are complete.
+
+Any of them left out of the file keep their current value. If the file
+can't be read or isn't a JSON object the error is logged and nothing is
+changed.
+
+    event_log = EventLog('events.jsonl', control='event_log.json')
+    handlers = [(evt.EVT_C_STORE, handle_store)] + event_log.handlers()
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from pynetdicom import evt
+
+from pdv_receiver import pdu_length
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# The events that can be logged and the names of their detail fields
+_FIELDS = {
+    'EVT_CONN_OPEN': ('port', ),
+    'EVT_CONN_CLOSE': (),
+    'EVT_REQUESTED': (),
+    'EVT_ACCEPTED': (),
+    'EVT_REJECTED': (),
+    'EVT_RELEASED': (),
+    'EVT_ABORTED': (),
+    'EVT_DATA_RECV': ('pdu_type', 'length'),
+    'EVT_DATA_SENT': ('pdu_type', 'length'),
+    'EVT_DIMSE_RECV': ('command', 'message_id', 'status', 'sop_class'),
+    'EVT_DIMSE_SENT': ('command', 'message_id', 'status', 'sop_class'),
+}
+
+
+def _name(event_type):
+    """Return the name of `event_type`, which may already be a name."""
+    return event_type if isinstance(event_type, str) else event_type.name
+
+
+def _aet(value):
+    """Return the AE title `value` as :class:`str`."""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='replace')
+
+    return value.strip()
+
+
+class _Peer(object):
+    """The peer of one association."""
+    __slots__ = ('address', 'ae_title', 'sampled')
+
+    def __init__(self, address, sampled):
+        self.address = address
+        self.ae_title = None
+        self.sampled = sampled
+
+
+class EventLog(object):
+    """A ring buffer of association events written to a JSON lines file.
+
+    Parameters
+    ----------
+    path : str
+        The file the records are appended to.
+    capacity : int, optional
+        The number of records the ring buffer holds (default ``65536``).
+    flush_interval : float, optional
+        The number of seconds between writing the records to file (default
+        ``1``). They're also written once the buffer is half full.
+    control : str, optional
+        The path to a JSON file with the ``configure()`` parameters, which is
+        reloaded when changed.
+    events : list of str or events.NotificationEvent, optional
+        The events to log, by default all of them.
+    peers : list of str, optional
+        The peer IP addresses and AE titles to log, by default all of them.
+    sample_rate : float, optional
+        The fraction of associations to log (default ``1``).
+    """
+    def __init__(self, path, capacity=65536, flush_interval=1, control=None,
+                 events=None, peers=None, sample_rate=1):
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.control = control
+        self.dropped = 0
+
+        # Replaced rather than changed so the handlers don't need a lock
+        self._events = frozenset(_FIELDS)
+        self._peers = None
+        self._sample_rate = 1
+        self.configure(events, peers, sample_rate)
+
+        self._lock = threading.Lock()
+        self._slots = [None] * capacity
+        # The sequence numbers of the next record to be added and written
+        self._head = 0
+        self._tail = 0
+        # {assoc: _Peer}
+        self._assocs = {}
+        self._control_mtime = None
+        self._reload()
+
+        self._wake = threading.Event()
+        self._stop = False
+        self._fp = open(path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='EventLog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def configure(self, events=None, peers=None, sample_rate=1):
+        """Change which events are logged.
+
+        Parameters
+        ----------
+        events : list of str or events.NotificationEvent, optional
+            The events to log, by default all of them.
+        peers : list of str, optional
+            The peer IP addresses and AE titles to log, by default all of
+            them.
+        sample_rate : float, optional
+            The fraction of associations to log (default ``1``), only
+            associations started after the change are affected.
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(
+                "The sample rate must be between 0 and 1, not {}"
+                .format(sample_rate)
+            )
+
+        if events is None:
+            self._events = frozenset(_FIELDS)
+        else:
+            names = set(_name(ee) for ee in events)
+            unknown = names - set(_FIELDS)
+            if unknown:
+                raise ValueError(
+                    "Events can't be logged: {}".format(
+                        ', '.join(sorted(unknown))
+                    )
+                )
+
+            self._events = frozenset(names)
+
+        self._peers = None if peers is None else frozenset(peers)
+        self._sample_rate = sample_rate
+
+    def handlers(self):
+        """Return the notification event handlers to bind."""
+        return [
+            (evt.EVT_CONN_OPEN, self._on_open),
+            (evt.EVT_CONN_CLOSE, self._on_close),
+            (evt.EVT_REQUESTED, self._on_requested),
+            (evt.EVT_ACCEPTED, self._on_event),
+            (evt.EVT_REJECTED, self._on_event),
+            (evt.EVT_RELEASED, self._on_event),
+            (evt.EVT_ABORTED, self._on_event),
+            (evt.EVT_DATA_RECV, self._on_data),
+            (evt.EVT_DATA_SENT, self._on_data),
+            (evt.EVT_DIMSE_RECV, self._on_dimse),
+            (evt.EVT_DIMSE_SENT, self._on_dimse),
+        ]
+
+    def close(self):
+        """Write any remaining records and close the file."""
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+        self._fp.close()
+
+    # Recording
+    def _peer(self, event, name):
+        """Return the _Peer for `event` if it should be logged."""
+        if name not in self._events:
+            return None
+
+        peer = self._assocs.get(event.assoc)
+        if peer is None or not peer.sampled:
+            return None
+
+        peers = self._peers
+        if (
+            peers is not None
+            and peer.address not in peers
+            and peer.ae_title not in peers
+        ):
+            return None
+
+        return peer
+
+    def _append(self, record):
+        """Add `record` to the ring buffer, overwriting the oldest if full."""
+        with self._lock:
+            if self._head - self._tail >= self.capacity:
+                self._tail += 1
+                self.dropped += 1
+
+            self._slots[self._head % self.capacity] = record
+            self._head += 1
+            if self._head - self._tail == self.capacity // 2:
+                self._wake.set()
+
+    def _on_open(self, event):
+        assoc = event.assoc
+        peer = _Peer(event.address[0], random.random() < self._sample_rate)
+        if assoc.is_requestor:
+            peer.ae_title = _aet(assoc.acceptor.ae_title)
+
+        self._assocs[assoc] = peer
+        if self._peer(event, 'EVT_CONN_OPEN'):
+            self._append((
+                time.time(), 'EVT_CONN_OPEN', peer.address, peer.ae_title,
+                event.address[1]
+            ))
+
+    def _on_close(self, event):
+        name = 'EVT_CONN_CLOSE'
+        peer = self._peer(event, name)
+        if peer:
+            self._append((time.time(), name, peer.address, peer.ae_title))
+
+        self._assocs.pop(event.assoc, None)
+
+    def _on_requested(self, event):
+        peer = self._assocs.get(event.assoc)
+        if peer is not None:
+            peer.ae_title = _aet(
+                event.assoc.requestor.primitive.calling_ae_title
+            )
+
+        self._on_event(event)
+
+    def _on_event(self, event):
+        name = event.event.name
+        peer = self._peer(event, name)
+        if peer:
+            self._append((time.time(), name, peer.address, peer.ae_title))
+
+    def _on_data(self, event):
+        name = event.event.name
+        peer = self._peer(event, name)
+        if peer:
+            data = event.data
+            self._append((
+                time.time(), name, peer.address, peer.ae_title,
+                data[0] if data else None, pdu_length(data)
+            ))
+
+    def _on_dimse(self, event):
+        name = event.event.name
+        peer = self._peer(event, name)
+        if peer:
+            cs = event.message.command_set
+            self._append((
+                time.time(), name, peer.address, peer.ae_title,
+                cs.CommandField,
+                cs.get('MessageID', cs.get('MessageIDBeingRespondedTo')),
+                cs.get('Status'),
+                cs.get('AffectedSOPClassUID')
+                or cs.get('RequestedSOPClassUID')
+            ))
+
+    # Writing
+    def _run(self):
+        """Write the records to file until closed."""
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self._reload()
+                self._flush()
+            except Exception:
+                LOGGER.exception('Unable to write the event log')
+
+            if self._stop:
+                return
+
+    def _flush(self):
+        """Write the records in the ring buffer to file."""
+        with self._lock:
+            start, end = self._tail, self._head
+            cap = self.capacity
+            records = [self._slots[ii % cap] for ii in range(start, end)]
+            self._tail = end
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            LOGGER.warning(
+                'The event log was full, %d records were dropped', dropped
+            )
+
+        if not records:
+            return
+
+        lines = []
+        for record in records:
+            line = {
+                't': round(record[0], 6),
+                'event': record[1],
+                'address': record[2],
+                'ae_title': record[3],
+            }
+            line.update(zip(_FIELDS[record[1]], record[4:]))
+            lines.append(json.dumps(line, default=str))
+
+        self._fp.write('\n'.join(lines) + '\n')
+        self._fp.flush()
+
+    def _reload(self):
+        """Reconfigure from the control file if it's changed."""
+        if not self.control:
+            return
+
+        try:
+            mtime = os.stat(self.control).st_mtime
+        except OSError:
+            return
+
+        if mtime == self._control_mtime:
+            return
+
+        self._control_mtime = mtime
+        try:
+            with open(self.control, 'r') as fp:
+                config = json.load(fp)
+
+            if not isinstance(config, dict):
+                raise ValueError('the file must contain a JSON object')
+
+            # Anything not in the file is left as it is
+            self.configure(
+                config.get('events', self._events),
+                config.get('peers', self._peers),
+                config.get('sample_rate', self._sample_rate)
+            )
+        except (OSError, TypeError, ValueError) as exc:
+            LOGGER.error(
+                "Unable to load the event log control file '%s': %s",
+                self.control, exc
+            )
+            return
+
+        LOGGER.info("Event log reconfigured from '%s'", self.control)
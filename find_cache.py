@@ -0,0 +1,177 @@
+"""
+A cache of encoded C-FIND response identifiers.
+
+Queries that are repeated over and over (such as a scanner polling its
+worklist) produce the same responses each time, so rather than matching the
+query and building and encoding a response for every match again, the
+responses are kept already encoded in the transfer syntax of the
+presentation context.
+
+A cached response is a Dataset decoded from its encoded form, so it's made
+of raw data elements, and when pynetdicom encodes it for sending the raw
+bytes are just copied. Each entry records the ``generation`` of the index it
+was built from and is ignored once the index has changed, or once it's older
+than `ttl` seconds.
+
+``FindCache.responses()`` answers a query from the cache or, if it's not
+cached, from the responses built by the handler, which are then cached::
+
+    responses = cache.responses(
+        cache.key(ds, transfer_syntax),
+        index.generation,
+        lambda: (pre_encode(rsp, transfer_syntax) for rsp in matches),
+        lambda: index.generation
+    )
+    for response in responses:
+        yield (0xFF00, response)
+"""
+from collections import OrderedDict
+from io import BytesIO
+import threading
+import time
+
+from pydicom.uid import UID
+
+from pynetdicom.dsutils import decode, encode
+
+
+def pre_encode(ds, transfer_syntax):
+    """Return `ds` as a Dataset that's already encoded in `transfer_syntax`.
+
+    Returns ``None`` if `ds` can't be encoded.
+    """
+    transfer_syntax = UID(transfer_syntax)
+    args = (
+        transfer_syntax.is_implicit_VR,
+        transfer_syntax.is_little_endian,
+        transfer_syntax.is_deflated
+    )
+    bytestream = encode(ds, *args)
+    if bytestream is None:
+        return None
+
+    encoded = decode(BytesIO(bytestream), *args)
+    # Otherwise pydicom checks for ambiguous VRs when the response is
+    #   encoded, which converts the raw elements
+    encoded.set_original_encoding(args[0], args[1], encoded._character_set)
+
+    return encoded
+
+
+class FindCache(object):
+    """A least recently used cache of C-FIND responses.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of queries to keep the responses for (default
+        ``256``).
+    ttl : float, optional
+        The number of seconds the responses are kept for (default ``30``).
+    max_responses : int, optional
+        Queries with more responses than this aren't cached (default
+        ``1000``).
+    """
+    def __init__(self, maxsize=256, ttl=30, max_responses=1000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_responses = max_responses
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(identifier, transfer_syntax):
+        """Return the cache key for a query.
+
+        The query is normalised by encoding it, so the same Identifier gives
+        the same key however its elements were added. Returns ``None`` if
+        the Identifier can't be encoded, which ``get()`` and ``put()``
+        ignore so the query isn't cached.
+        """
+        encoded = encode(identifier, False, True)
+        if encoded is None:
+            return None
+
+        return encoded, str(transfer_syntax)
+
+    def get(self, key, generation):
+        """Return the cached responses for `key` or ``None``.
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key from ``FindCache.key()``.
+        generation : int
+            The current generation of the index, responses cached from an
+            earlier generation are discarded.
+        """
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            created, entry_generation, responses = entry
+            if (
+                entry_generation != generation
+                or time.monotonic() - created > self.ttl
+            ):
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return responses
+
+    def put(self, key, generation, responses):
+        """Cache the encoded `responses` for `key`."""
+        if key is None or len(responses) > self.max_responses:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), generation, responses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def responses(self, key, generation, build, current):
+        """Yield the encoded responses to a query, caching new ones.
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key from ``FindCache.key()``.
+        generation : int
+            The generation of the index the responses are built from.
+        build : callable
+            Called if the responses aren't cached, returns an iterable of
+            responses from ``pre_encode()``. Any that couldn't be encoded
+            (``None``) are left out.
+        current : callable
+            Returns the current generation of the index. The new responses
+            are only cached if it's still `generation` once they've all been
+            yielded, and not at all if the consumer stops early.
+        """
+        responses = self.get(key, generation)
+        if responses is not None:
+            for response in responses:
+                yield response
+
+            return
+
+        responses = []
+        for response in build():
+            if response is None:
+                continue
+
+            responses.append(response)
+            yield response
+
+        if current() == generation:
+            self.put(key, generation, responses)
+
+    def clear(self):
+        """Remove all the cached responses."""
+        with self._lock:
+            self._entries.clear()
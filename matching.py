@@ -0,0 +1,396 @@
+"""
+Query/Retrieve and Worklist attribute matching, see the DICOM Standard,
+Part 4, Section C.2.2.2.
+
+An Identifier is compiled once into a ``QueryPlan``, which can then be used
+to check any number of candidate instances without re-examining the query.
+Each key is compiled to one of the following kinds of matching:
+
+* Universal matching: the key has no value, anything matches
+* Single value matching: the value must be equal
+* Wildcard matching: ``*`` matches any sequence of characters and ``?`` any
+  single character
+* Range matching: DA, TM and DT keys of the form ``lower-upper``, where one
+  of the bounds may be absent
+* List of UID matching: a UI key with multiple values matches any of them
+* Sequence matching: a sequence key's single item is itself a query that must
+  match at least one item of the candidate's sequence
+
+The matchers also know how to express themselves as SQL, which lets an
+index (such as ``archive_index.ArchiveIndex``) look up the selective keys
+itself instead of scanning every instance.
+"""
+import re
+
+from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+
+
+# The Query/Retrieve levels, highest first
+LEVELS = ['PATIENT', 'STUDY', 'SERIES', 'IMAGE']
+
+# The Unique Key for each Query/Retrieve level
+UNIQUE_KEYS = {
+    'PATIENT': 'PatientID',
+    'STUDY': 'StudyInstanceUID',
+    'SERIES': 'SeriesInstanceUID',
+    'IMAGE': 'SOPInstanceUID',
+}
+
+# The level of the common Query/Retrieve keys, keys that aren't listed here
+#   are matched at whatever level is requested
+KEY_LEVELS = {
+    'PatientID': 'PATIENT',
+    'PatientName': 'PATIENT',
+    'PatientBirthDate': 'PATIENT',
+    'PatientSex': 'PATIENT',
+    'OtherPatientIDs': 'PATIENT',
+    'NumberOfPatientRelatedStudies': 'PATIENT',
+    'StudyInstanceUID': 'STUDY',
+    'StudyDate': 'STUDY',
+    'StudyTime': 'STUDY',
+    'AccessionNumber': 'STUDY',
+    'StudyID': 'STUDY',
+    'StudyDescription': 'STUDY',
+    'ReferringPhysicianName': 'STUDY',
+    'ModalitiesInStudy': 'STUDY',
+    'NumberOfStudyRelatedSeries': 'STUDY',
+    'SeriesInstanceUID': 'SERIES',
+    'SeriesNumber': 'SERIES',
+    'SeriesDescription': 'SERIES',
+    'Modality': 'SERIES',
+    'NumberOfSeriesRelatedInstances': 'SERIES',
+    'SOPInstanceUID': 'IMAGE',
+    'SOPClassUID': 'IMAGE',
+    'InstanceNumber': 'IMAGE',
+}
+
+# Keys that are part of the Identifier but are never matched
+_NON_MATCHING_KEYS = [
+    'QueryRetrieveLevel', 'SpecificCharacterSet', 'TimezoneOffsetFromUTC'
+]
+
+# VRs that support range matching
+_RANGE_VRS = ['DA', 'TM', 'DT']
+
+# VRs that support wildcard matching
+_WILDCARD_VRS = ['AE', 'CS', 'LO', 'LT', 'PN', 'SH', 'ST', 'UC', 'UR', 'UT']
+
+
+def _as_text(value):
+    """Return a candidate's element value as :class:`str`."""
+    if value is None:
+        return ''
+
+    return str(value)
+
+
+def _values(value):
+    """Return a candidate's (possibly multi-valued) value as a list of str."""
+    if isinstance(value, (list, MultiValue)):
+        return [_as_text(vv) for vv in value]
+
+    return [_as_text(value)]
+
+
+def _normalise_time(value):
+    """Return a TM or DT value in a form that compares as a string."""
+    return value.replace(':', '').strip()
+
+
+class SingleValue(object):
+    """Single value matching."""
+    def __init__(self, value):
+        self.value = value
+
+    def matches(self, value):
+        return any(vv == self.value for vv in _values(value))
+
+    def sql(self, column):
+        return '{} = ?'.format(column), [self.value]
+
+
+class Wildcard(object):
+    """Wildcard matching using ``*`` and ``?``."""
+    def __init__(self, pattern):
+        self.pattern = pattern
+        regex = re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.')
+        self._regex = re.compile(regex, re.DOTALL)
+
+    def matches(self, value):
+        return any(self._regex.fullmatch(vv) for vv in _values(value))
+
+    def sql(self, column):
+        # GLOB uses the same wildcards as DICOM, but '[' has to be escaped
+        pattern = self.pattern.replace('[', '[[]')
+        return '{} GLOB ?'.format(column), [pattern]
+
+
+class Range(object):
+    """Range matching of DA, TM and DT values."""
+    def __init__(self, lower, upper, vr):
+        self.vr = vr
+        if vr != 'DA':
+            lower = _normalise_time(lower)
+            upper = _normalise_time(upper)
+
+        self.lower = lower or None
+        self.upper = upper or None
+
+    def matches(self, value):
+        for vv in _values(value):
+            if not vv:
+                continue
+
+            if self.vr != 'DA':
+                vv = _normalise_time(vv)
+                # A bound only has to match to its own precision
+                if self.upper and vv[:len(self.upper)] > self.upper:
+                    continue
+            elif self.upper and vv > self.upper:
+                continue
+
+            if self.lower and vv < self.lower:
+                continue
+
+            return True
+
+        return False
+
+    def sql(self, column):
+        # Times and datetimes may be stored with different precisions so
+        #   leave them to ``matches()``
+        if self.vr != 'DA':
+            return None
+
+        clauses, params = [], []
+        if self.lower:
+            clauses.append('{} >= ?'.format(column))
+            params.append(self.lower)
+        if self.upper:
+            clauses.append('{} <= ?'.format(column))
+            params.append(self.upper)
+            # An empty value is less than any bound but never matches
+            if not self.lower:
+                clauses.append("{} != ''".format(column))
+
+        return ' AND '.join(clauses), params
+
+
+class ValueList(object):
+    """List of UID matching."""
+    def __init__(self, values):
+        self.values = set(values)
+
+    def matches(self, value):
+        return any(vv in self.values for vv in _values(value))
+
+    def sql(self, column):
+        values = sorted(self.values)
+        return (
+            '{} IN ({})'.format(column, ', '.join('?' * len(values))),
+            values
+        )
+
+
+class SequenceMatch(object):
+    """Sequence matching, the query item must match one candidate item."""
+    def __init__(self, plan):
+        self.plan = plan
+
+    def matches(self, value):
+        if not value:
+            return False
+
+        return any(self.plan.matches(item) for item in value)
+
+    def sql(self, column):
+        return None
+
+
+def compile_key(elem):
+    """Return the matcher for the Identifier element `elem`.
+
+    Returns ``None`` if the key uses universal matching.
+    """
+    vr = elem.VR
+    value = elem.value
+
+    if vr == 'SQ':
+        # An empty sequence, or a sequence with an empty item, is universal
+        if not value or len(value[0]) == 0:
+            return None
+
+        plan = QueryPlan(value[0], level=None)
+        if not plan.matchers:
+            return None
+
+        return SequenceMatch(plan)
+
+    if value is None or value == '':
+        return None
+
+    if isinstance(value, MultiValue):
+        values = [_as_text(vv) for vv in value if _as_text(vv)]
+        if not values:
+            return None
+
+        if len(values) > 1:
+            return ValueList(values)
+
+        value = values[0]
+
+    value = _as_text(value)
+
+    if vr in _RANGE_VRS and '-' in value:
+        lower, upper = value.split('-', 1)
+        return Range(lower.strip(), upper.strip(), vr)
+
+    if vr in _WILDCARD_VRS and ('*' in value or '?' in value):
+        # A lone '*' is the same as universal matching
+        if value.strip('*') == '':
+            return None
+
+        return Wildcard(value)
+
+    return SingleValue(value)
+
+
+class QueryPlan(object):
+    """A compiled C-FIND, C-GET or C-MOVE Identifier.
+
+    Attributes
+    ----------
+    level : str or None
+        The Query/Retrieve level, or ``None`` if the query isn't
+        hierarchical (as for a Modality Worklist).
+    matchers : list of (str, matcher)
+        The (keyword, matcher) for each key that doesn't use universal
+        matching.
+    return_keys : list of str
+        The keywords of the keys to be returned in a C-FIND response.
+    """
+    def __init__(self, identifier, level=None):
+        self.identifier = identifier
+        self.level = level
+        self.matchers = []
+        self.return_keys = []
+        # The plans for the items of sequence keys with sub-keys, only
+        #   those sub-keys are returned
+        self._item_plans = {}
+
+        allowed = LEVELS[:LEVELS.index(level) + 1] if level else LEVELS
+        for elem in identifier:
+            keyword = elem.keyword
+            if not keyword or keyword in _NON_MATCHING_KEYS:
+                continue
+
+            # Keys below the query level aren't matched or returned
+            if KEY_LEVELS.get(keyword, allowed[-1]) not in allowed:
+                continue
+
+            self.return_keys.append(keyword)
+            if elem.VR == 'SQ' and elem.value and len(elem.value[0]):
+                self._item_plans[keyword] = QueryPlan(elem.value[0])
+
+            matcher = compile_key(elem)
+            if matcher is not None:
+                self.matchers.append((keyword, matcher))
+
+    @property
+    def unique_key(self):
+        """Return the keyword of the Unique Key for the query level."""
+        return UNIQUE_KEYS.get(self.level)
+
+    def matches(self, candidate):
+        """Return ``True`` if `candidate` matches the query.
+
+        Parameters
+        ----------
+        candidate : pydicom.dataset.Dataset or dict
+            The instance to check, anything with a ``get(keyword)`` method.
+        """
+        for keyword, matcher in self.matchers:
+            if not matcher.matches(candidate.get(keyword)):
+                return False
+
+        return True
+
+    def split(self, columns):
+        """Split the matchers into those that can be run as SQL and the rest.
+
+        Parameters
+        ----------
+        columns : dict
+            The {keyword: column} available to the SQL query.
+
+        Returns
+        -------
+        list of (str, list), list of (str, matcher)
+            The SQL (clause, parameters) and the remaining (keyword, matcher)
+            that have to be checked with ``matches()``.
+        """
+        clauses = []
+        residual = []
+        for keyword, matcher in self.matchers:
+            sql = matcher.sql(columns[keyword]) if keyword in columns else None
+            if sql and sql[0]:
+                clauses.append(sql)
+            else:
+                residual.append((keyword, matcher))
+
+        return clauses, residual
+
+    def response(self, candidate):
+        """Return the C-FIND response Identifier for a matching `candidate`.
+
+        The response contains every key in the query, set to the value of the
+        corresponding attribute of `candidate` (if it has one). The items of a
+        sequence key only contain the keys in the query's item, unless it's
+        empty.
+        """
+        ds = Dataset()
+        if 'SpecificCharacterSet' in self.identifier:
+            ds.SpecificCharacterSet = candidate.get(
+                'SpecificCharacterSet', self.identifier.SpecificCharacterSet
+            )
+
+        if self.level:
+            ds.QueryRetrieveLevel = self.level
+
+        for keyword in self.return_keys:
+            query_elem = self.identifier.data_element(keyword)
+            value = candidate.get(keyword)
+            if isinstance(value, DataElement):
+                value = value.value
+
+            if query_elem.VR == 'SQ':
+                items = value or []
+                item_plan = self._item_plans.get(keyword)
+                if item_plan is not None:
+                    items = [item_plan.response(item) for item in items]
+
+                value = Sequence(items)
+            elif value == '':
+                value = None
+
+            ds.add_new(query_elem.tag, query_elem.VR, value)
+
+        return ds
+
+
+def compile_query(identifier):
+    """Return a ``QueryPlan`` for the Query/Retrieve `identifier`.
+
+    Raises ``ValueError`` if the Identifier has no valid *Query/Retrieve
+    Level*.
+    """
+    level = identifier.get('QueryRetrieveLevel', None)
+    if level not in LEVELS:
+        raise ValueError(
+            "Invalid 'Query/Retrieve Level' value '{}'".format(level)
+        )
+
+    return QueryPlan(identifier, level)
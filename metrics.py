@@ -0,0 +1,413 @@
+"""
+Latency and throughput metrics for SCPs and SCUs, collected from pynetdicom's
+events and exported in the Prometheus text format.
+
+``Metrics.handlers()`` returns notification event handlers that record, for
+each peer AE title:
+
+* ``dicom_association_setup_seconds``: from the connection being opened to
+  the association being accepted
+* ``dicom_dimse_seconds``: from a DIMSE request being sent or received to
+  the final (non-Pending) response, by command and SOP Class
+* ``dicom_bytes_{received,sent}_total`` and
+  ``dicom_pdus_{received,sent}_total``, by PDU type
+* ``dicom_associations_total``, by outcome
+
+Wrapping an intervention event handler with ``Metrics.timed()`` also records
+``dicom_handler_seconds``, the time spent in the handler itself.
+
+Each observation is a few dict lookups and additions under a lock, cheap
+enough to leave on, and nothing is formatted until the metrics are scraped
+from the HTTP endpoint started by ``Metrics.serve()``::
+
+    metrics = Metrics()
+    handlers = [(evt.EVT_C_STORE, metrics.timed(evt.EVT_C_STORE, handle))]
+    handlers += metrics.handlers()
+    metrics.serve(('127.0.0.1', 9102))
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import inspect
+import threading
+import time
+
+from pydicom.uid import UID
+
+from pynetdicom import evt
+
+from pdv_receiver import pdu_length
+
+
+# The upper bounds of the histogram buckets, in seconds
+BUCKETS = [
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60
+]
+
+# DIMSE Command Field values, responses have bit 15 set as well
+_COMMANDS = {
+    0x0001: 'C-STORE', 0x0010: 'C-GET', 0x0020: 'C-FIND', 0x0021: 'C-MOVE',
+    0x0030: 'C-ECHO', 0x0FFF: 'C-CANCEL', 0x0100: 'N-EVENT-REPORT',
+    0x0110: 'N-GET', 0x0120: 'N-SET', 0x0130: 'N-ACTION',
+    0x0140: 'N-CREATE', 0x0150: 'N-DELETE',
+}
+
+# The PDU type is the first byte of the PDU
+_PDU_TYPES = {
+    0x01: 'A-ASSOCIATE-RQ', 0x02: 'A-ASSOCIATE-AC', 0x03: 'A-ASSOCIATE-RJ',
+    0x04: 'P-DATA-TF', 0x05: 'A-RELEASE-RQ', 0x06: 'A-RELEASE-RP',
+    0x07: 'A-ABORT',
+}
+
+# Status values of responses that will be followed by another response
+_PENDING = (0xFF00, 0xFF01)
+
+_HELP = {
+    'dicom_association_setup_seconds':
+        'Time from the connection opening to the association being accepted',
+    'dicom_dimse_seconds':
+        'Time from a DIMSE request to its final response',
+    'dicom_handler_seconds': 'Time spent in the event handler',
+    'dicom_bytes_received_total': 'Bytes received in PDUs',
+    'dicom_bytes_sent_total': 'Bytes sent in PDUs',
+    'dicom_pdus_received_total': 'PDUs received',
+    'dicom_pdus_sent_total': 'PDUs sent',
+    'dicom_associations_total': 'Associations by outcome',
+}
+
+
+def _escape(value):
+    """Return `value` escaped for use as a Prometheus label value."""
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def _aet(value):
+    """Return the AE title `value` as :class:`str`."""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='replace')
+
+    return value.strip()
+
+
+def _labels(names, values, extra=''):
+    """Return the Prometheus label set for `names` and `values`."""
+    labels = [
+        '{}="{}"'.format(name, _escape(value))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        labels.append(extra)
+
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class _Connection(object):
+    """What's known about one association's connection."""
+    def __init__(self):
+        self.opened = time.perf_counter()
+        # The peer's AE title, once known
+        self.peer = None
+        # {'in'/'out': {message ID: (start, command, SOP Class)}}
+        self.requests = {'in': {}, 'out': {}}
+        # PDUs seen before the peer was known, as (direction, data length,
+        #   PDU type)
+        self.early = []
+
+
+class Metrics(object):
+    """Histograms and counters for DICOM associations.
+
+    Parameters
+    ----------
+    buckets : list of float, optional
+        The upper bounds of the histogram buckets in seconds, by default
+        ``BUCKETS``.
+    """
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets or BUCKETS)
+        self._lock = threading.Lock()
+        # {name: (label names, {label values: [bucket counts..., sum]})}
+        self._histograms = {
+            'dicom_association_setup_seconds': (('peer', ), {}),
+            'dicom_dimse_seconds': (('peer', 'command', 'sop_class'), {}),
+            'dicom_handler_seconds': (('event', 'sop_class'), {}),
+        }
+        # {name: (label names, {label values: total})}
+        self._counters = {
+            'dicom_bytes_received_total': (('peer', ), {}),
+            'dicom_bytes_sent_total': (('peer', ), {}),
+            'dicom_pdus_received_total': (('peer', 'type'), {}),
+            'dicom_pdus_sent_total': (('peer', 'type'), {}),
+            'dicom_associations_total': (('peer', 'outcome'), {}),
+        }
+        # {assoc: _Connection}
+        self._connections = {}
+        # {UID: name}, so each UID is only looked up once
+        self._names = {}
+
+    # Recording
+    def observe(self, name, labels, seconds):
+        """Add an observation of `seconds` to the histogram `name`."""
+        idx = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms[name][1]
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(self.buckets) + 2)
+
+            # The per-bucket counts, +Inf and then the sum
+            counts[idx] += 1
+            counts[-1] += seconds
+
+    def increment(self, name, labels, value=1):
+        """Add `value` to the counter `name`."""
+        with self._lock:
+            series = self._counters[name][1]
+            series[labels] = series.get(labels, 0) + value
+
+    def _sop_class(self, uid):
+        """Return the name of the SOP Class with `uid`."""
+        name = self._names.get(uid)
+        if name is None:
+            name = self._names[uid] = UID(uid).name if uid else ''
+
+        return name
+
+    # Event handlers
+    def handlers(self):
+        """Return the notification event handlers to bind."""
+        return [
+            (evt.EVT_CONN_OPEN, self._on_open),
+            (evt.EVT_CONN_CLOSE, self._on_close),
+            (evt.EVT_REQUESTED, self._on_requested),
+            (evt.EVT_ACCEPTED, self._on_accepted),
+            (evt.EVT_REJECTED, self._on_outcome),
+            (evt.EVT_RELEASED, self._on_outcome),
+            (evt.EVT_ABORTED, self._on_outcome),
+            (evt.EVT_DATA_RECV, self._on_data_recv),
+            (evt.EVT_DATA_SENT, self._on_data_sent),
+            (evt.EVT_DIMSE_RECV, self._on_dimse_recv),
+            (evt.EVT_DIMSE_SENT, self._on_dimse_sent),
+        ]
+
+    def timed(self, event_type, handler):
+        """Return `handler` wrapped to record the time it takes.
+
+        If the handler is a generator (as for C-FIND, C-GET and C-MOVE) then
+        only the time spent producing each value is counted, not the time
+        spent sending them.
+        """
+        name = event_type.name
+
+        def _wrapper(event, *args):
+            sop_class = self._sop_class(event.context.abstract_syntax)
+            start = time.perf_counter()
+            result = handler(event, *args)
+            elapsed = time.perf_counter() - start
+            if not inspect.isgenerator(result):
+                self.observe(
+                    'dicom_handler_seconds', (name, sop_class), elapsed
+                )
+                return result
+
+            return self._timed_generator(result, name, sop_class, elapsed)
+
+        return _wrapper
+
+    def _timed_generator(self, generator, name, sop_class, elapsed):
+        """Yield from `generator`, recording the time spent in it."""
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    value = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+
+                yield value
+        finally:
+            generator.close()
+            self.observe('dicom_handler_seconds', (name, sop_class), elapsed)
+
+    def _on_open(self, event):
+        conn = _Connection()
+        if event.assoc.is_requestor:
+            conn.peer = _aet(event.assoc.acceptor.ae_title)
+
+        with self._lock:
+            self._connections[event.assoc] = conn
+
+    def _on_close(self, event):
+        with self._lock:
+            self._connections.pop(event.assoc, None)
+
+    def _on_requested(self, event):
+        conn = self._connections.get(event.assoc)
+        if conn is None:
+            return
+
+        # Count the A-ASSOCIATE-RQ now that we know who it was from
+        conn.peer = _aet(event.assoc.requestor.primitive.calling_ae_title)
+        for direction, length, pdu_type in conn.early:
+            self._count_pdu(conn.peer, direction, length, pdu_type)
+
+        conn.early = []
+
+    def _on_accepted(self, event):
+        conn = self._connections.get(event.assoc)
+        if conn is None or conn.peer is None:
+            return
+
+        self.observe(
+            'dicom_association_setup_seconds',
+            (conn.peer, ),
+            time.perf_counter() - conn.opened
+        )
+        self.increment('dicom_associations_total', (conn.peer, 'accepted'))
+
+    def _on_outcome(self, event):
+        conn = self._connections.get(event.assoc)
+        if conn is None or conn.peer is None:
+            return
+
+        outcome = event.event.name[4:].lower()
+        self.increment('dicom_associations_total', (conn.peer, outcome))
+
+    def _count_pdu(self, peer, direction, length, pdu_type):
+        if direction == 'in':
+            self.increment('dicom_bytes_received_total', (peer, ), length)
+            self.increment('dicom_pdus_received_total', (peer, pdu_type))
+        else:
+            self.increment('dicom_bytes_sent_total', (peer, ), length)
+            self.increment('dicom_pdus_sent_total', (peer, pdu_type))
+
+    def _on_data(self, event, direction):
+        conn = self._connections.get(event.assoc)
+        if conn is None:
+            return
+
+        data = event.data
+        pdu_type = _PDU_TYPES.get(data[0], 'unknown') if data else 'unknown'
+        length = pdu_length(data)
+        if conn.peer is None:
+            conn.early.append((direction, length, pdu_type))
+            return
+
+        self._count_pdu(conn.peer, direction, length, pdu_type)
+
+    def _on_data_recv(self, event):
+        self._on_data(event, 'in')
+
+    def _on_data_sent(self, event):
+        self._on_data(event, 'out')
+
+    def _on_dimse(self, event, direction):
+        conn = self._connections.get(event.assoc)
+        if conn is None:
+            return
+
+        cs = event.message.command_set
+        field = cs.CommandField
+        if not field & 0x8000:
+            # A request, remember when it started
+            sop_class = cs.get('AffectedSOPClassUID') or cs.get(
+                'RequestedSOPClassUID'
+            )
+            conn.requests[direction][cs.MessageID] = (
+                time.perf_counter(),
+                _COMMANDS.get(field, 'unknown'),
+                self._sop_class(sop_class)
+            )
+            return
+
+        if cs.get('Status') in _PENDING:
+            return
+
+        # A final response to a request going the other way
+        requests = conn.requests['out' if direction == 'in' else 'in']
+        request = requests.pop(cs.get('MessageIDBeingRespondedTo'), None)
+        if request is None:
+            return
+
+        start, command, sop_class = request
+        self.observe(
+            'dicom_dimse_seconds',
+            (conn.peer, command, sop_class),
+            time.perf_counter() - start
+        )
+
+    def _on_dimse_recv(self, event):
+        self._on_dimse(event, 'in')
+
+    def _on_dimse_sent(self, event):
+        self._on_dimse(event, 'out')
+
+    # Exporting
+    def export(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = []
+        bounds = ['{:g}'.format(bb) for bb in self.buckets] + ['+Inf']
+        with self._lock:
+            for name, (names, series) in sorted(self._histograms.items()):
+                lines.append('# HELP {} {}'.format(name, _HELP[name]))
+                lines.append('# TYPE {} histogram'.format(name))
+                for values, counts in sorted(series.items()):
+                    total = 0
+                    for bound, count in zip(bounds, counts):
+                        total += count
+                        lines.append('{}_bucket{} {}'.format(
+                            name,
+                            _labels(names, values, 'le="{}"'.format(bound)),
+                            total
+                        ))
+
+                    labels = _labels(names, values)
+                    lines.append(
+                        '{}_sum{} {}'.format(name, labels, counts[-1])
+                    )
+                    lines.append('{}_count{} {}'.format(name, labels, total))
+
+            for name, (names, series) in sorted(self._counters.items()):
+                lines.append('# HELP {} {}'.format(name, _HELP[name]))
+                lines.append('# TYPE {} counter'.format(name))
+                for values, total in sorted(series.items()):
+                    lines.append('{}{} {}'.format(
+                        name, _labels(names, values), total
+                    ))
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, address=('127.0.0.1', 9102)):
+        """Serve the metrics over HTTP from a background thread.
+
+        Returns the ``http.server.ThreadingHTTPServer``.
+        """
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.export().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4; charset=utf-8'
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(address, _Handler)
+        thread = threading.Thread(
+            target=server.serve_forever, name='MetricsServer'
+        )
+        thread.daemon = True
+        thread.start()
+
+        return server
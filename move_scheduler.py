@@ -0,0 +1,412 @@
+"""
+Scheduling of the C-STORE sub-associations made by a Move SCP.
+
+Without scheduling every C-MOVE request opens its own association with the
+move destination, so when many requests are made for the same (slow)
+destination they all compete for it. Here the sub-associations to each
+destination are limited to `max_per_destination` at a time, and the moves
+waiting for one are started in order of their C-MOVE *Priority* (HIGH, then
+MEDIUM, then LOW) and then in the order they arrived. Finished moves return
+their association to an ``assoc_pool.AssociationPool`` so the next move to
+the same destination can use it without negotiating again.
+
+A move that has waited `wait_timeout` seconds without getting an association
+gives up: it's given a stand-in association over which every C-STORE fails,
+so pynetdicom ends the C-MOVE with 0xA702 (Out of Resources - Unable to
+perform sub-operations) rather than the association hanging. A move that
+fails part way through can leave its association unreleased, so the C-MOVE
+handler runs its sub-operations inside ``MoveScheduler.moving()``, which
+releases any association still held once they're over. While waiting, the
+slots of moves whose association has died without being released are also
+taken back. If the scheduler has a ``transcode.TranscodeCache`` then
+instances that can't be sent with any of the transfer syntaxes the
+destination accepted are converted first.
+
+pynetdicom requests the sub-association with ``AE.associate()``, passing on
+any keyword arguments yielded with the destination, so a Move SCP using a
+``SchedulingAE`` only needs to yield the request's priority, inside
+``moving()``::
+
+    with ae.scheduler.moving():
+        yield (addr, port, {'priority': event.request.Priority})
+        ...
+"""
+from contextlib import contextmanager
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from pynetdicom import AE
+
+from assoc_pool import AssociationPool
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# The number of seconds between checks for dead associations while waiting
+_CHECK_INTERVAL = 5
+
+# The order in which moves are started for each C-MOVE Priority value
+_PRIORITY_ORDER = {
+    1: 0,  # HIGH
+    0: 1,  # MEDIUM
+    2: 2,  # LOW
+}
+
+
+class _Destination(object):
+    """The sub-associations and statistics for one move destination."""
+    def __init__(self, ae_title, limit):
+        self.ae_title = ae_title
+        self.limit = limit
+        self.active = 0
+        # Heap of (priority order, arrival, event) for the waiting moves
+        self.waiting = []
+        # The _ScheduledAssociation for each slot in use
+        self.holders = set()
+
+        self.moves = 0
+        self.instances = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+class MoveScheduler(object):
+    """Schedules the associations made with each move destination.
+
+    Parameters
+    ----------
+    pool : assoc_pool.AssociationPool
+        The pool the associations are taken from and returned to.
+    max_per_destination : int, optional
+        The maximum number of concurrent associations with each destination
+        (default ``2``).
+    transcoder : transcode.TranscodeCache, optional
+        If used then the instances sent are converted when needed.
+    wait_timeout : float, optional
+        The number of seconds a move waits for an association before its
+        sub-operations fail (default ``300``).
+    """
+    def __init__(self, pool, max_per_destination=2, transcoder=None,
+                 wait_timeout=300):
+        self.pool = pool
+        self.max_per_destination = max_per_destination
+        self.transcoder = transcoder
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._destinations = {}
+        self._arrivals = itertools.count()
+        # The associations taken inside moving() by each thread
+        self._local = threading.local()
+
+    def associate(self, addr, port, ae_title=b'ANY-SCP', priority=0,
+                  contexts=None):
+        """Return an association with the destination once it's our turn.
+
+        Blocks until fewer than `max_per_destination` associations with the
+        destination are in use and no move with a higher priority (or the
+        same priority, that arrived earlier) is waiting, or for at most
+        `wait_timeout` seconds.
+
+        Returns
+        -------
+        association.Association
+            The association, if it's established then it must be released
+            with its ``release()`` method, which returns it to the pool. If
+            the wait timed out then a stand-in over which every C-STORE
+            fails.
+        """
+        key = (addr, port, ae_title)
+        with self._lock:
+            dest = self._destinations.get(key)
+            if dest is None:
+                dest = _Destination(ae_title, self.max_per_destination)
+                self._destinations[key] = dest
+
+            if dest.active < dest.limit and not dest.waiting:
+                dest.active += 1
+                entry = None
+            else:
+                order = _PRIORITY_ORDER.get(priority, 1)
+                entry = (order, next(self._arrivals), threading.Event())
+                heapq.heappush(dest.waiting, entry)
+
+        # The slot is handed over by the move that frees it
+        if entry is not None and not self._wait(dest, entry):
+            LOGGER.error(
+                "No association with '%s' was available after %d s",
+                ae_title, self.wait_timeout
+            )
+            return _Unavailable()
+
+        try:
+            assoc = self.pool.acquire(addr, port, ae_title, contexts)
+        except Exception:
+            self._next(dest)
+            raise
+
+        if not assoc.is_established:
+            self._next(dest)
+            return assoc
+
+        scheduled = _ScheduledAssociation(self, dest, assoc)
+        with self._lock:
+            dest.holders.add(scheduled)
+
+        held = getattr(self._local, 'held', None)
+        if held is not None:
+            held.append(scheduled)
+
+        return scheduled
+
+    @contextmanager
+    def moving(self):
+        """Context manager that releases the associations taken within it.
+
+        pynetdicom requests the sub-association and sends the C-STOREs from
+        the thread running the C-MOVE handler, so any association taken by
+        that thread while the context is open is released when it closes,
+        even if the C-MOVE failed before pynetdicom released it. pynetdicom
+        drops the handler when it fails, which closes a context opened in a
+        generator handler.
+        """
+        previous = getattr(self._local, 'held', None)
+        held = self._local.held = []
+        try:
+            yield
+        finally:
+            self._local.held = previous
+            for scheduled in held:
+                scheduled.release()
+
+    def throughput(self):
+        """Return the transfer statistics for each destination.
+
+        Returns
+        -------
+        dict
+            {AE title: statistics}, where the statistics are a dict with the
+            number of ``moves``, ``instances`` sent and ``failed``, the
+            ``bytes`` sent and the ``seconds`` spent sending them, the
+            ``instances_per_s`` and ``mb_per_s`` while sending, and the
+            number of associations ``active`` and moves ``waiting``.
+        """
+        stats = {}
+        with self._lock:
+            for dest in self._destinations.values():
+                seconds = dest.seconds or 1
+                stats[dest.ae_title] = {
+                    'moves': dest.moves,
+                    'instances': dest.instances,
+                    'failed': dest.failed,
+                    'bytes': dest.bytes,
+                    'seconds': dest.seconds,
+                    'instances_per_s': dest.instances / seconds,
+                    'mb_per_s': dest.bytes / seconds / 1024**2,
+                    'active': dest.active,
+                    'waiting': len(dest.waiting),
+                }
+
+        return stats
+
+    def _wait(self, dest, entry):
+        """Wait for the waiting move `entry` to be given a slot.
+
+        Returns ``False`` if it wasn't within `wait_timeout` seconds.
+        """
+        ready = entry[2]
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            if ready.wait(min(remaining, _CHECK_INTERVAL)):
+                return True
+
+            self._reclaim(dest)
+
+        with self._lock:
+            # The slot may have been handed over just now
+            if ready.is_set():
+                return True
+
+            dest.waiting.remove(entry)
+            heapq.heapify(dest.waiting)
+
+        return False
+
+    def _reclaim(self, dest):
+        """Free the slots of moves whose association died unreleased."""
+        with self._lock:
+            dead = [hh for hh in dest.holders if not hh.assoc.is_alive()]
+
+        for scheduled in dead:
+            LOGGER.warning(
+                "Freeing the slot of a dead association with '%s'",
+                dest.ae_title
+            )
+            scheduled.release()
+
+    def _next(self, dest):
+        """Hand the destination's slot to the next waiting move, if any."""
+        with self._lock:
+            if dest.waiting:
+                _, _, ready = heapq.heappop(dest.waiting)
+                ready.set()
+            else:
+                dest.active -= 1
+
+    def _finished(self, scheduled):
+        """Return the association of a finished move to the pool."""
+        dest = scheduled.destination
+        with self._lock:
+            dest.holders.discard(scheduled)
+            dest.moves += 1
+            dest.instances += scheduled.instances
+            dest.failed += scheduled.failed
+            dest.bytes += scheduled.bytes
+            dest.seconds += scheduled.seconds
+
+        LOGGER.info(
+            "Move to '%s' finished: %d instances (%d failed) in %.1f s",
+            dest.ae_title, scheduled.instances, scheduled.failed,
+            scheduled.seconds
+        )
+
+        self.pool.release(scheduled.assoc)
+        self._next(dest)
+
+
+class _ScheduledAssociation(object):
+    """An association taken from the pool for a single move.
+
+    Behaves like the association it wraps, but records the C-STOREs sent
+    over it and gives it back to the scheduler when it's released.
+    """
+    def __init__(self, scheduler, destination, assoc):
+        self.scheduler = scheduler
+        self.destination = destination
+        self.assoc = assoc
+        self.instances = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self.assoc, name)
+
+    def send_c_store(self, dataset, *args, **kwargs):
+        """Send a C-STORE request and record how long it took."""
+        transcoder = self.scheduler.transcoder
+        if transcoder is not None:
+            dataset = transcoder.dataset_for(
+                dataset, self.assoc.accepted_contexts
+            )
+
+        start = time.perf_counter()
+        try:
+            status = self.assoc.send_c_store(dataset, *args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+        if status and status.Status in (0x0000, 0xB000, 0xB007, 0xB006):
+            self.instances += 1
+            # Instances read from file know how large they are
+            fpath = getattr(dataset, 'filename', None)
+            if isinstance(fpath, str) and os.path.exists(fpath):
+                self.bytes += os.path.getsize(fpath)
+        else:
+            self.failed += 1
+
+        return status
+
+    def release(self):
+        """Give the association back to the scheduler."""
+        # Can also be released by the scheduler if the association died
+        with self.scheduler._lock:
+            if self._released:
+                return
+
+            self._released = True
+
+        self.scheduler._finished(self)
+
+    def abort(self):
+        """Abort the association and give up its slot."""
+        self.assoc.abort()
+        self.release()
+
+
+class _Unavailable(object):
+    """Stands in for an association that couldn't be had in time.
+
+    pynetdicom sees an established association, but every C-STORE sent over
+    it fails.
+    """
+    is_established = True
+
+    def send_c_store(self, dataset, *args, **kwargs):
+        raise RuntimeError(
+            'No association with the move destination was available'
+        )
+
+    def release(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class SchedulingAE(AE):
+    """An AE whose C-MOVE sub-associations are scheduled.
+
+    Associations requested with a `priority` keyword argument are made
+    through a ``MoveScheduler``, any others are requested as usual.
+
+    Parameters
+    ----------
+    ae_title : bytes, optional
+        The AE title (default ``b'PYNETDICOM'``).
+    max_per_destination : int, optional
+        The maximum number of concurrent associations with each move
+        destination (default ``2``).
+    max_idle : int, optional
+        The maximum number of idle associations kept for each destination
+        (default ``1``).
+    idle_timeout : float, optional
+        The number of seconds after which an idle association is released
+        (default ``60``).
+    transcoder : transcode.TranscodeCache, optional
+        If used then the instances sent are converted when needed.
+    wait_timeout : float, optional
+        The number of seconds a move waits for an association before its
+        sub-operations fail (default ``300``).
+    """
+    def __init__(self, ae_title=b'PYNETDICOM', max_per_destination=2,
+                 max_idle=1, idle_timeout=60, transcoder=None,
+                 wait_timeout=300):
+        super(SchedulingAE, self).__init__(ae_title)
+        pool = AssociationPool(
+            self, max_idle=max_idle, idle_timeout=idle_timeout
+        )
+        self.scheduler = MoveScheduler(
+            pool, max_per_destination, transcoder, wait_timeout
+        )
+
+    def associate(self, addr, port, priority=None, **kwargs):
+        """Request an association, scheduled if `priority` is used."""
+        if priority is None:
+            return super(SchedulingAE, self).associate(addr, port, **kwargs)
+
+        return self.scheduler.associate(
+            addr, port,
+            ae_title=kwargs.get('ae_title', b'ANY-SCP'),
+            priority=priority,
+            contexts=kwargs.get('contexts')
+        )
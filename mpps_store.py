@@ -0,0 +1,286 @@
+"""
+A thread-safe, persistent store for Modality Performed Procedure Step SOP
+Instances.
+
+Every change is written through to a SQLite database (in WAL mode), so the
+in-progress procedure steps are recovered when the SCP restarts. An N-CREATE
+writes the complete instance but an N-SET only appends its *Modification
+List* to a journal of changes, so the cost of an N-SET depends on the size
+of the modification and not on how large the instance has grown. Once an
+instance has `fold_after` journalled modifications, or it's finished, the
+whole instance is written again in their place, so the journal stays
+small. Any journal left is folded into its instance when it's recovered and
+by the hourly compaction.
+
+Updates to an instance are serialised by one of a fixed set of locks chosen
+by hashing the SOP Instance UID, so N-CREATE and N-SET requests for
+different instances arriving on separate association threads don't block
+each other. Once a step is COMPLETED or DISCONTINUED it can no longer be
+modified and is dropped from memory, and after `retention` seconds it's
+removed from the database as well.
+"""
+from copy import deepcopy
+from io import BytesIO
+import sqlite3
+import threading
+import time
+
+from pydicom.filereader import read_dataset
+from pydicom.filewriter import write_dataset
+from pydicom.filebase import DicomBytesIO
+
+
+# The final values of Performed Procedure Step Status
+FINAL_STATUSES = ['COMPLETED', 'DISCONTINUED']
+
+# The minimum number of seconds between compactions
+COMPACT_INTERVAL = 60 * 60
+
+
+def _encode(ds):
+    """Return `ds` encoded as explicit VR little endian."""
+    fp = DicomBytesIO()
+    fp.is_little_endian = True
+    fp.is_implicit_VR = False
+    write_dataset(fp, ds)
+    return fp.getvalue()
+
+
+def _decode(data):
+    """Return the explicit VR little endian encoded `data` as a Dataset."""
+    return read_dataset(BytesIO(data), False, True)
+
+
+class MPPSStore(object):
+    """A store of MPPS SOP Instances.
+
+    Parameters
+    ----------
+    db_path : str
+        The path to the SQLite database.
+    stripes : int, optional
+        The number of locks that instance updates are spread over (default
+        ``64``).
+    retention : float, optional
+        The number of seconds a COMPLETED or DISCONTINUED instance is kept in
+        the database (default one week).
+    fold_after : int, optional
+        The number of N-SET modifications journalled for an instance before
+        they're folded into it (default ``32``).
+    """
+    def __init__(self, db_path, stripes=64, retention=7 * 24 * 60 * 60,
+                 fold_after=32):
+        self.retention = retention
+        self.fold_after = fold_after
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        # Protects the database connection and the in-memory instances
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS mpps ('
+                'uid TEXT PRIMARY KEY, status TEXT, updated REAL, '
+                'dataset BLOB)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS mpps_delta ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, uid TEXT, delta BLOB)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_delta_uid ON mpps_delta (uid)'
+            )
+
+        # Recover the procedure steps still in progress
+        self._instances = {}
+        # {uid: number of journalled modifications}
+        self._journalled = {}
+        rows = self._conn.execute(
+            'SELECT uid, dataset FROM mpps WHERE status NOT IN (?, ?)',
+            FINAL_STATUSES
+        ).fetchall()
+        for uid, data in rows:
+            self._instances[uid] = self._recover(uid, _decode(data))
+
+        self._compacted = 0
+        self.compact()
+
+    def _stripe(self, uid):
+        """Return the lock for the instance with `uid`."""
+        return self._stripes[hash(uid) % len(self._stripes)]
+
+    def __contains__(self, uid):
+        with self._lock:
+            if uid in self._instances:
+                return True
+
+            row = self._conn.execute(
+                'SELECT 1 FROM mpps WHERE uid = ?', (uid, )
+            ).fetchone()
+
+        return row is not None
+
+    def get(self, uid):
+        """Return the in-progress instance with `uid` or ``None``."""
+        with self._lock:
+            return self._instances.get(uid)
+
+    def create(self, ds):
+        """Add the new instance `ds`.
+
+        Returns ``False`` if an instance with the same SOP Instance UID
+        already exists.
+        """
+        uid = ds.SOPInstanceUID
+        with self._stripe(uid):
+            if uid in self:
+                return False
+
+            self._save(uid, ds)
+
+        self._maybe_compact()
+        return True
+
+    def update(self, uid, mod_list):
+        """Apply the N-SET *Modification List* `mod_list` to an instance.
+
+        Only the modified attributes are written to the database, unless
+        it's time to fold the instance's journal or the instance is
+        finished.
+
+        Returns the modified attributes (i.e. `mod_list`) or ``None`` if
+        there's no in-progress instance with `uid`.
+        """
+        with self._stripe(uid):
+            ds = self.get(uid)
+            if ds is None:
+                return None
+
+            status = mod_list.get(
+                'PerformedProcedureStepStatus',
+                ds.get('PerformedProcedureStepStatus', '')
+            )
+            status = str(status).upper()
+            count = self._journalled.get(uid, 0) + 1
+            folded = None
+            if count >= self.fold_after or status in FINAL_STATUSES:
+                # Write a modified copy, the instance itself is only changed
+                #   once the database has been
+                folded = deepcopy(ds)
+                folded.update(mod_list)
+            else:
+                data = _encode(mod_list)
+
+            with self._lock:
+                with self._conn:
+                    if folded is None:
+                        self._conn.execute(
+                            'INSERT INTO mpps_delta (uid, delta) '
+                            'VALUES (?, ?)',
+                            (uid, data)
+                        )
+                        self._journalled[uid] = count
+                    else:
+                        self._fold(uid, folded)
+
+                    self._conn.execute(
+                        'UPDATE mpps SET status = ?, updated = ? '
+                        'WHERE uid = ?',
+                        (status, time.time(), uid)
+                    )
+
+                # Apply the modifications in place
+                ds.update(mod_list)
+                if status in FINAL_STATUSES:
+                    self._instances.pop(uid, None)
+
+        self._maybe_compact()
+        return mod_list
+
+    def compact(self):
+        """Fold the journal into the instances and remove old instances.
+
+        Finished instances are removed once they're older than `retention`.
+        """
+        self._compacted = time.time()
+        with self._lock:
+            uids = [
+                uid for (uid, ) in self._conn.execute(
+                    'SELECT DISTINCT uid FROM mpps_delta'
+                )
+            ]
+
+        for uid in uids:
+            with self._stripe(uid):
+                ds = self.get(uid)
+                with self._lock:
+                    if ds is not None:
+                        # The modifications have already been applied
+                        with self._conn:
+                            self._fold(uid, ds)
+                    else:
+                        row = self._conn.execute(
+                            'SELECT dataset FROM mpps WHERE uid = ?', (uid, )
+                        ).fetchone()
+                        if row is not None:
+                            self._recover(uid, _decode(row[0]))
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM mpps WHERE status IN (?, ?) AND updated < ?',
+                FINAL_STATUSES + [self._compacted - self.retention]
+            )
+            self._conn.execute(
+                'DELETE FROM mpps_delta '
+                'WHERE uid NOT IN (SELECT uid FROM mpps)'
+            )
+
+    def _recover(self, uid, ds):
+        """Apply the journalled modifications to `ds` and fold them in."""
+        deltas = self._conn.execute(
+            'SELECT delta FROM mpps_delta WHERE uid = ? ORDER BY id', (uid, )
+        ).fetchall()
+        if not deltas:
+            return ds
+
+        for (data, ) in deltas:
+            ds.update(_decode(data))
+
+        with self._conn:
+            self._fold(uid, ds)
+
+        return ds
+
+    def _fold(self, uid, ds):
+        """Write the modified `ds` in place of the instance's journal.
+
+        Must be called with the lock held, within a transaction.
+        """
+        self._conn.execute(
+            'UPDATE mpps SET dataset = ? WHERE uid = ?', (_encode(ds), uid)
+        )
+        self._conn.execute('DELETE FROM mpps_delta WHERE uid = ?', (uid, ))
+        self._journalled.pop(uid, None)
+
+    def _maybe_compact(self):
+        """Compact if it's been `COMPACT_INTERVAL` seconds since the last."""
+        if time.time() - self._compacted > COMPACT_INTERVAL:
+            self.compact()
+
+    def _save(self, uid, ds):
+        """Write the complete `ds` to the database and keep it in memory."""
+        status = str(ds.get('PerformedProcedureStepStatus', '')).upper()
+        data = _encode(ds)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO mpps VALUES (?, ?, ?, ?)',
+                    (uid, status, time.time(), data)
+                )
+
+            # Finished steps can't be modified, so there's no need to keep
+            #   them in memory
+            if status in FINAL_STATUSES:
+                self._instances.pop(uid, None)
+            else:
+                self._instances[uid] = ds
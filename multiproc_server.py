@@ -0,0 +1,211 @@
+"""
+Run an SCP as several processes that all accept associations on one port.
+
+``AE.start_server()`` runs in a single process, so however many associations
+are open their handlers share one core under the GIL. A
+``MultiprocessServer`` forks `workers` processes, each of which creates its
+own AE and handlers by calling `setup` and then listens on the same address
+with ``SO_REUSEPORT`` set, letting the kernel spread the incoming connections
+over them. Anything created before the server is started (such as
+configuration loaded from file) is shared by all the workers, but threads,
+pools and database connections must be created in `setup` as they don't
+survive being forked.
+
+The workers count their associations and DIMSE messages in shared memory, so
+the totals for the whole server are available from the parent process and
+are logged every `report_interval` seconds.
+
+    def setup(worker):
+        ae = AE()
+        ae.supported_contexts = StoragePresentationContexts
+        return ae, [(evt.EVT_C_STORE, handle_store)]
+
+    MultiprocessServer(('', 11112), setup, workers=8).serve_forever()
+
+``SO_REUSEPORT`` is only available on Linux and some BSDs.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from pynetdicom import evt
+from pynetdicom.transport import ThreadedAssociationServer
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+
+def _exit_reason(status):
+    """Return a description of a wait status from ``os.waitpid()``."""
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        try:
+            name = signal.Signals(signum).name
+        except ValueError:
+            name = str(signum)
+
+        return 'was killed by signal {}'.format(name)
+
+    if os.WIFEXITED(status):
+        return 'exited with code {}'.format(os.WEXITSTATUS(status))
+
+    return 'ended with wait status {}'.format(status)
+
+
+class ReusePortServer(ThreadedAssociationServer):
+    """An association server whose port can be shared by other processes."""
+    def server_bind(self):
+        """Set ``SO_REUSEPORT`` then bind the socket."""
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super(ReusePortServer, self).server_bind()
+
+
+class SharedStats(object):
+    """Counters shared by all the worker processes.
+
+    Parameters
+    ----------
+    names : list of str, optional
+        The names of the counters, by default the ``NAMES`` counted by the
+        handlers from ``handlers()``.
+    """
+    NAMES = ['associations', 'released', 'aborted', 'rejected', 'messages']
+
+    def __init__(self, names=None):
+        self.names = list(names or self.NAMES)
+        self._values = multiprocessing.Array('q', len(self.names))
+
+    def increment(self, name, value=1):
+        """Add `value` to the counter `name`."""
+        idx = self.names.index(name)
+        with self._values.get_lock():
+            self._values[idx] += value
+
+    def snapshot(self):
+        """Return the current value of each counter as a dict."""
+        with self._values.get_lock():
+            return dict(zip(self.names, self._values[:]))
+
+    def handlers(self):
+        """Return the event handlers that update the default counters."""
+        def _count(name):
+            return lambda event: self.increment(name)
+
+        return [
+            (evt.EVT_ACCEPTED, _count('associations')),
+            (evt.EVT_RELEASED, _count('released')),
+            (evt.EVT_ABORTED, _count('aborted')),
+            (evt.EVT_REJECTED, _count('rejected')),
+            (evt.EVT_DIMSE_RECV, _count('messages')),
+        ]
+
+
+class MultiprocessServer(object):
+    """An SCP server run by several worker processes.
+
+    Parameters
+    ----------
+    address : tuple of (str, int)
+        The (host, port) to listen on.
+    setup : callable
+        Called in each worker process with the worker's number, it must
+        return the worker's (AE, event handlers).
+    workers : int, optional
+        The number of worker processes, by default one per CPU.
+    stats : SharedStats, optional
+        The counters to update, by default a new ``SharedStats``.
+    report_interval : float, optional
+        The number of seconds between logging the counters (default
+        ``60``), or ``None`` to never log them.
+    """
+    def __init__(self, address, setup, workers=None, stats=None,
+                 report_interval=60):
+        self.address = address
+        self.setup = setup
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = stats or SharedStats()
+        self.report_interval = report_interval
+        # {pid: worker number}
+        self._children = {}
+        self._stopping = False
+
+    def serve_forever(self):
+        """Start the workers and restart any that exit, until stopped.
+
+        Stopped by SIGINT or SIGTERM, which are passed on to the workers.
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for worker in range(self.workers):
+            self._start(worker)
+
+        reported = time.monotonic()
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid:
+                worker = self._children.pop(pid)
+                if not self._stopping:
+                    LOGGER.error(
+                        "Worker %d %s, restarting",
+                        worker, _exit_reason(status)
+                    )
+                    # Don't restart in a tight loop if setup keeps failing
+                    time.sleep(1)
+                    self._start(worker)
+
+                continue
+
+            if (
+                self.report_interval is not None
+                and time.monotonic() - reported > self.report_interval
+            ):
+                reported = time.monotonic()
+                LOGGER.info('Server statistics: %s', self.stats.snapshot())
+
+            time.sleep(0.5)
+
+    def shutdown(self):
+        """Stop the workers."""
+        self._stop()
+
+    def _start(self, worker):
+        """Fork the process for `worker`."""
+        pid = os.fork()
+        if pid:
+            self._children[pid] = worker
+            return
+
+        # In the worker process
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            ae, handlers = self.setup(worker)
+            server = ae.make_server(
+                self.address,
+                evt_handlers=list(handlers) + self.stats.handlers(),
+                server_class=ReusePortServer
+            )
+            server.serve_forever()
+        except Exception:
+            LOGGER.exception('Worker %d failed', worker)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum=None, frame=None):
+        """Pass on the signal to stop to the workers."""
+        self._stopping = True
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,364 @@
+"""
+Receive DIMSE data sets straight from the socket into a single buffer.
+
+pynetdicom assembles a received data set by reading each P-DATA-TF PDU in
+4096 byte chunks, joining them, copying the PDU to ``bytes``, slicing each
+PDV out of it (twice) and then appending the fragment to a ``BytesIO``, so
+every byte of a large C-STORE is copied five or six times and the buffer is
+repeatedly reallocated as it grows.
+
+A ``PDVReceiver`` replaces the reading of P-DATA-TF PDUs for the
+associations it's bound to. Each PDV's header is read on its own and its
+data set fragment is then read with ``socket.recv_into()`` directly into
+the end of a ``ReceivedDataset``. Its buffer is an anonymous memory map
+preallocated to the size of the previous data set received on the
+association, none of which uses any memory until it's written to, and if
+it needs to grow it's doubled in size by the kernel without copying.
+Command sets are small and are passed on to pynetdicom as
+usual. Once the last fragment arrives the ``ReceivedDataset`` becomes the
+request's *Data Set* (it's a ``BytesIO`` so nothing else needs to change)
+and ``encoded_dataset(event)`` returns a read-only ``memoryview`` of it,
+which can be written to file or decoded in another process without being
+copied::
+
+    receiver = PDVReceiver()
+    handlers = [(evt.EVT_C_STORE, handle_store)] + receiver.handlers()
+
+    def handle_store(event):
+        with open(path, 'wb') as fp:
+            fp.write(encoded_dataset(event))
+
+Other PDU types are read and decoded as before. ``evt.EVT_DATA_RECV`` and
+``evt.EVT_PDU_RECV`` are still triggered for every PDU, but for P-DATA-TF
+PDUs the PDU is never assembled in one piece. The ``EVT_DATA_RECV`` `data`
+is only the 6 byte PDU header, so handlers should take the PDU length from
+the header rather than from ``len(data)``, and the presentation data values
+of the ``EVT_PDU_RECV`` `pdu` are only the message control header for data
+set fragments. If reading a PDU fails for any reason other than the
+connection closing the association is aborted.
+``ReceivedDataset.getvalue()`` still returns a copy, as do
+``event.dataset`` and ``event.request.DataSet.read()``.
+"""
+from io import BytesIO
+import logging
+import mmap
+import socket
+from struct import unpack
+
+from pynetdicom import evt
+from pynetdicom.dimse_messages import DIMSEMessage
+from pynetdicom.pdu import P_DATA_TF
+from pynetdicom.pdu_primitives import P_DATA
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# The PDU types pynetdicom can decode
+_PDU_TYPES = (0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07)
+
+# P-DATA-TF
+_P_DATA_TF = 0x04
+
+
+def pdu_length(data):
+    """Return the length of the PDU received as ``EVT_DATA_RECV`` `data`.
+
+    Use instead of ``len(data)``, as the `data` may be just the PDU header.
+    """
+    if len(data) < 6:
+        return len(data)
+
+    return 6 + unpack('>L', data[2:6])[0]
+
+
+def encoded_dataset(event):
+    """Return the encoded *Data Set* of a request as a read-only buffer.
+
+    Parameters
+    ----------
+    event : events.Event
+        An event with a ``request`` that has a *Data Set*, such as
+        ``evt.EVT_C_STORE``.
+
+    Returns
+    -------
+    memoryview
+        The *Data Set* as received, without any copying if it was received
+        by a ``PDVReceiver``.
+    """
+    return event.request.DataSet.getbuffer().toreadonly()
+
+
+class ReceivedDataset(BytesIO):
+    """An encoded data set received directly into a memory mapped buffer.
+
+    Only the methods pynetdicom and pydicom use to read a ``BytesIO`` are
+    provided: ``read()``, ``seek()``, ``tell()``, ``getbuffer()`` and
+    ``getvalue()``, plus ``write()`` to append.
+
+    Parameters
+    ----------
+    size : int, optional
+        The number of bytes to preallocate (default ``65536``).
+    """
+    def __init__(self, size=65536):
+        super(ReceivedDataset, self).__init__()
+        self._buffer = mmap.mmap(
+            -1, max(size, mmap.PAGESIZE), flags=mmap.MAP_PRIVATE
+        )
+        self._size = 0
+        self._pos = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, nr_bytes):
+        """Return a writable memoryview of the next `nr_bytes` to append.
+
+        Use ``commit()`` once they've been filled.
+        """
+        end = self._size + nr_bytes
+        if end > len(self._buffer):
+            # Double the size so growing is only occasionally needed
+            self._buffer.resize(max(end, 2 * len(self._buffer)))
+
+        return memoryview(self._buffer)[self._size:end]
+
+    def commit(self, nr_bytes):
+        """Add the `nr_bytes` filled after ``reserve()`` to the data set."""
+        self._size += nr_bytes
+
+    def finish(self):
+        """Unmap any of the preallocated buffer that wasn't used."""
+        if self._size:
+            self._buffer.resize(self._size)
+
+    def write(self, data):
+        """Append `data` to the data set."""
+        nr_bytes = len(data)
+        if nr_bytes:
+            self.reserve(nr_bytes)[:] = data
+            self.commit(nr_bytes)
+
+        return nr_bytes
+
+    def read(self, size=-1):
+        """Return up to `size` bytes from the current position."""
+        start = self._pos
+        end = self._size if size is None or size < 0 else start + size
+        end = min(end, self._size)
+        self._pos = max(start, end)
+        return bytes(memoryview(self._buffer)[start:end])
+
+    def seek(self, offset, whence=0):
+        """Change the current position, as for ``io.BytesIO.seek()``."""
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+
+        if offset < 0:
+            raise ValueError('negative seek value {}'.format(offset))
+
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        """Return the current position."""
+        return self._pos
+
+    def getbuffer(self):
+        """Return a read-only memoryview of the data set, without copying."""
+        return memoryview(self._buffer)[:self._size].toreadonly()
+
+    def getvalue(self):
+        """Return a copy of the data set as :class:`bytes`."""
+        return bytes(self.getbuffer())
+
+
+class _Reader(object):
+    """Reads the PDUs of one association, replacing the DUL's reader."""
+    def __init__(self, dul, initial_size):
+        self.dul = dul
+        # The data set being received and the size of the last one
+        self.dataset = None
+        self.size_hint = initial_size
+        self._header = bytearray(6)
+
+    def _recv_into(self, view):
+        """Fill `view` from the socket, return ``False`` if closed early."""
+        sock = self.dul.socket.socket
+        nr_read = 0
+        nr_bytes = len(view)
+        while nr_read < nr_bytes:
+            count = sock.recv_into(view[nr_read:])
+            # The connection has been broken
+            if not count:
+                return False
+
+            nr_read += count
+
+        return True
+
+    def read_pdu_data(self):
+        """Read the next PDU, as ``DULServiceProvider._read_pdu_data()``."""
+        try:
+            self._read_pdu()
+        except (socket.error, socket.timeout):
+            self.dataset = None
+            # Evt17: Transport connection closed
+            self.dul.event_queue.put('Evt17')
+        except Exception as exc:
+            # Anything else would stop the DUL's thread and leave the
+            #   association hanging, so abort it instead
+            LOGGER.error('Unable to read the received PDU data')
+            LOGGER.exception(exc)
+            self.dataset = None
+            # Evt19: Unrecognised or invalid PDU received, which aborts
+            self.dul.event_queue.put('Evt19')
+
+    def _read_pdu(self):
+        """Read the next PDU and put its event on the DUL's queue."""
+        dul = self.dul
+        if not self._recv_into(memoryview(self._header)):
+            # Evt17: Transport connection closed
+            dul.event_queue.put('Evt17')
+            return
+
+        pdu_type, _, pdu_length = unpack('>BBL', self._header)
+        if pdu_type not in _PDU_TYPES:
+            # Evt19: Unrecognised or invalid PDU received
+            dul.event_queue.put('Evt19')
+            return
+
+        if pdu_type == _P_DATA_TF:
+            self._read_p_data(pdu_length)
+            return
+
+        # Other PDUs are small, so decode them as pynetdicom does
+        bytestream = bytearray(6 + pdu_length)
+        bytestream[:6] = self._header
+        if not self._recv_into(memoryview(bytestream)[6:]):
+            dul.event_queue.put('Evt17')
+            return
+
+        try:
+            pdu, event = dul._decode_pdu(bytestream)
+        except Exception as exc:
+            LOGGER.error('Unable to decode the received PDU data')
+            LOGGER.exception(exc)
+            dul.event_queue.put('Evt19')
+            return
+
+        dul.pdu = pdu
+        dul.primitive = pdu.to_primitive()
+        dul.event_queue.put(event)
+
+    def _read_p_data(self, pdu_length):
+        """Read the PDVs of a P-DATA-TF PDU into a P-DATA primitive."""
+        dul = self.dul
+        evt.trigger(
+            dul.assoc, evt.EVT_DATA_RECV, {'data': bytes(self._header)}
+        )
+
+        primitive = P_DATA()
+        item_header = bytearray(6)
+        remaining = pdu_length
+        while remaining:
+            if remaining < 6:
+                # Evt19: Unrecognised or invalid PDU received
+                dul.event_queue.put('Evt19')
+                return
+
+            if not self._recv_into(memoryview(item_header)):
+                # Evt17: Transport connection closed
+                dul.event_queue.put('Evt17')
+                return
+
+            # The item length includes the context ID and control header
+            item_length, context_id, control = unpack('>LBB', item_header)
+            if item_length < 2 or item_length + 4 > remaining:
+                # Evt19: Unrecognised or invalid PDU received
+                dul.event_queue.put('Evt19')
+                return
+
+            remaining -= item_length + 4
+            nr_bytes = item_length - 2
+            if control & 0x01:
+                # A command set fragment, pynetdicom wants the control
+                #   header followed by the fragment
+                data = bytearray(nr_bytes + 1)
+                data[0] = control
+                if not self._recv_into(memoryview(data)[1:]):
+                    dul.event_queue.put('Evt17')
+                    return
+            else:
+                # A data set fragment, read straight into the data set
+                if self.dataset is None:
+                    self.dataset = ReceivedDataset(self.size_hint)
+
+                if not self._recv_into(self.dataset.reserve(nr_bytes)):
+                    dul.event_queue.put('Evt17')
+                    return
+
+                self.dataset.commit(nr_bytes)
+                # pynetdicom only sees the control header
+                data = bytes([control])
+                if control & 0x02:
+                    # The last fragment
+                    self.dataset.finish()
+                    primitive.received_dataset = self.dataset
+                    self.size_hint = max(len(self.dataset), 1)
+                    self.dataset = None
+
+            primitive.presentation_data_value_list.append([context_id, data])
+
+        pdu = P_DATA_TF()
+        pdu.from_primitive(primitive)
+        evt.trigger(dul.assoc, evt.EVT_PDU_RECV, {'pdu': pdu})
+
+        dul.pdu = pdu
+        dul.primitive = primitive
+        # Evt10: P-DATA-TF PDU received
+        dul.event_queue.put('Evt10')
+
+
+class PDVReceiver(object):
+    """Receives data sets without copying them.
+
+    Parameters
+    ----------
+    initial_size : int, optional
+        The number of bytes preallocated for the first data set received on
+        an association, after which the size of the previous data set is
+        used (default ``65536``).
+    """
+    def __init__(self, initial_size=65536):
+        self.initial_size = initial_size
+
+    def handlers(self):
+        """Return the notification event handlers to bind."""
+        return [(evt.EVT_CONN_OPEN, self._on_open)]
+
+    def _on_open(self, event):
+        """Replace the association's PDU reader before anything is read."""
+        assoc = event.assoc
+        reader = _Reader(assoc.dul, self.initial_size)
+        dimse = assoc.dimse
+        receive_primitive = dimse.receive_primitive
+
+        def _receive_primitive(primitive):
+            # Use the assembled data set for the DIMSE message, the
+            #   fragments pynetdicom sees are empty
+            dataset = getattr(primitive, 'received_dataset', None)
+            if dataset is not None:
+                if dimse.message is None:
+                    dimse.message = DIMSEMessage()
+
+                dimse.message.data_set = dataset
+
+            receive_primitive(primitive)
+
+        # Only replaced for this association
+        assoc.dul._read_pdu_data = reader.read_pdu_data
+        dimse.receive_primitive = _receive_primitive
@@ -0,0 +1,127 @@
+"""
+On-disk layouts for the stored SOP Instances.
+
+Saving every instance into a single directory means that directory ends up
+with millions of entries and anything that lists it slows down. Instead the
+instances are spread over a tree of subdirectories so that each directory
+stays small:
+
+* ``HashedLayout`` places an instance by the hash of its SOP Instance UID,
+  e.g. ``root/3f/a2/1.2.3.4``, so its path can be found from the UID alone
+* ``HierarchicalLayout`` places an instance by its patient, study and series,
+  e.g. ``root/7c/1234567/1.2.3/1.2.3.4/1.2.3.4.5``, where the top level is a
+  bucket of patients
+"""
+import hashlib
+import os
+import re
+
+
+# Characters that aren't safe in a directory name are replaced
+_UNSAFE = re.compile(r'[^A-Za-z0-9._-]')
+
+
+def _bucket(value, width):
+    """Return the first `width` hex digits of the SHA-1 hash of `value`."""
+    return hashlib.sha1(value.encode('ascii', 'replace')).hexdigest()[:width]
+
+
+def _safe_name(value):
+    """Return `value` in a form that's safe to use as a directory name."""
+    value = _UNSAFE.sub('_', str(value or '').strip())
+    if value in ('', '.', '..'):
+        return 'UNKNOWN'
+
+    return value
+
+
+def iter_files(root):
+    """Yield the path of every stored file below the directory `root`.
+
+    Files still being written (with a ``.tmp`` suffix) are skipped.
+    """
+    directories = [root]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file() and not entry.name.endswith('.tmp'):
+                    yield entry.path
+
+
+class HashedLayout(object):
+    """Place each instance using the hash of its SOP Instance UID.
+
+    Parameters
+    ----------
+    root : str
+        The root directory of the archive.
+    depth : int, optional
+        The number of levels of subdirectories (default ``2``).
+    width : int, optional
+        The number of hex digits in each subdirectory name, so each directory
+        has at most ``16 ** width`` subdirectories (default ``2``).
+    """
+    def __init__(self, root, depth=2, width=2):
+        self.root = root
+        self.depth = depth
+        self.width = width
+
+    def path_for(self, sop_instance_uid, ds=None):
+        """Return the path to store the instance with `sop_instance_uid`."""
+        digest = _bucket(sop_instance_uid, self.depth * self.width)
+        parts = [
+            digest[ii:ii + self.width]
+            for ii in range(0, self.depth * self.width, self.width)
+        ]
+        return os.path.join(self.root, *parts, _safe_name(sop_instance_uid))
+
+    def find(self, sop_instance_uid):
+        """Return the path to the stored instance or ``None`` if not found."""
+        path = self.path_for(sop_instance_uid)
+        return path if os.path.isfile(path) else None
+
+
+class HierarchicalLayout(object):
+    """Place each instance under its patient, study and series.
+
+    Finding an instance by SOP Instance UID requires the archive index.
+
+    Parameters
+    ----------
+    root : str
+        The root directory of the archive.
+    fanout : int, optional
+        The number of buckets the patient directories are spread over, must
+        be a power of 16 (default ``256``).
+    index : archive_index.ArchiveIndex, optional
+        The archive index, used by ``find()``.
+    """
+    def __init__(self, root, fanout=256, index=None):
+        self.root = root
+        self.width = max(len('{:x}'.format(fanout - 1)), 1)
+        self.index = index
+
+    def path_for(self, sop_instance_uid, ds):
+        """Return the path to store the instance with `sop_instance_uid`.
+
+        `ds` must contain the *Patient ID*, *Study Instance UID* and *Series
+        Instance UID*, the header is enough.
+        """
+        patient_id = str(ds.get('PatientID', '') or '')
+        return os.path.join(
+            self.root,
+            _bucket(patient_id, self.width),
+            _safe_name(patient_id),
+            _safe_name(ds.get('StudyInstanceUID')),
+            _safe_name(ds.get('SeriesInstanceUID')),
+            _safe_name(sop_instance_uid)
+        )
+
+    def find(self, sop_instance_uid):
+        """Return the path to the stored instance or ``None`` if not found."""
+        if self.index is None:
+            return None
+
+        return self.index.lookup(sop_instance_uid)
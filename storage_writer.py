@@ -0,0 +1,198 @@
+"""
+A write-through pool for Storage SCPs.
+
+Rather than writing each received dataset to file on the association's
+thread, the C-STORE handler hands the write to a ``StorageWriter`` and waits
+for it to become durable. The writes from every association are shared
+between a pool of writer threads, each of which takes up to `batch_size`
+queued writes at a time and only has to sync their directories once per
+batch. The queue of pending writes is bounded so that when the disk can't
+keep up the handlers are pushed back on rather than buffering without limit.
+
+Each write goes to a temporary file of its own, so two associations storing
+the same SOP Instance at once each publish a complete file, and a write's
+future only succeeds once both the file and its directory entry have been
+synced.
+"""
+from concurrent.futures import Future
+import itertools
+import os
+import queue
+import threading
+
+from pydicom.filewriter import write_file_meta_info
+
+
+class StorageWriter(object):
+    """Write files on a pool of background threads.
+
+    Parameters
+    ----------
+    workers : int, optional
+        The number of writer threads (default ``4``).
+    max_queue : int, optional
+        The maximum number of writes waiting for a writer (default ``64``).
+    batch_size : int, optional
+        The maximum number of writes a writer takes from the queue at once
+        (default ``16``).
+    """
+    def __init__(self, workers=4, max_queue=64, batch_size=16):
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        # Numbers the temporary files, so writes to the same path don't
+        #   share one
+        self._ids = itertools.count()
+        self._threads = []
+        for ii in range(workers):
+            thread = threading.Thread(
+                target=self._run, name='StorageWriter-{}'.format(ii)
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, path, write, timeout=None):
+        """Queue a write of the file at `path`.
+
+        Parameters
+        ----------
+        path : str
+            The path to write the file to, any existing file is replaced.
+        write : callable
+            A callable that takes a single binary file-like parameter and
+            writes the file's contents to it.
+        timeout : float, optional
+            If the queue is full, the number of seconds to wait for space
+            before giving up. If ``None`` (default) then wait indefinitely.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            A future whose result is `path` once the file has been written and
+            synced to disk.
+
+        Raises
+        ------
+        queue.Full
+            If the queue is still full after `timeout` seconds.
+        """
+        future = Future()
+        self._queue.put((path, write, future), timeout=timeout)
+        return future
+
+    def shutdown(self):
+        """Finish the queued writes and stop the writer threads."""
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+        self._threads = []
+
+    def _next_batch(self):
+        """Return the next batch of writes, blocking until there's one."""
+        batch = [self._queue.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """Write batches of files until told to stop."""
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            if stop:
+                batch = batch[:-1]
+
+            written = []
+            for path, write, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    self._write(path, write)
+                    written.append((path, future))
+                except Exception as exc:
+                    future.set_exception(exc)
+
+            # Make the new directory entries durable, once per directory
+            failed = {}
+            directories = set(os.path.dirname(path) for path, _ in written)
+            for directory in directories:
+                try:
+                    _sync_directory(directory)
+                except OSError as exc:
+                    failed[directory] = exc
+
+            for path, future in written:
+                # The file may not survive a crash, so it's not a success
+                exc = failed.get(os.path.dirname(path))
+                if exc is None:
+                    future.set_result(path)
+                else:
+                    future.set_exception(exc)
+
+            if stop:
+                return
+
+    def _write(self, path, write):
+        """Write and sync a temporary file then move it to `path`."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Unique to this process and write, and with the '.tmp' suffix so
+        #   it's never mistaken for a stored file
+        tmp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), next(self._ids))
+        try:
+            with open(tmp_path, 'xb') as fp:
+                write(fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+            raise
+
+
+def write_raw(fp, file_meta, dataset):
+    """Write an encoded dataset to `fp` in the DICOM File Format.
+
+    The *Data Set* is written exactly as it was received, so it never has to
+    be decoded and re-encoded.
+
+    Parameters
+    ----------
+    fp : file-like
+        The binary file-like to write to.
+    file_meta : pydicom.dataset.Dataset
+        The File Meta Information, such as ``event.file_meta``. Its *Transfer
+        Syntax UID* must match the encoding of `dataset`.
+    dataset : io.BytesIO
+        The encoded *Data Set*, such as ``event.request.DataSet``.
+    """
+    # Preamble and DICOM prefix
+    fp.write(b'\x00' * 128)
+    fp.write(b'DICM')
+    write_file_meta_info(fp, file_meta, enforce_standard=True)
+    # Write straight from the received buffer, without making a copy
+    fp.write(dataset.getbuffer())
+
+
+def _sync_directory(directory):
+    """Sync the directory entries of `directory` to disk."""
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,7 @@
+"""pytest configuration, the modules under test are in the parent directory."""
+import os
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,95 @@
+"""Tests for admission.py, using real associations over loopback."""
+import threading
+import time
+
+from pynetdicom import AE
+from pynetdicom.sop_class import VerificationSOPClass
+
+from admission import AdmissionControl
+
+
+def start_scp(admission):
+    """Return an SCP using `admission` and its port."""
+    ae = AE()
+    ae.add_supported_context(VerificationSOPClass)
+    ae.maximum_associations = admission.ae_maximum_associations
+    scp = ae.start_server(
+        ('127.0.0.1', 0), block=False, evt_handlers=admission.handlers()
+    )
+    return scp, scp.socket.getsockname()[1]
+
+
+def associate(port):
+    """Return an association with the SCP at `port`."""
+    ae = AE()
+    ae.add_requested_context(VerificationSOPClass)
+    return ae.associate('127.0.0.1', port)
+
+
+def wait_for(condition, timeout=5):
+    """Return ``True`` once `condition()` is, ``False`` after `timeout`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(0.01)
+
+    return False
+
+
+def test_queued_request_is_admitted():
+    """A queued request is accepted once an association ends."""
+    admission = AdmissionControl(
+        max_associations=2, max_per_aet=2, max_queued=1, queue_timeout=10
+    )
+    scp, port = start_scp(admission)
+    try:
+        first = associate(port)
+        second = associate(port)
+        assert first.is_established and second.is_established
+        assert admission.active == 2
+
+        # Over the limit, so it waits in the queue
+        queued = []
+        thread = threading.Thread(
+            target=lambda: queued.append(associate(port))
+        )
+        thread.start()
+        assert wait_for(lambda: admission._queued == 1)
+        assert not queued
+
+        first.release()
+        thread.join(10)
+        assert queued and queued[0].is_established
+        assert admission.rejected == 0
+
+        second.release()
+        queued[0].release()
+    finally:
+        scp.shutdown()
+
+
+def test_rejected_when_queue_full():
+    """A request is rejected when the queue is already full."""
+    admission = AdmissionControl(
+        max_associations=1, max_per_aet=1, max_queued=0, queue_timeout=10
+    )
+    scp, port = start_scp(admission)
+    try:
+        first = associate(port)
+        assert first.is_established
+
+        second = associate(port)
+        assert second.is_rejected
+        assert admission.rejected == 1
+
+        first.release()
+    finally:
+        scp.shutdown()
+
+
+def test_ae_maximum_associations():
+    """pynetdicom's limit covers the admitted and queued requests."""
+    admission = AdmissionControl(max_associations=40, max_queued=20)
+    assert admission.ae_maximum_associations == 60
@@ -0,0 +1,193 @@
+"""Tests for ae_registry.py."""
+import json
+import os
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ImplicitVRLittleEndian
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import (
+    CTImageStorage, PatientRootQueryRetrieveInformationModelMove
+)
+import pytest
+
+import ae_registry
+from ae_registry import AERegistry
+
+
+class Clock(object):
+    """A replacement for the ``time`` module that's moved by hand."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ae_registry, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'destinations.json')
+
+
+def write(path, config, mtime):
+    """Write the registry file with a known modification time."""
+    with open(path, 'w') as fp:
+        json.dump(config, fp)
+
+    os.utime(path, (mtime, mtime))
+
+
+STORESCP = {'STORESCP': {'address': '127.0.0.1', 'port': 11113}}
+
+
+def test_lookup(clock, path):
+    """AE titles are found whether bytes or str, padded or not."""
+    write(path, STORESCP, 1)
+    registry = AERegistry(path)
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+    assert registry.lookup(b'STORESCP        ') == ('127.0.0.1', 11113)
+    assert registry.lookup('STORESCP') == ('127.0.0.1', 11113)
+    assert 'STORESCP' in registry
+    assert registry.lookup(b'UNKNOWN') is None
+    assert b'UNKNOWN' not in registry
+
+
+def test_reload(clock, path):
+    """The file is reloaded once it has changed and is due a check."""
+    write(path, STORESCP, 1)
+    registry = AERegistry(path, check_interval=5)
+
+    moved = {'STORESCP': {'address': '127.0.0.1', 'port': 104}}
+    write(path, moved, 2)
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+
+    clock.now += 5
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 104)
+
+    # Removed destinations are gone
+    write(path, {}, 3)
+    clock.now += 5
+    assert registry.lookup(b'STORESCP') is None
+
+
+def test_reload_invalid(clock, path):
+    """The last good configuration is kept if the file can't be used."""
+    write(path, STORESCP, 1)
+    registry = AERegistry(path, check_interval=0)
+
+    with open(path, 'w') as fp:
+        fp.write('{"STORESCP": {"address"')
+
+    os.utime(path, (2, 2))
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+
+    write(path, {'STORESCP': {'address': '127.0.0.1'}}, 3)
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+
+    write(path, ['STORESCP'], 4)
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+
+    os.remove(path)
+    assert registry.lookup(b'STORESCP') == ('127.0.0.1', 11113)
+
+
+def test_unknown(clock, path):
+    """An unknown AE title is looked for at once, then remembered."""
+    write(path, STORESCP, 1)
+    registry = AERegistry(path, check_interval=300, negative_ttl=60)
+
+    # Added before the next check is due, but found anyway
+    added = dict(STORESCP)
+    added['NEWSCP'] = {'address': '127.0.0.1', 'port': 11114}
+    write(path, added, 2)
+    assert registry.lookup(b'NEWSCP') == ('127.0.0.1', 11114)
+
+    assert registry.lookup(b'LATESCP') is None
+    added['LATESCP'] = {'address': '127.0.0.1', 'port': 11115}
+    write(path, added, 3)
+    clock.now += 59
+    assert registry.lookup(b'LATESCP') is None
+
+    clock.now += 1
+    assert registry.lookup(b'LATESCP') == ('127.0.0.1', 11115)
+
+
+def test_move_unknown_destination(clock, path):
+    """A C-MOVE to an unknown destination is rejected, as by the Move SCP."""
+    received = []
+    store_ae = AE(b'STORESCP')
+    store_ae.add_supported_context(CTImageStorage)
+    store_scp = store_ae.start_server(
+        ('127.0.0.1', 0), block=False, evt_handlers=[
+            (evt.EVT_C_STORE, lambda event: received.append(event) or 0)
+        ]
+    )
+    store_port = store_scp.socket.getsockname()[1]
+    write(path, {'STORESCP': {'address': '127.0.0.1', 'port': store_port}}, 1)
+    registry = AERegistry(path)
+
+    instance = Dataset()
+    instance.SOPClassUID = CTImageStorage
+    instance.SOPInstanceUID = '1.2.3.4'
+    instance.PatientID = '1234'
+    instance.file_meta = FileMetaDataset()
+    instance.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    instance.is_little_endian = True
+    instance.is_implicit_VR = True
+
+    def handle_move(event):
+        # As Query_Retrieve_Move_SCP.py
+        destination = registry.lookup(event.move_destination)
+        if destination is None:
+            yield (None, None)
+            return
+
+        (addr, port) = destination
+        yield (addr, port)
+        yield 1
+        yield (0xFF00, instance)
+
+    move_ae = AE()
+    move_ae.add_requested_context(CTImageStorage)
+    move_ae.add_supported_context(
+        PatientRootQueryRetrieveInformationModelMove
+    )
+    move_scp = move_ae.start_server(
+        ('127.0.0.1', 0), block=False,
+        evt_handlers=[(evt.EVT_C_MOVE, handle_move)]
+    )
+    move_port = move_scp.socket.getsockname()[1]
+
+    query = Dataset()
+    query.QueryRetrieveLevel = 'PATIENT'
+    query.PatientID = '1234'
+    scu = AE()
+    scu.add_requested_context(PatientRootQueryRetrieveInformationModelMove)
+    assoc = scu.associate('127.0.0.1', move_port)
+    try:
+        assert assoc.is_established
+        model = PatientRootQueryRetrieveInformationModelMove
+        statuses = [
+            status.Status for status, _ in
+            assoc.send_c_move(query, b'UNKNOWN', model)
+        ]
+        # Move Destination unknown
+        assert statuses == [0xA801]
+        assert not received
+
+        statuses = [
+            status.Status for status, _ in
+            assoc.send_c_move(query, b'STORESCP', model)
+        ]
+        assert statuses[-1] == 0x0000
+        assert len(received) == 1
+    finally:
+        assoc.release()
+        move_scp.shutdown()
+        store_scp.shutdown()
@@ -0,0 +1,119 @@
+"""Tests for archive_index.py."""
+import os
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ImplicitVRLittleEndian, generate_uid
+from pynetdicom.sop_class import CTImageStorage
+import pytest
+
+from archive_index import ArchiveIndex
+from matching import compile_query
+
+
+def write_instance(path, patient_id, modality='CT'):
+    """Write a small instance to `path` and return its SOP Instance UID."""
+    ds = Dataset()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = generate_uid()
+    ds.PatientID = patient_id
+    ds.StudyInstanceUID = '1.2.3'
+    ds.SeriesInstanceUID = '1.2.3.4'
+    ds.Modality = modality
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = ds.SOPClassUID
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    ds.is_implicit_VR = True
+    ds.is_little_endian = True
+    ds.save_as(path, write_like_original=False)
+    return ds.SOPInstanceUID
+
+
+@pytest.fixture
+def archive(tmpdir):
+    """Return an archive directory with two instances in subdirectories."""
+    fdir = str(tmpdir.mkdir('archive'))
+    for name, patient_id in (('a', '1'), ('b', '2')):
+        os.mkdir(os.path.join(fdir, name))
+        write_instance(os.path.join(fdir, name, name + '.dcm'), patient_id)
+
+    return fdir
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = ArchiveIndex(str(tmpdir.join('index.sqlite')))
+    yield index
+    index.close()
+
+
+def test_sync(archive, index):
+    """Only new, changed and removed files change the index."""
+    generation = index.generation
+    assert index.sync(archive) == (2, 0)
+    assert len(index.search()) == 2
+    # One change for the whole sync
+    assert index.generation == generation + 1
+    generation = index.generation
+
+    # Nothing has changed, so nothing is read
+    assert index.sync(archive) == (0, 0)
+    assert index.generation == generation
+
+    # A changed file is read again
+    path = os.path.join(archive, 'a', 'a.dcm')
+    uid = write_instance(path, '3')
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+    assert index.sync(archive) == (1, 0)
+    assert index.lookup(uid) == os.path.abspath(path)
+    assert [row['patient_id'] for row in index.search(patient_id='3')] == [
+        '3'
+    ]
+    assert index.search(patient_id='1') == []
+
+    # A removed file is removed from the index
+    os.remove(os.path.join(archive, 'b', 'b.dcm'))
+    assert index.sync(archive) == (0, 1)
+    assert index.search(patient_id='2') == []
+    assert index.generation == generation + 2
+
+
+def test_sync_skips_other_files(archive, index):
+    """Files that aren't DICOM and files still being written are skipped."""
+    with open(os.path.join(archive, 'notes.txt'), 'w') as fp:
+        fp.write('not DICOM')
+
+    write_instance(os.path.join(archive, 'c.dcm.tmp'), '4')
+    assert index.sync(archive) == (2, 0)
+    assert index.search(patient_id='4') == []
+
+
+def test_sync_shared(archive, tmpdir):
+    """Changes made through one index are seen by another on the file."""
+    path = str(tmpdir.join('index.sqlite'))
+    first = ArchiveIndex(path)
+    second = ArchiveIndex(path)
+    try:
+        generation = second.generation
+        first.sync(archive)
+        assert second.generation > generation
+        assert len(second.search()) == 2
+        assert second.sync(archive) == (0, 0)
+    finally:
+        first.close()
+        second.close()
+
+
+def test_query(archive, index):
+    """Matching instances are found after a sync."""
+    index.sync(archive)
+    query = Dataset()
+    query.QueryRetrieveLevel = 'IMAGE'
+    query.PatientID = '2'
+    query.SOPInstanceUID = ''
+    results = list(index.query(compile_query(query)))
+    assert len(results) == 1
+    path, candidate = results[0]
+    assert path == os.path.abspath(os.path.join(archive, 'b', 'b.dcm'))
+    assert candidate['PatientID'] == '2'
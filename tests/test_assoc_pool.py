@@ -0,0 +1,107 @@
+"""Tests for assoc_pool.py, using real associations over loopback."""
+import socket
+
+from pynetdicom import AE, build_context, evt
+from pynetdicom.sop_class import CTImageStorage, VerificationSOPClass
+
+from assoc_pool import MAX_CONTEXTS, AssociationPool, _is_connected
+
+
+def start_scp(echoes):
+    """Return a Storage and Verification SCP and its port."""
+    ae = AE()
+    ae.add_supported_context(CTImageStorage)
+    ae.add_supported_context(VerificationSOPClass)
+
+    def handle_echo(event):
+        echoes.append(event)
+        return 0x0000
+
+    scp = ae.start_server(
+        ('127.0.0.1', 0), block=False,
+        evt_handlers=[(evt.EVT_C_ECHO, handle_echo)]
+    )
+    return scp, scp.socket.getsockname()[1]
+
+
+def test_reuse_checked_with_echo():
+    """An idle association is checked with a C-ECHO and reused."""
+    echoes = []
+    scp, port = start_scp(echoes)
+    pool = AssociationPool(AE(), check_after=0)
+    try:
+        contexts = [build_context(CTImageStorage)]
+        with pool.association('127.0.0.1', port, contexts=contexts) as first:
+            assert first.is_established
+
+        with pool.association('127.0.0.1', port, contexts=contexts) as second:
+            assert second is first
+
+        assert len(echoes) == 1
+    finally:
+        pool.close()
+        scp.shutdown()
+
+
+def test_reuse_without_verification():
+    """With no room for a Verification context the connection is checked."""
+    echoes = []
+    scp, port = start_scp(echoes)
+    pool = AssociationPool(AE(), check_after=0)
+    contexts = [build_context(CTImageStorage)]
+    contexts += [
+        build_context('1.2.3.{}'.format(ii)) for ii in range(MAX_CONTEXTS - 1)
+    ]
+    try:
+        with pool.association('127.0.0.1', port, contexts=contexts) as first:
+            assert first.is_established
+            assert len(first.requestor.requested_contexts) == MAX_CONTEXTS
+
+        with pool.association('127.0.0.1', port, contexts=contexts) as second:
+            assert second is first
+
+        assert echoes == []
+
+        # Once the peer has closed the connection a new one is requested
+        for assoc in scp.active_associations:
+            assoc.dul.socket.socket.shutdown(socket.SHUT_RDWR)
+
+        with pool.association('127.0.0.1', port, contexts=contexts) as third:
+            assert third is not first
+            assert third.is_established
+    finally:
+        pool.close()
+        scp.shutdown()
+
+
+class _Socket(object):
+    def __init__(self, sock):
+        self.socket = sock
+
+
+class _DUL(object):
+    def __init__(self, sock):
+        self.socket = _Socket(sock)
+
+
+class _Association(object):
+    def __init__(self, sock):
+        self.dul = _DUL(sock)
+
+
+def test_is_connected():
+    """A socket closed by the peer isn't connected."""
+    local, remote = socket.socketpair()
+    try:
+        assoc = _Association(local)
+        assert _is_connected(assoc)
+
+        # Pending data is left in place
+        remote.sendall(b'\x01')
+        assert _is_connected(assoc)
+        assert local.recv(1) == b'\x01'
+
+        remote.close()
+        assert not _is_connected(assoc)
+    finally:
+        local.close()
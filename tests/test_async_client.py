@@ -0,0 +1,54 @@
+"""Tests for async_client.py, using real associations over loopback."""
+import asyncio
+import socket
+
+from pynetdicom import AE
+from pynetdicom.sop_class import VerificationSOPClass
+
+from async_client import associate
+
+
+def test_echo():
+    """Requests are run and the thread is stopped after release."""
+    scp_ae = AE()
+    scp_ae.add_supported_context(VerificationSOPClass)
+    scp = scp_ae.start_server(('127.0.0.1', 0), block=False)
+    port = scp.socket.getsockname()[1]
+
+    ae = AE()
+    ae.add_requested_context(VerificationSOPClass)
+
+    async def run():
+        assoc = await associate(ae, '127.0.0.1', port)
+        assert assoc.is_established
+        status = await assoc.send_c_echo()
+        await assoc.release()
+        return status, assoc
+
+    try:
+        status, assoc = asyncio.run(run())
+        assert status.Status == 0x0000
+        assert assoc._executor._shutdown
+    finally:
+        scp.shutdown()
+
+
+def test_not_established():
+    """The thread is stopped if the association isn't established."""
+    # Find a port with nothing listening on it
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    ae = AE()
+    ae.add_requested_context(VerificationSOPClass)
+
+    async def run():
+        assoc = await associate(ae, '127.0.0.1', port)
+        await assoc.release()
+        return assoc
+
+    assoc = asyncio.run(run())
+    assert not assoc.is_established
+    assert assoc._executor._shutdown
@@ -0,0 +1,91 @@
+"""Tests for bulk_store.py, sending to a Storage SCP over loopback."""
+import os
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import (
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, generate_uid
+)
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import CTImageStorage, MRImageStorage
+
+from bulk_store import MAX_CONTEXTS, build_contexts, split_groups, BulkSender
+
+
+def write_instance(path, sop_class, transfer_syntax):
+    """Write a small instance to `path`."""
+    ds = Dataset()
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = generate_uid()
+    ds.PatientID = '1234'
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = sop_class
+    ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.is_implicit_VR = transfer_syntax.is_implicit_VR
+    ds.is_little_endian = transfer_syntax.is_little_endian
+    ds.save_as(path, write_like_original=False)
+
+
+def test_build_contexts():
+    """Each transfer syntax gets its own presentation context."""
+    groups = {
+        (CTImageStorage, ImplicitVRLittleEndian): ['a'],
+        (CTImageStorage, ExplicitVRLittleEndian): ['b'],
+    }
+    contexts = build_contexts(groups)
+    assert len(contexts) == 2
+    assert all(len(cx.transfer_syntax) == 1 for cx in contexts)
+
+
+def test_split_groups():
+    """Groups needing more than 128 contexts are split into batches."""
+    groups = {('1.2.{}'.format(ii), ImplicitVRLittleEndian): ['a']
+              for ii in range(MAX_CONTEXTS + 2)}
+    batches = split_groups(groups)
+    assert [len(batch) for batch in batches] == [MAX_CONTEXTS, 2]
+    assert sum(len(build_contexts(batch)) for batch in batches) == 130
+
+
+def test_send(tmpdir):
+    """Every transfer syntax is sent and each summary is of one call."""
+    received = []
+
+    def handle_store(event):
+        received.append(event.context.transfer_syntax)
+        return 0x0000
+
+    ae = AE()
+    for sop_class in (CTImageStorage, MRImageStorage):
+        ae.add_supported_context(
+            sop_class, [ImplicitVRLittleEndian, ExplicitVRLittleEndian]
+        )
+
+    scp = ae.start_server(
+        ('127.0.0.1', 0), block=False,
+        evt_handlers=[(evt.EVT_C_STORE, handle_store)]
+    )
+    port = scp.socket.getsockname()[1]
+
+    paths = []
+    for ii, sop_class in enumerate((CTImageStorage, MRImageStorage)):
+        for jj, syntax in enumerate(
+            (ImplicitVRLittleEndian, ExplicitVRLittleEndian)
+        ):
+            path = os.path.join(str(tmpdir), '{}{}.dcm'.format(ii, jj))
+            write_instance(path, sop_class, syntax)
+            paths.append(path)
+
+    try:
+        sender = BulkSender('127.0.0.1', port, associations=2)
+        summary = sender.send(paths)
+        assert summary['sent'] == 4
+        assert summary['failed'] == []
+        assert sorted(set(received)) == sorted(
+            [ImplicitVRLittleEndian, ExplicitVRLittleEndian]
+        )
+
+        summary = sender.send(paths[:1])
+        assert summary['sent'] == 1
+        assert summary['bytes'] == os.path.getsize(paths[0])
+    finally:
+        scp.shutdown()
@@ -0,0 +1,80 @@
+"""Tests for dataset_loader.py."""
+import os
+import threading
+import time
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ImplicitVRLittleEndian, generate_uid
+
+from pynetdicom.sop_class import CTImageStorage
+
+from dataset_loader import iter_instances
+
+
+def write_instances(fdir, count):
+    """Write `count` small instances to `fdir` and return their paths."""
+    paths = []
+    for ii in range(count):
+        ds = Dataset()
+        ds.SOPInstanceUID = generate_uid()
+        ds.InstanceNumber = ii
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+        ds.is_implicit_VR = True
+        ds.is_little_endian = True
+        path = os.path.join(fdir, '{}.dcm'.format(ii))
+        ds.save_as(path, write_like_original=False)
+        paths.append(path)
+
+    return paths
+
+
+def readers():
+    """Return the running read ahead threads."""
+    return [tt for tt in threading.enumerate() if tt.name == 'ReadAhead']
+
+
+def test_iter_instances(tmpdir):
+    """The datasets are yielded in order."""
+    paths = write_instances(str(tmpdir), 5)
+    numbers = [ds.InstanceNumber for ds in iter_instances(paths, 2)]
+    assert numbers == [0, 1, 2, 3, 4]
+
+
+def test_unreadable_file(tmpdir):
+    """A file that can't be read is yielded as an exception."""
+    paths = write_instances(str(tmpdir), 2)
+    paths.insert(1, os.path.join(str(tmpdir), 'missing.dcm'))
+    instances = list(iter_instances(paths))
+    assert len(instances) == 3
+    assert instances[0].InstanceNumber == 0
+    assert isinstance(instances[1], OSError)
+    assert instances[2].InstanceNumber == 1
+
+
+def test_close_stops_reader(tmpdir):
+    """The reader thread ends when the consumer stops early."""
+    paths = write_instances(str(tmpdir), 5)
+    before = len(readers())
+    instances = iter_instances(paths, 1)
+    next(instances)
+    # The reader is now blocked on the full buffer
+    time.sleep(0.2)
+    instances.close()
+
+    deadline = time.monotonic() + 5
+    while len(readers()) > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert len(readers()) == before
+
+
+def test_paths_error():
+    """An error getting the next path ends the datasets."""
+    def paths():
+        raise RuntimeError('No more')
+        yield
+
+    assert list(iter_instances(paths())) == []
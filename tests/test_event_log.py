@@ -0,0 +1,185 @@
+"""Tests for event_log.py, using real associations over loopback."""
+import json
+import os
+import time
+
+from pynetdicom import AE
+from pynetdicom.sop_class import VerificationSOPClass
+import pytest
+
+from event_log import EventLog
+
+
+CALLING_AET = b'LOGSCU'
+
+
+def wait_for(condition, timeout=5):
+    """Return ``True`` once `condition()` is, ``False`` after `timeout`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(0.01)
+
+    return False
+
+
+def read_records(path):
+    """Return the records written to the log file at `path`."""
+    with open(path, 'r', encoding='utf-8') as fp:
+        return [json.loads(line) for line in fp]
+
+
+@pytest.fixture
+def scp():
+    """Return a function that starts a Verification SCP using a log."""
+    servers = []
+
+    def start(event_log):
+        ae = AE()
+        ae.add_supported_context(VerificationSOPClass)
+        server = ae.start_server(
+            ('127.0.0.1', 0), block=False, evt_handlers=event_log.handlers()
+        )
+        servers.append(server)
+        return server.socket.getsockname()[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def echo(port):
+    """Associate with the SCP at `port`, send a C-ECHO and release."""
+    ae = AE(ae_title=CALLING_AET)
+    ae.add_requested_context(VerificationSOPClass)
+    assoc = ae.associate('127.0.0.1', port)
+    assert assoc.is_established
+    assert assoc.send_c_echo().Status == 0x0000
+    assoc.release()
+
+
+def write_control(path, config, mtime):
+    """Write `config` to the control file at `path` with `mtime`."""
+    with open(path, 'w') as fp:
+        json.dump(config, fp)
+
+    # Make sure the change is seen however coarse the file system's times
+    os.utime(path, (mtime, mtime))
+
+
+class _NoWake(object):
+    """Stands in for the writer's wake-up event so it isn't woken."""
+    def set(self):
+        pass
+
+
+def test_ring_buffer_overwrite(tmpdir):
+    """The oldest records are overwritten and counted once full."""
+    path = str(tmpdir.join('events.jsonl'))
+    event_log = EventLog(path, capacity=4, flush_interval=3600)
+    wake, event_log._wake = event_log._wake, _NoWake()
+    for ii in range(6):
+        event_log._append((ii, 'EVT_RELEASED', '127.0.0.1', 'A'))
+
+    assert event_log.dropped == 2
+
+    event_log._wake = wake
+    event_log.close()
+    assert [rr['t'] for rr in read_records(path)] == [2, 3, 4, 5]
+    assert event_log.dropped == 0
+
+
+def test_event_filter(tmpdir, scp):
+    """Only the configured events are logged."""
+    path = str(tmpdir.join('events.jsonl'))
+    event_log = EventLog(path, events=['EVT_ACCEPTED', 'EVT_DIMSE_RECV'])
+    echo(scp(event_log))
+    event_log.close()
+
+    records = read_records(path)
+    assert [rr['event'] for rr in records] == [
+        'EVT_ACCEPTED', 'EVT_DIMSE_RECV'
+    ]
+    assert records[0]['ae_title'] == CALLING_AET.decode()
+    assert records[1]['command'] == 0x0030
+
+
+def test_peer_filter(tmpdir, scp):
+    """Only the configured peers are logged, by AE title or address."""
+    path = str(tmpdir.join('events.jsonl'))
+    event_log = EventLog(path, events=['EVT_ACCEPTED'], peers=['OTHER'])
+    port = scp(event_log)
+    echo(port)
+
+    event_log.configure(['EVT_ACCEPTED'], [CALLING_AET.decode()])
+    echo(port)
+    event_log.configure(['EVT_ACCEPTED'], ['127.0.0.1'])
+    echo(port)
+    event_log.close()
+
+    assert len(read_records(path)) == 2
+
+
+def test_sampling(tmpdir, scp):
+    """Whole associations are sampled."""
+    path = str(tmpdir.join('events.jsonl'))
+    event_log = EventLog(path, sample_rate=0)
+    port = scp(event_log)
+    echo(port)
+
+    event_log.configure(sample_rate=1)
+    echo(port)
+    event_log.close()
+
+    records = read_records(path)
+    # Every event of the second association, none of the first
+    assert records[0]['event'] == 'EVT_CONN_OPEN'
+    assert records[-1]['event'] == 'EVT_CONN_CLOSE'
+    assert len(set(rr['event'] for rr in records)) > 5
+
+    with pytest.raises(ValueError):
+        event_log.configure(sample_rate=2)
+
+
+def test_reload(tmpdir, scp):
+    """The control file is reloaded while running."""
+    path = str(tmpdir.join('events.jsonl'))
+    control = str(tmpdir.join('control.json'))
+    write_control(control, {'events': ['EVT_RELEASED']}, 1000)
+    event_log = EventLog(
+        path, flush_interval=0.05, control=control, sample_rate=0.5
+    )
+    assert event_log._events == frozenset(['EVT_RELEASED'])
+    # Left out of the control file, so not changed
+    assert event_log._sample_rate == 0.5
+
+    config = {'events': ['EVT_ACCEPTED'], 'sample_rate': 1}
+    write_control(control, config, 2000)
+    assert wait_for(lambda: event_log._events == frozenset(['EVT_ACCEPTED']))
+    echo(scp(event_log))
+    event_log.close()
+
+    assert [rr['event'] for rr in read_records(path)] == ['EVT_ACCEPTED']
+
+
+@pytest.mark.parametrize('config', [
+    '[]', '3', 'null', '{"events": ["EVT_UNKNOWN"]}', '{"sample_rate": "x"}',
+    '{"events": 1}', 'not JSON'
+])
+def test_reload_invalid(tmpdir, config):
+    """A bad control file is logged and leaves the configuration as it is."""
+    control = str(tmpdir.join('control.json'))
+    with open(control, 'w') as fp:
+        fp.write(config)
+
+    event_log = EventLog(
+        str(tmpdir.join('events.jsonl')), control=control,
+        events=['EVT_ABORTED'], sample_rate=0.1
+    )
+    try:
+        assert event_log._events == frozenset(['EVT_ABORTED'])
+        assert event_log._sample_rate == 0.1
+    finally:
+        event_log.close()
@@ -0,0 +1,155 @@
+"""Tests for find_cache.py."""
+from pydicom.dataset import Dataset
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+from pynetdicom.dsutils import encode
+import pytest
+
+import find_cache
+from find_cache import FindCache, pre_encode
+
+
+class Clock(object):
+    """A replacement for the ``time`` module that's moved by hand."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(find_cache, 'time', clock)
+    return clock
+
+
+def identifier(**kwargs):
+    ds = Dataset()
+    ds.QueryRetrieveLevel = 'PATIENT'
+    for keyword, value in kwargs.items():
+        setattr(ds, keyword, value)
+
+    return ds
+
+
+def test_pre_encode():
+    """The encoded response is the same as the original."""
+    ds = identifier(PatientName='Citizen^Jan', PatientID='1234')
+    for syntax in (ImplicitVRLittleEndian, ExplicitVRLittleEndian):
+        encoded = pre_encode(ds, syntax)
+        args = (syntax.is_implicit_VR, syntax.is_little_endian)
+        assert encode(encoded, *args) == encode(ds, *args)
+
+
+def test_key():
+    """The key doesn't depend on the order the elements were added in."""
+    first = identifier(PatientName='A*', PatientID='')
+    second = Dataset()
+    second.PatientID = ''
+    second.PatientName = 'A*'
+    second.QueryRetrieveLevel = 'PATIENT'
+    key = FindCache.key(first, ImplicitVRLittleEndian)
+    assert key == FindCache.key(second, ImplicitVRLittleEndian)
+    assert key != FindCache.key(first, ExplicitVRLittleEndian)
+
+
+def test_generation(clock):
+    """Responses from an earlier generation of the index are discarded."""
+    cache = FindCache()
+    cache.put('key', 1, ['response'])
+    assert cache.get('key', 1) == ['response']
+    assert cache.get('key', 2) is None
+    # Discarded, not just hidden
+    assert cache.get('key', 1) is None
+
+
+def test_ttl(clock):
+    """Responses are discarded once they're older than the TTL."""
+    cache = FindCache(ttl=30)
+    cache.put('key', 1, ['response'])
+    clock.now += 29
+    assert cache.get('key', 1) == ['response']
+
+    # Getting the responses doesn't make them any younger
+    clock.now += 2
+    assert cache.get('key', 1) is None
+
+
+def test_lru(clock):
+    """The least recently used query is removed when the cache is full."""
+    cache = FindCache(maxsize=2)
+    cache.put('a', 1, ['a'])
+    cache.put('b', 1, ['b'])
+    assert cache.get('a', 1) == ['a']
+    cache.put('c', 1, ['c'])
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) == ['a']
+    assert cache.get('c', 1) == ['c']
+
+
+def test_max_responses(clock):
+    """Queries with too many responses aren't cached."""
+    cache = FindCache(max_responses=2)
+    cache.put('key', 1, ['a', 'b', 'c'])
+    assert cache.get('key', 1) is None
+    cache.put('key', 1, ['a', 'b'])
+    assert cache.get('key', 1) == ['a', 'b']
+
+    cache.clear()
+    assert cache.get('key', 1) is None
+
+
+def test_key_unencodable(clock):
+    """A query that can't be encoded has no key and isn't cached."""
+    ds = identifier(Rows='not a number')
+    key = FindCache.key(ds, ImplicitVRLittleEndian)
+    assert key is None
+
+    cache = FindCache()
+    cache.put(key, 1, ['response'])
+    assert cache.get(key, 1) is None
+    assert not cache._entries
+
+
+def test_responses(clock):
+    """Responses that couldn't be encoded are skipped, the rest cached."""
+    syntax = ImplicitVRLittleEndian
+    good = pre_encode(identifier(PatientID='1234'), syntax)
+    bad = pre_encode(identifier(Rows='not a number'), syntax)
+    assert bad is None
+
+    cache = FindCache()
+    key = FindCache.key(identifier(PatientID=''), syntax)
+    built = []
+
+    def build():
+        built.append(True)
+        return iter([bad, good, bad])
+
+    responses = list(cache.responses(key, 1, build, lambda: 1))
+    assert responses == [good]
+    assert cache.get(key, 1) == [good]
+
+    # Answered from the cache
+    assert list(cache.responses(key, 1, build, lambda: 1)) == [good]
+    assert len(built) == 1
+
+
+def test_responses_changed(clock):
+    """New responses aren't cached if the index changed while being made."""
+    cache = FindCache()
+    responses = cache.responses('key', 1, lambda: ['response'], lambda: 2)
+    assert list(responses) == ['response']
+    assert cache.get('key', 1) is None
+
+
+def test_responses_stopped(clock):
+    """New responses aren't cached if they weren't all yielded."""
+    cache = FindCache()
+    responses = cache.responses(
+        'key', 1, lambda: ['first', 'second'], lambda: 1
+    )
+    assert next(responses) == 'first'
+    responses.close()
+    assert cache.get('key', 1) is None
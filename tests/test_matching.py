@@ -0,0 +1,151 @@
+"""Tests for matching.py, the SQL and in-memory matching must agree."""
+import sqlite3
+
+from pydicom.dataset import Dataset
+import pytest
+
+from matching import QueryPlan, compile_query
+
+
+# The StudyDate, Modality and PatientName of the candidates
+CANDIDATES = [
+    ('20191231', 'CT', 'Citizen^Jan'),
+    ('20200101', 'MR', 'Citizen^Jo'),
+    ('20200615', 'CT', 'Doe^John'),
+    ('20210101', 'US', 'Doe^Jane'),
+    ('', 'CT', ''),
+    (None, None, None),
+]
+
+COLUMNS = {
+    'StudyDate': 'study_date',
+    'Modality': 'modality',
+    'PatientName': 'patient_name',
+}
+
+
+@pytest.fixture(scope='module')
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE instances (id INTEGER, study_date TEXT, modality TEXT, '
+        'patient_name TEXT)'
+    )
+    conn.executemany(
+        'INSERT INTO instances VALUES (?, ?, ?, ?)',
+        [(ii, ) + cc for ii, cc in enumerate(CANDIDATES)]
+    )
+    yield conn
+    conn.close()
+
+
+def candidate(values):
+    """Return the candidate dict for a row of CANDIDATES."""
+    return dict(zip(['StudyDate', 'Modality', 'PatientName'], values))
+
+
+def sql_matches(conn, plan):
+    """Return the indices of the candidates matched by `plan` in SQL."""
+    clauses, residual = plan.split(COLUMNS)
+    assert not residual
+    sql = 'SELECT id FROM instances'
+    params = []
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(cc for cc, _ in clauses)
+        for _, pp in clauses:
+            params.extend(pp)
+
+    return sorted(row[0] for row in conn.execute(sql, params))
+
+
+def memory_matches(plan):
+    """Return the indices of the candidates matched by ``plan.matches()``."""
+    return [
+        ii for ii, cc in enumerate(CANDIDATES)
+        if plan.matches(candidate(cc))
+    ]
+
+
+@pytest.mark.parametrize('keyword, value', [
+    ('StudyDate', '20200101'),
+    ('StudyDate', '20200101-20201231'),
+    ('StudyDate', '20200101-'),
+    ('StudyDate', '-20200101'),
+    ('StudyDate', '-20251231'),
+    ('Modality', 'CT'),
+    ('Modality', 'C*'),
+    ('PatientName', 'Citizen^J?'),
+    ('PatientName', 'Doe*'),
+])
+def test_sql_agrees(conn, keyword, value):
+    """The SQL and in-memory matching return the same candidates."""
+    ds = Dataset()
+    setattr(ds, keyword, value)
+    plan = QueryPlan(ds)
+    assert plan.matchers
+    assert sql_matches(conn, plan) == memory_matches(plan)
+
+
+def test_upper_only_range_excludes_empty(conn):
+    """An upper-only date range doesn't match empty values."""
+    ds = Dataset()
+    ds.StudyDate = '-20251231'
+    plan = QueryPlan(ds)
+    assert sql_matches(conn, plan) == [0, 1, 2, 3]
+    assert not plan.matches(candidate(('', 'CT', '')))
+
+
+def test_universal_matching():
+    """A key with no value or a lone '*' matches anything."""
+    ds = Dataset()
+    ds.PatientName = '*'
+    ds.StudyDate = ''
+    assert QueryPlan(ds).matchers == []
+
+
+def test_compile_query_level():
+    """The Query/Retrieve Level is required and limits the keys."""
+    ds = Dataset()
+    ds.QueryRetrieveLevel = 'PATIENT'
+    ds.PatientID = '1234'
+    ds.StudyDate = '20200101'
+    plan = compile_query(ds)
+    assert plan.return_keys == ['PatientID']
+
+    del ds.QueryRetrieveLevel
+    with pytest.raises(ValueError):
+        compile_query(ds)
+
+
+def test_response_sequence_sub_keys():
+    """Sequence items in a response only have the requested sub-keys."""
+    step = Dataset()
+    step.Modality = 'CT'
+    step.ScheduledStationAETitle = 'CT1'
+    step.ScheduledProcedureStepDescription = 'Head'
+    worklist_item = Dataset()
+    worklist_item.PatientName = 'Citizen^Jan'
+    worklist_item.PatientID = '1234'
+    worklist_item.ScheduledProcedureStepSequence = [step]
+
+    query_item = Dataset()
+    query_item.Modality = 'CT'
+    query_item.ScheduledProcedureStepDescription = None
+    ds = Dataset()
+    ds.PatientName = ''
+    ds.ScheduledProcedureStepSequence = [query_item]
+    plan = QueryPlan(ds)
+    assert plan.matches(worklist_item)
+
+    rsp = plan.response(worklist_item)
+    assert 'PatientID' not in rsp
+    assert rsp.PatientName == 'Citizen^Jan'
+    item = rsp.ScheduledProcedureStepSequence[0]
+    assert item.Modality == 'CT'
+    assert item.ScheduledProcedureStepDescription == 'Head'
+    assert 'ScheduledStationAETitle' not in item
+
+    # An empty item returns the whole of each candidate item
+    ds.ScheduledProcedureStepSequence = [Dataset()]
+    rsp = QueryPlan(ds).response(worklist_item)
+    assert 'ScheduledStationAETitle' in rsp.ScheduledProcedureStepSequence[0]
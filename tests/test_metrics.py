@@ -0,0 +1,168 @@
+"""Tests for metrics.py, using real associations over loopback."""
+from urllib.request import urlopen
+
+from pydicom.dataset import Dataset
+from pynetdicom import AE, evt
+from pynetdicom.sop_class import (
+    VerificationSOPClass, PatientRootQueryRetrieveInformationModelFind
+)
+import pytest
+
+from metrics import Metrics
+
+
+CALLING_AET = b'METSCU'
+
+
+def samples(text):
+    """Return {metric and labels: value} for the samples in `text`."""
+    result = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            result[name] = float(value)
+
+    return result
+
+
+def test_histogram():
+    """Observations are counted in every bucket they fall under."""
+    metrics = Metrics(buckets=[0.1, 1])
+    for seconds in (0.05, 0.1, 0.5, 5):
+        metrics.observe('dicom_association_setup_seconds', ('A', ), seconds)
+
+    result = samples(metrics.export())
+    name = 'dicom_association_setup_seconds'
+    assert result[name + '_bucket{peer="A",le="0.1"}'] == 2
+    assert result[name + '_bucket{peer="A",le="1"}'] == 3
+    assert result[name + '_bucket{peer="A",le="+Inf"}'] == 4
+    assert result[name + '_sum{peer="A"}'] == pytest.approx(5.65)
+    assert result[name + '_count{peer="A"}'] == 4
+
+
+def test_export_format():
+    """Each metric has HELP and TYPE lines and label values are escaped."""
+    metrics = Metrics()
+    metrics.increment('dicom_bytes_sent_total', ('a"b\\c\nd', ), 10)
+    text = metrics.export()
+
+    assert '# TYPE dicom_dimse_seconds histogram\n' in text
+    assert '# TYPE dicom_bytes_sent_total counter\n' in text
+    assert text.count('# HELP ') == text.count('# TYPE ') == 8
+    assert 'dicom_bytes_sent_total{peer="a\\"b\\\\c\\nd"} 10\n' in text
+    assert text.endswith('\n')
+
+
+def test_timed():
+    """The time spent in a handler or generator handler is recorded."""
+    class Context(object):
+        def __init__(self, abstract_syntax):
+            self.abstract_syntax = abstract_syntax
+
+    class Event(object):
+        def __init__(self, abstract_syntax):
+            self.context = Context(abstract_syntax)
+
+    def handler(event):
+        return 0x0000
+
+    def generator(event):
+        yield 0xFF00, None
+        yield 0xFF00, None
+
+    metrics = Metrics()
+    echo = Event(VerificationSOPClass)
+    find = Event(PatientRootQueryRetrieveInformationModelFind)
+    assert metrics.timed(evt.EVT_C_ECHO, handler)(echo) == 0x0000
+    assert len(list(metrics.timed(evt.EVT_C_FIND, generator)(find))) == 2
+
+    result = samples(metrics.export())
+    name = 'dicom_handler_seconds_count{{event="{}",sop_class="{}"}}'
+    assert result[name.format('EVT_C_ECHO', 'Verification SOP Class')] == 1
+    assert result[name.format(
+        'EVT_C_FIND',
+        'Patient Root Query/Retrieve Information Model - FIND'
+    )] == 1
+
+
+def test_dimse_latency():
+    """Each request is paired with its final response, per peer."""
+    def handle_find(event):
+        for _ in range(3):
+            yield 0xFF00, event.identifier
+
+    scp_metrics = Metrics()
+    scp_ae = AE(ae_title=b'METSCP')
+    scp_ae.add_supported_context(VerificationSOPClass)
+    scp_ae.add_supported_context(PatientRootQueryRetrieveInformationModelFind)
+    scp = scp_ae.start_server(
+        ('127.0.0.1', 0), block=False,
+        evt_handlers=[(evt.EVT_C_FIND, handle_find)] + scp_metrics.handlers()
+    )
+    port = scp.socket.getsockname()[1]
+
+    scu_metrics = Metrics()
+    ae = AE(ae_title=CALLING_AET)
+    ae.add_requested_context(VerificationSOPClass)
+    ae.add_requested_context(PatientRootQueryRetrieveInformationModelFind)
+    try:
+        assoc = ae.associate(
+            '127.0.0.1', port, ae_title=b'METSCP',
+            evt_handlers=scu_metrics.handlers()
+        )
+        assert assoc.is_established
+        for _ in range(2):
+            assert assoc.send_c_echo().Status == 0x0000
+
+        query = Dataset()
+        query.QueryRetrieveLevel = 'PATIENT'
+        query.PatientID = '1234'
+        responses = list(assoc.send_c_find(
+            query, PatientRootQueryRetrieveInformationModelFind
+        ))
+        assert len(responses) == 4
+        assoc.release()
+    finally:
+        scp.shutdown()
+
+    find = 'Patient Root Query/Retrieve Information Model - FIND'
+    name = (
+        'dicom_dimse_seconds_count'
+        '{{peer="{}",command="{}",sop_class="{}"}}'
+    )
+    for metrics, peer in ((scp_metrics, 'METSCU'), (scu_metrics, 'METSCP')):
+        result = samples(metrics.export())
+        assert result[name.format(
+            peer, 'C-ECHO', 'Verification SOP Class'
+        )] == 2
+        # The Pending responses aren't counted separately
+        assert result[name.format(peer, 'C-FIND', find)] == 1
+
+    result = samples(scp_metrics.export())
+    # Received before the peer's AE title was known
+    assert result[
+        'dicom_pdus_received_total{peer="METSCU",type="A-ASSOCIATE-RQ"}'
+    ] == 1
+    assert result[
+        'dicom_associations_total{peer="METSCU",outcome="accepted"}'
+    ] == 1
+    assert result['dicom_bytes_received_total{peer="METSCU"}'] > 0
+
+
+def test_serve():
+    """The metrics are served over HTTP."""
+    metrics = Metrics()
+    metrics.increment('dicom_associations_total', ('A', 'accepted'))
+    server = metrics.serve(('127.0.0.1', 0))
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urlopen(url, timeout=5) as rsp:
+            assert rsp.status == 200
+            assert rsp.headers['Content-Type'].startswith('text/plain')
+            body = rsp.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert body == metrics.export()
+    assert 'dicom_associations_total{peer="A",outcome="accepted"} 1' in body
@@ -0,0 +1,138 @@
+"""Tests for move_scheduler.py, with a Storage SCP over loopback."""
+import threading
+import time
+
+from pydicom.dataset import Dataset
+from pynetdicom import AE, build_context
+from pynetdicom.sop_class import CTImageStorage
+import pytest
+
+import move_scheduler
+from assoc_pool import AssociationPool
+from move_scheduler import MoveScheduler
+
+
+@pytest.fixture
+def port():
+    ae = AE()
+    ae.add_supported_context(CTImageStorage)
+    scp = ae.start_server(('127.0.0.1', 0), block=False)
+    yield scp.socket.getsockname()[1]
+    scp.shutdown()
+
+
+@pytest.fixture
+def scheduler():
+    ae = AE()
+    pool = AssociationPool(ae, max_idle=1)
+    scheduler = MoveScheduler(pool, max_per_destination=1, wait_timeout=0.5)
+    yield scheduler
+    pool.close()
+
+
+CONTEXTS = [build_context(CTImageStorage)]
+
+
+def test_wait_timeout(scheduler, port):
+    """A move that can't get an association fails its sub-operations."""
+    first = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert first.is_established
+
+    start = time.monotonic()
+    second = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert 0.4 < time.monotonic() - start < 5
+    # pynetdicom counts each C-STORE that raises as a failure
+    assert second.is_established
+    with pytest.raises(RuntimeError):
+        second.send_c_store(Dataset())
+
+    second.release()
+    assert scheduler.throughput()[b'ANY-SCP']['waiting'] == 0
+
+    # The timed out move didn't take the slot
+    first.release()
+    third = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert third.is_established
+    third.release()
+
+
+def test_slot_handed_over(scheduler, port):
+    """A waiting move gets the slot when it's released."""
+    scheduler.wait_timeout = 10
+    first = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(
+        scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    ))
+    thread.start()
+    time.sleep(0.2)
+    assert not result
+
+    first.release()
+    thread.join(10)
+    assert result[0].is_established
+    assert result[0].assoc is first.assoc
+    result[0].release()
+
+
+def test_dead_holder_reclaimed(scheduler, port, monkeypatch):
+    """The slot of an association that died unreleased is taken back."""
+    monkeypatch.setattr(move_scheduler, '_CHECK_INTERVAL', 0.1)
+    scheduler.wait_timeout = 10
+    first = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    # Aborted without going through the scheduler
+    first.assoc.abort()
+
+    second = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert second.is_established
+    assert second.assoc is not first.assoc
+    second.release()
+
+
+def test_released_when_move_fails(scheduler, port):
+    """A move that raises part way through still gives up its slot."""
+    with pytest.raises(RuntimeError):
+        with scheduler.moving():
+            first = scheduler.associate(
+                '127.0.0.1', port, contexts=CONTEXTS
+            )
+            assert first.is_established
+            raise RuntimeError('Failed mid-move')
+
+    stats = scheduler.throughput()[b'ANY-SCP']
+    assert stats['active'] == 0
+    assert stats['moves'] == 1
+
+    # Returned to the pool, and releasing it again does nothing
+    second = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert second.assoc is first.assoc
+    first.release()
+    assert scheduler.throughput()[b'ANY-SCP']['active'] == 1
+    second.release()
+
+
+def test_released_when_handler_dropped(scheduler, port):
+    """The slot is freed when pynetdicom drops a handler part way through."""
+    def handle_move():
+        with scheduler.moving():
+            yield ('127.0.0.1', port, {'priority': 0})
+            yield 2
+            yield (0xFF00, Dataset())
+            yield (0xFF00, Dataset())
+
+    handler = handle_move()
+    next(handler)
+    # pynetdicom requests the sub-association between the handler's yields
+    scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    next(handler)
+    next(handler)
+    assert scheduler.throughput()[b'ANY-SCP']['active'] == 1
+
+    # Raising while sending, so the handler isn't resumed
+    handler.close()
+    assert scheduler.throughput()[b'ANY-SCP']['active'] == 0
+
+    # Nothing held is released outside the context
+    third = scheduler.associate('127.0.0.1', port, contexts=CONTEXTS)
+    assert scheduler.throughput()[b'ANY-SCP']['active'] == 1
+    third.release()
@@ -0,0 +1,125 @@
+"""Tests for mpps_store.py."""
+import os
+
+from pydicom.dataset import Dataset
+import pytest
+
+from mpps_store import MPPSStore
+
+
+def mpps(uid):
+    """Return a new, in progress MPPS instance."""
+    ds = Dataset()
+    ds.SOPInstanceUID = uid
+    ds.PerformedProcedureStepStatus = 'IN PROGRESS'
+    ds.PerformedProcedureStepDescription = 'Created'
+    return ds
+
+
+def modification(**kwargs):
+    """Return an N-SET Modification List."""
+    ds = Dataset()
+    for keyword, value in kwargs.items():
+        setattr(ds, keyword, value)
+
+    return ds
+
+
+def journal_size(store):
+    """Return the number of journalled modifications."""
+    return store._conn.execute('SELECT COUNT(*) FROM mpps_delta').fetchone()[0]
+
+
+@pytest.fixture
+def db_path(tmpdir):
+    return os.path.join(str(tmpdir), 'mpps.sqlite')
+
+
+def test_create_and_update(db_path):
+    """Instances are created once and updated in place."""
+    store = MPPSStore(db_path)
+    ds = mpps('1.2.3')
+    assert store.create(ds)
+    assert not store.create(mpps('1.2.3'))
+    assert '1.2.3' in store
+
+    mod = modification(PerformedProcedureStepDescription='Updated')
+    assert store.update('1.2.3', mod) is mod
+    assert store.get('1.2.3') is ds
+    assert ds.PerformedProcedureStepDescription == 'Updated'
+    assert store.update('1.2.4', mod) is None
+
+
+def test_recovery(db_path):
+    """In progress instances are recovered with their modifications."""
+    store = MPPSStore(db_path)
+    store.create(mpps('1.2.3'))
+    store.create(mpps('1.2.4'))
+    store.update(
+        '1.2.3', modification(PerformedProcedureStepDescription='Updated')
+    )
+    store.update('1.2.4', modification(
+        PerformedProcedureStepStatus='COMPLETED'
+    ))
+    assert journal_size(store) == 1
+    store._conn.close()
+
+    store = MPPSStore(db_path)
+    ds = store.get('1.2.3')
+    assert ds.PerformedProcedureStepDescription == 'Updated'
+    assert journal_size(store) == 0
+    # Finished instances aren't recovered, but still exist
+    assert store.get('1.2.4') is None
+    assert '1.2.4' in store
+
+
+def test_journal_folded(db_path):
+    """The journal is folded into the instance after `fold_after` N-SETs."""
+    store = MPPSStore(db_path, fold_after=4)
+    store.create(mpps('1.2.3'))
+    for ii in range(3):
+        store.update('1.2.3', modification(StudyID=str(ii)))
+
+    assert journal_size(store) == 3
+    store.update('1.2.3', modification(StudyID='3'))
+    assert journal_size(store) == 0
+
+    row = store._conn.execute(
+        "SELECT dataset FROM mpps WHERE uid = '1.2.3'"
+    ).fetchone()
+    assert b'3' in row[0]
+    store._conn.close()
+
+    store = MPPSStore(db_path)
+    assert store.get('1.2.3').StudyID == '3'
+
+
+def test_finished_folded(db_path):
+    """A finished instance is written whole, without a journal."""
+    store = MPPSStore(db_path)
+    ds = mpps('1.2.3')
+    store.create(ds)
+    store.update('1.2.3', modification(StudyID='1'))
+    store.update('1.2.3', modification(
+        PerformedProcedureStepStatus='DISCONTINUED'
+    ))
+    assert journal_size(store) == 0
+    assert store.get('1.2.3') is None
+    assert ds.PerformedProcedureStepStatus == 'DISCONTINUED'
+
+
+def test_compact(db_path):
+    """Compaction folds the journal and removes old finished instances."""
+    store = MPPSStore(db_path, retention=0)
+    store.create(mpps('1.2.3'))
+    store.create(mpps('1.2.4'))
+    store.update('1.2.3', modification(StudyID='1'))
+    store.update('1.2.4', modification(
+        PerformedProcedureStepStatus='COMPLETED'
+    ))
+    assert journal_size(store) == 1
+
+    store.compact()
+    assert journal_size(store) == 0
+    assert '1.2.4' not in store
+    assert store.get('1.2.3').StudyID == '1'
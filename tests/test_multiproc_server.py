@@ -0,0 +1,27 @@
+"""Tests for multiproc_server.py."""
+import os
+import signal
+
+from multiproc_server import _exit_reason
+
+
+def wait_status(action):
+    """Return the wait status of a child process that runs `action`."""
+    pid = os.fork()
+    if not pid:
+        action()
+        os._exit(0)
+
+    return os.waitpid(pid, 0)[1]
+
+
+def test_exit_reason_code():
+    """The exit code is reported, not the raw wait status."""
+    status = wait_status(lambda: os._exit(3))
+    assert _exit_reason(status) == 'exited with code 3'
+
+
+def test_exit_reason_signal():
+    """The signal that killed a worker is reported."""
+    status = wait_status(lambda: os.kill(os.getpid(), signal.SIGKILL))
+    assert _exit_reason(status) == 'was killed by signal SIGKILL'
@@ -0,0 +1,79 @@
+"""Tests for offload.py."""
+import zlib
+
+from pydicom.dataset import Dataset
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import write_dataset
+from pydicom.sequence import Sequence
+from pydicom.uid import (
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, ExplicitVRBigEndian,
+    DeflatedExplicitVRLittleEndian
+)
+import pytest
+
+from offload import read_keys
+
+
+KEYWORDS = ['PatientID', 'PatientName', 'StudyDate', 'SOPInstanceUID']
+
+
+def encode(ds, transfer_syntax):
+    """Return `ds` encoded with `transfer_syntax`."""
+    fp = DicomBytesIO()
+    fp.is_implicit_VR = transfer_syntax.is_implicit_VR
+    fp.is_little_endian = transfer_syntax.is_little_endian
+    write_dataset(fp, ds)
+    data = fp.getvalue()
+    if transfer_syntax.is_deflated:
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS
+        )
+        data = compressor.compress(data) + compressor.flush()
+
+    return data
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.SOPInstanceUID = '1.2.3.4'
+    ds.StudyDate = '20200101'
+    ds.PatientName = 'Citizen^Jan'
+    ds.PatientID = '1234'
+    item = Dataset()
+    item.CodeValue = '1'
+    ds.ProcedureCodeSequence = Sequence([item])
+    ds.BitsAllocated = 8
+    ds.PixelData = b'\x00' * 200000
+    return ds
+
+
+@pytest.mark.parametrize('transfer_syntax', [
+    ImplicitVRLittleEndian, ExplicitVRLittleEndian, ExplicitVRBigEndian,
+    DeflatedExplicitVRLittleEndian
+])
+def test_read_keys(dataset, transfer_syntax):
+    """The values are read for each transfer syntax."""
+    data = encode(dataset, transfer_syntax)
+    assert read_keys(memoryview(data), transfer_syntax, KEYWORDS) == {
+        'PatientID': '1234',
+        'PatientName': 'Citizen^Jan',
+        'StudyDate': '20200101',
+        'SOPInstanceUID': '1.2.3.4',
+    }
+
+
+def test_read_keys_missing(dataset):
+    """Keywords not in the dataset are left out."""
+    del dataset.PatientName
+    data = encode(dataset, ImplicitVRLittleEndian)
+    keys = read_keys(data, ImplicitVRLittleEndian, KEYWORDS)
+    assert 'PatientName' not in keys
+    assert keys['PatientID'] == '1234'
+
+
+def test_read_keys_truncated_pixel_data(dataset):
+    """Parsing stops before the pixel data, which isn't needed."""
+    data = encode(dataset, ExplicitVRLittleEndian)
+    keys = read_keys(data[:-100000], ExplicitVRLittleEndian, KEYWORDS)
+    assert keys['SOPInstanceUID'] == '1.2.3.4'
@@ -0,0 +1,129 @@
+"""Tests for pdv_receiver.py, using real associations over loopback."""
+import time
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import write_dataset
+from pydicom.uid import ImplicitVRLittleEndian, generate_uid
+from pynetdicom import AE, evt
+from pynetdicom.pdu import P_DATA_TF
+from pynetdicom.sop_class import CTImageStorage
+import pytest
+
+import pdv_receiver
+from pdv_receiver import PDVReceiver, encoded_dataset
+
+
+@pytest.fixture
+def dataset():
+    ds = Dataset()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = generate_uid()
+    ds.PatientID = '1234'
+    ds.BitsAllocated = 8
+    # Larger than the maximum PDU size so it's sent in several PDUs
+    ds.PixelData = bytes(range(256)) * 1000
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    ds.is_implicit_VR = True
+    ds.is_little_endian = True
+    return ds
+
+
+def encode(ds):
+    """Return `ds` encoded as Implicit VR Little Endian."""
+    fp = DicomBytesIO()
+    fp.is_implicit_VR = True
+    fp.is_little_endian = True
+    write_dataset(fp, ds)
+    return fp.getvalue()
+
+
+def start_scp(received, pdus, aborted=None):
+    """Return a Storage SCP using a ``PDVReceiver`` and its port."""
+    def handle_store(event):
+        received.append(bytes(encoded_dataset(event)))
+        return 0x0000
+
+    def handle_pdu(event):
+        pdus.append(event.pdu)
+
+    ae = AE()
+    ae.add_supported_context(CTImageStorage, ImplicitVRLittleEndian)
+    ae.maximum_pdu_size = 16382
+    handlers = [
+        (evt.EVT_C_STORE, handle_store), (evt.EVT_PDU_RECV, handle_pdu)
+    ]
+    if aborted is not None:
+        handlers.append((evt.EVT_ABORTED, aborted.append))
+
+    scp = ae.start_server(
+        ('127.0.0.1', 0), block=False,
+        evt_handlers=handlers + PDVReceiver().handlers()
+    )
+    return scp, scp.socket.getsockname()[1]
+
+
+def associate(port):
+    """Return an association with the SCP at `port`."""
+    ae = AE()
+    ae.add_requested_context(CTImageStorage, ImplicitVRLittleEndian)
+    return ae.associate('127.0.0.1', port)
+
+
+def test_store(dataset):
+    """Data sets are received intact and EVT_PDU_RECV is triggered."""
+    received = []
+    pdus = []
+    scp, port = start_scp(received, pdus)
+    try:
+        assoc = associate(port)
+        assert assoc.is_established
+        for _ in range(2):
+            status = assoc.send_c_store(dataset)
+            assert status.Status == 0x0000
+
+        assoc.release()
+    finally:
+        scp.shutdown()
+
+    assert received == [encode(dataset)] * 2
+    p_data = [pdu for pdu in pdus if isinstance(pdu, P_DATA_TF)]
+    assert len(p_data) > 2 * len(encode(dataset)) // 16382
+
+
+def wait_for(condition, timeout=5):
+    """Return ``True`` once `condition()` is, ``False`` after `timeout`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(0.01)
+
+    return False
+
+
+def test_read_failure_aborts(dataset, monkeypatch):
+    """An unexpected error while reading aborts the association."""
+    def reserve(self, nr_bytes):
+        raise MemoryError()
+
+    monkeypatch.setattr(pdv_receiver.ReceivedDataset, 'reserve', reserve)
+
+    received = []
+    aborted = []
+    scp, port = start_scp(received, [], aborted)
+    try:
+        assoc = associate(port)
+        assert assoc.is_established
+        status = assoc.send_c_store(dataset)
+        assert not status
+        assert wait_for(lambda: not assoc.is_established)
+        # Aborted through the state machine, so the handlers are told
+        assert wait_for(lambda: aborted)
+        assert wait_for(lambda: not scp.active_associations)
+    finally:
+        scp.shutdown()
+
+    assert received == []
@@ -0,0 +1,119 @@
+"""Tests for storage_layout.py."""
+import hashlib
+import os
+
+from pydicom.dataset import Dataset
+import pytest
+
+from storage_layout import (
+    HashedLayout, HierarchicalLayout, _safe_name, iter_files
+)
+
+
+def test_hashed_path(tmp_path):
+    """The path is given by the hash of the UID alone."""
+    root = str(tmp_path)
+    uid = '1.2.826.0.1.3680043.8.498.1'
+    digest = hashlib.sha1(uid.encode('ascii')).hexdigest()
+
+    layout = HashedLayout(root)
+    path = layout.path_for(uid)
+    assert path == os.path.join(root, digest[0:2], digest[2:4], uid)
+    assert path == HashedLayout(root).path_for(uid, Dataset())
+
+    layout = HashedLayout(root, depth=3, width=1)
+    path = layout.path_for(uid)
+    assert path == os.path.join(
+        root, digest[0], digest[1], digest[2], uid
+    )
+
+
+def test_hashed_find(tmp_path):
+    """Stored instances are found by their UID."""
+    layout = HashedLayout(str(tmp_path))
+    assert layout.find('1.2.3.4') is None
+
+    path = layout.path_for('1.2.3.4')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fp:
+        fp.write(b'\x00')
+
+    assert layout.find('1.2.3.4') == path
+    assert layout.find('1.2.3.5') is None
+
+
+@pytest.mark.parametrize('uid, name', [
+    ('1.2.3.4', '1.2.3.4'),
+    (' 1.2.3.4 ', '1.2.3.4'),
+    ('1.2.3.4\x00', '1.2.3.4_'),
+    ('../../etc/passwd', '.._.._etc_passwd'),
+    ('/etc/passwd', '_etc_passwd'),
+    ('..\\..\\boot.ini', '.._.._boot.ini'),
+    ('1.2\n3', '1.2_3'),
+    ('..', 'UNKNOWN'),
+    ('.', 'UNKNOWN'),
+    ('', 'UNKNOWN'),
+    (None, 'UNKNOWN'),
+])
+def test_safe_name(uid, name):
+    """Anything that isn't safe in a directory name is replaced."""
+    assert _safe_name(uid) == name
+
+
+@pytest.mark.parametrize('uid', [
+    '../../etc/passwd', '/etc/passwd', '..', '', '1.2.3.4/../..'
+])
+def test_hostile_uid(tmp_path, uid):
+    """A hostile UID can't place an instance outside the root."""
+    root = os.path.realpath(str(tmp_path))
+    ds = Dataset()
+    ds.PatientID = '../..'
+    ds.StudyInstanceUID = '/'
+    ds.SeriesInstanceUID = '..'
+    layouts = (HashedLayout(root), HierarchicalLayout(root))
+    for path in (layout.path_for(uid, ds) for layout in layouts):
+        path = os.path.realpath(path)
+        assert os.path.commonpath([root, path]) == root
+        assert path != root
+
+
+def test_hierarchical_path(tmp_path):
+    """The path is given by the patient, study and series."""
+    root = str(tmp_path)
+    ds = Dataset()
+    ds.PatientID = '1234'
+    ds.StudyInstanceUID = '1.2.3'
+    ds.SeriesInstanceUID = '1.2.3.4'
+    bucket = hashlib.sha1(b'1234').hexdigest()
+
+    path = HierarchicalLayout(root).path_for('1.2.3.4.5', ds)
+    assert path == os.path.join(
+        root, bucket[:2], '1234', '1.2.3', '1.2.3.4', '1.2.3.4.5'
+    )
+
+    path = HierarchicalLayout(root, fanout=16).path_for('1.2.3.4.5', ds)
+    assert path.split(os.sep)[-5] == bucket[:1]
+
+    # No patient ID
+    path = HierarchicalLayout(root).path_for('1.2.3.4.5', Dataset())
+    assert path.split(os.sep)[-4:] == [
+        'UNKNOWN', 'UNKNOWN', 'UNKNOWN', '1.2.3.4.5'
+    ]
+
+
+def test_iter_files(tmp_path):
+    """Every stored file is found, but not those still being written."""
+    layout = HashedLayout(str(tmp_path))
+    paths = set()
+    for uid in ('1.2.3.4', '1.2.3.5', '1.2.3.6'):
+        path = layout.path_for(uid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(b'\x00')
+
+        paths.add(path)
+
+    with open(path + '.tmp', 'wb') as fp:
+        fp.write(b'\x00')
+
+    assert set(iter_files(str(tmp_path))) == paths
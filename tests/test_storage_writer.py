@@ -0,0 +1,129 @@
+"""Tests for storage_writer.py."""
+import os
+import queue
+import threading
+
+import pytest
+
+import storage_writer
+from storage_writer import StorageWriter
+
+
+def writer_of(data, started=None, proceed=None):
+    """Return a write callable that writes `data`, optionally pausing."""
+    def write(fp):
+        fp.write(data[:1])
+        if started is not None:
+            started.set()
+
+        if proceed is not None:
+            assert proceed.wait(5)
+
+        fp.write(data[1:])
+
+    return write
+
+
+@pytest.fixture
+def writer():
+    writer = StorageWriter(workers=2, max_queue=4)
+    yield writer
+    writer.shutdown()
+
+
+def test_write(tmpdir, writer):
+    """The file is written, synced and no temporary file is left."""
+    path = os.path.join(str(tmpdir), 'a', 'b', 'file.dcm')
+    future = writer.submit(path, writer_of(b'data'))
+    assert future.result(5) == path
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'data'
+
+    assert os.listdir(os.path.dirname(path)) == ['file.dcm']
+
+
+def test_same_path(tmpdir):
+    """Concurrent writes to one path each publish a complete file."""
+    writer = StorageWriter(workers=2, batch_size=1)
+    path = os.path.join(str(tmpdir), 'file.dcm')
+    started = [threading.Event(), threading.Event()]
+    proceed = threading.Event()
+    try:
+        futures = [
+            writer.submit(path, writer_of(data, ss, proceed))
+            for data, ss in zip((b'1' * 1000, b'2' * 2000), started)
+        ]
+        # Both are part way through writing at once
+        assert all(ss.wait(5) for ss in started)
+        proceed.set()
+        for future in futures:
+            assert future.result(5) == path
+    finally:
+        proceed.set()
+        writer.shutdown()
+
+    with open(path, 'rb') as fp:
+        assert fp.read() in (b'1' * 1000, b'2' * 2000)
+
+    assert os.listdir(str(tmpdir)) == ['file.dcm']
+
+
+def test_backpressure(tmpdir):
+    """Submitting to a full queue waits and then raises queue.Full."""
+    writer = StorageWriter(workers=1, max_queue=1, batch_size=1)
+    started = threading.Event()
+    proceed = threading.Event()
+    try:
+        first = writer.submit(
+            os.path.join(str(tmpdir), '1'), writer_of(b'1', started, proceed)
+        )
+        assert started.wait(5)
+        second = writer.submit(os.path.join(str(tmpdir), '2'), writer_of(b'2'))
+        with pytest.raises(queue.Full):
+            writer.submit(
+                os.path.join(str(tmpdir), '3'), writer_of(b'3'), timeout=0.1
+            )
+
+        proceed.set()
+        assert first.result(5) and second.result(5)
+    finally:
+        proceed.set()
+        writer.shutdown()
+
+
+def test_write_error(tmpdir, writer):
+    """A failed write sets the exception and removes the temporary file."""
+    def write(fp):
+        fp.write(b'partial')
+        raise ValueError('Unable to encode')
+
+    path = os.path.join(str(tmpdir), 'file.dcm')
+    future = writer.submit(path, write)
+    assert isinstance(future.exception(5), ValueError)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_directory_sync_error(tmpdir, writer, monkeypatch):
+    """The write isn't a success if its directory can't be synced."""
+    def sync_directory(directory):
+        raise OSError('Unable to sync')
+
+    monkeypatch.setattr(storage_writer, '_sync_directory', sync_directory)
+    future = writer.submit(
+        os.path.join(str(tmpdir), 'file.dcm'), writer_of(b'data')
+    )
+    assert isinstance(future.exception(5), OSError)
+
+
+def test_shutdown(tmpdir):
+    """The queued writes are finished before the writers stop."""
+    writer = StorageWriter(workers=1, max_queue=16, batch_size=4)
+    futures = [
+        writer.submit(os.path.join(str(tmpdir), str(ii)), writer_of(b'x'))
+        for ii in range(10)
+    ]
+    writer.shutdown()
+    assert all(future.done() and not future.exception() for future in futures)
+    assert len(os.listdir(str(tmpdir))) == 10
+    assert not any(tt.is_alive() for tt in threading.enumerate()
+                   if tt.name.startswith('StorageWriter'))
@@ -0,0 +1,136 @@
+"""Tests for transcode.py."""
+import os
+
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import (
+    ExplicitVRLittleEndian, RLELossless, generate_uid
+)
+from pynetdicom import build_context
+from pynetdicom.sop_class import CTImageStorage
+
+from transcode import TranscodeCache, _cache_name
+
+
+def accepted_contexts():
+    """Return accepted contexts that need RLE instances decompressed."""
+    cx = build_context(CTImageStorage, ExplicitVRLittleEndian)
+    cx._as_scu = True
+    return [cx]
+
+
+def write(path, transfer_syntax, uid):
+    """Write a small instance to `path`, return its size."""
+    ds = Dataset()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = uid
+    ds.PatientID = '1234' * 64
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = uid
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    ds.is_implicit_VR = False
+    ds.is_little_endian = True
+    ds.save_as(path, write_like_original=False)
+    return os.path.getsize(path)
+
+
+def cached_instances(tmpdir, count):
+    """Return the stored paths and the cache paths of converted instances.
+
+    The converted instances are already in the cache, oldest first.
+    """
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    os.makedirs(cache_dir)
+    paths, cached = [], []
+    for ii in range(count):
+        uid = generate_uid()
+        path = os.path.join(str(tmpdir), '{}.dcm'.format(ii))
+        write(path, RLELossless, uid)
+        cpath = os.path.join(
+            cache_dir, _cache_name(uid, ExplicitVRLittleEndian)
+        )
+        write(cpath, ExplicitVRLittleEndian, uid)
+        # Newer than the stored instance and used in order
+        os.utime(cpath, (1000 + ii, os.path.getmtime(path) + 10))
+        paths.append(path)
+        cached.append(cpath)
+
+    return cache_dir, paths, cached
+
+
+def test_iter_paths_cached(tmpdir):
+    """Instances already converted are taken from the cache."""
+    cache_dir, paths, cached = cached_instances(tmpdir, 2)
+    cache = TranscodeCache(cache_dir, workers=1)
+    try:
+        assert list(cache.iter_paths(paths, accepted_contexts())) == cached
+    finally:
+        cache.shutdown()
+
+
+def test_yielded_path_not_evicted(tmpdir):
+    """A yielded path stays in the cache until the next is requested."""
+    cache_dir, paths, cached = cached_instances(tmpdir, 3)
+    size = os.path.getsize(cached[0])
+    cache = TranscodeCache(cache_dir, max_bytes=size, workers=1)
+    try:
+        paths = cache.iter_paths(paths[:1], accepted_contexts())
+        assert next(paths) == cached[0]
+
+        # Another association's conversion finishing evicts the rest
+        with cache._lock:
+            cache._evict()
+
+        assert os.path.exists(cached[0])
+        assert not os.path.exists(cached[1])
+        assert not os.path.exists(cached[2])
+
+        paths.close()
+        assert cache._pins == {}
+    finally:
+        cache.shutdown()
+
+
+def test_evicted_once_released(tmpdir):
+    """An instance kept while it was being sent is evicted afterwards."""
+    cache_dir, paths, cached = cached_instances(tmpdir, 2)
+    size = os.path.getsize(cached[0])
+    cache = TranscodeCache(cache_dir, max_bytes=size, workers=1)
+    try:
+        first = cache.iter_paths(paths[:1], accepted_contexts())
+        assert next(first) == cached[0]
+        second = cache.iter_paths(paths[1:], accepted_contexts())
+        assert next(second) == cached[1]
+
+        # Both in use so nothing can be evicted
+        with cache._lock:
+            cache._evict()
+
+        assert all(os.path.exists(cc) for cc in cached)
+
+        # The least recently used is removed once it's released
+        list(first)
+        assert not os.path.exists(cached[0])
+        assert os.path.exists(cached[1])
+        list(second)
+    finally:
+        cache.shutdown()
+
+
+def test_hostile_uid(tmpdir):
+    """A SOP Instance UID can't place a cached instance outside the cache."""
+    cache_dir = os.path.join(str(tmpdir), 'cache')
+    path = os.path.join(str(tmpdir), 'stored.dcm')
+    write(path, RLELossless, '../../x')
+    cache = TranscodeCache(cache_dir, workers=1)
+    try:
+        cached = cache._submit(path, accepted_contexts())
+        assert os.path.dirname(cached) == cache_dir
+        # There's no Pixel Data to convert, so it's sent as stored
+        assert cache._result(path, cached) == path
+        cache._release(cached)
+    finally:
+        cache.shutdown()
+
+    assert os.listdir(str(tmpdir)) == ['cache', 'stored.dcm']
+    assert os.listdir(cache_dir) == []
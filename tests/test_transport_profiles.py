@@ -0,0 +1,56 @@
+"""Tests for transport_profiles.py, using real associations over loopback."""
+import socket
+import time
+
+from pynetdicom import AE
+from pynetdicom.sop_class import VerificationSOPClass
+
+from transport_profiles import TransportTuner, tcp_rtt
+
+
+def test_tcp_rtt():
+    """The round-trip time of a connected socket is found."""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    client = socket.create_connection(server.getsockname())
+    conn, _ = server.accept()
+    try:
+        rtt = tcp_rtt(client)
+        assert rtt is not None and 0 <= rtt < 1
+    finally:
+        conn.close()
+        client.close()
+        server.close()
+
+
+def test_throughput_ignores_idle_time():
+    """Time spent idle before and after the requests isn't counted."""
+    scp_ae = AE()
+    scp_ae.add_supported_context(VerificationSOPClass)
+    scp = scp_ae.start_server(('127.0.0.1', 0), block=False)
+    port = scp.socket.getsockname()[1]
+
+    tuner = TransportTuner()
+    ae = AE()
+    ae.add_requested_context(VerificationSOPClass)
+    try:
+        assoc = tuner.associate(ae, '127.0.0.1', port)
+        assert assoc.is_established
+        time.sleep(0.5)
+        for _ in range(3):
+            assert assoc.send_c_echo().Status == 0x0000
+
+        time.sleep(0.5)
+        assoc.release()
+    finally:
+        scp.shutdown()
+
+    deadline = time.monotonic() + 5
+    while not tuner.stats() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stats = tuner.stats()['127.0.0.1']
+    assert stats['associations'] == 1
+    # A few hundred bytes over a second would be under 1 KiB/s
+    assert stats['throughput'] > 10 * 1024
@@ -0,0 +1,134 @@
+"""Tests for worklist_store.py."""
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+import pytest
+
+from matching import QueryPlan
+from worklist_store import WorklistStore
+
+
+def worklist_item(study_uid, sps_id, station, date, modality='CT'):
+    """Return a worklist item with a single Scheduled Procedure Step."""
+    ds = Dataset()
+    ds.PatientName = 'Citizen^Jan'
+    ds.PatientID = '1234'
+    ds.StudyInstanceUID = study_uid
+    item = Dataset()
+    item.ScheduledStationAETitle = station
+    item.ScheduledProcedureStepStartDate = date
+    item.Modality = modality
+    item.ScheduledProcedureStepID = sps_id
+    ds.ScheduledProcedureStepSequence = Sequence([item])
+    return ds
+
+
+def query(station=None, date=None, modality=None, **kwargs):
+    """Return a QueryPlan for a worklist poll."""
+    ds = Dataset()
+    for keyword, value in kwargs.items():
+        setattr(ds, keyword, value)
+
+    item = Dataset()
+    item.ScheduledStationAETitle = station or ''
+    item.ScheduledProcedureStepStartDate = date or ''
+    item.Modality = modality or ''
+    ds.ScheduledProcedureStepSequence = Sequence([item])
+    return QueryPlan(ds)
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = WorklistStore(str(tmpdir.join('worklist.sqlite')))
+    store.add(worklist_item('1.1', 'A', 'CTSCANNER', '20200101'))
+    store.add(worklist_item('1.2', 'B', 'CTSCANNER', '20200102'))
+    store.add(worklist_item('1.3', 'C', 'MRSCANNER', '20200101', 'MR'))
+    yield store
+    store.close()
+
+
+def uids(items):
+    return sorted(ds.StudyInstanceUID for ds in items)
+
+
+def test_query(store):
+    """Items are matched on the indexed and the other keys."""
+    assert uids(store.query(query())) == ['1.1', '1.2', '1.3']
+    assert uids(store.query(query('CTSCANNER'))) == ['1.1', '1.2']
+    assert uids(store.query(query(date='20200101'))) == ['1.1', '1.3']
+    assert uids(store.query(query(date='20200102-'))) == ['1.2']
+    assert uids(store.query(query('CTSCANNER', '20200101', 'CT'))) == ['1.1']
+    assert uids(store.query(query(modality='MR'))) == ['1.3']
+    # Not an indexed key, so checked against the decoded items
+    assert uids(store.query(query(PatientID='1234'))) == [
+        '1.1', '1.2', '1.3'
+    ]
+    assert list(store.query(query(PatientID='5678'))) == []
+
+
+def test_add_replaces(store):
+    """An item with the same Study Instance UID and step ID is replaced."""
+    generation = store.generation
+    store.add(worklist_item('1.1', 'A', 'OTHER', '20200101'))
+    assert store.generation > generation
+    assert uids(store.query(query('CTSCANNER'))) == ['1.2']
+    assert uids(store.query(query('OTHER'))) == ['1.1']
+
+
+def test_add_invalid(store):
+    """Items that can't be stored raise ValueError and aren't added."""
+    generation = store.generation
+    ds = worklist_item('1.4', 'D', 'CTSCANNER', '20200101')
+    del ds.StudyInstanceUID
+    with pytest.raises(ValueError):
+        store.add(ds)
+
+    # Can't be encoded
+    ds = worklist_item('1.4', 'D', 'CTSCANNER', '20200101')
+    ds.Rows = 'not a number'
+    with pytest.raises(ValueError):
+        store.add(ds)
+
+    assert store.generation == generation
+    assert uids(store.query(query())) == ['1.1', '1.2', '1.3']
+
+
+def test_remove(store):
+    """A step is removed by Study Instance UID and step ID."""
+    generation = store.generation
+    assert store.remove('1.1', 'A')
+    assert store.generation == generation + 1
+    assert not store.remove('1.1', 'A')
+    assert store.generation == generation + 1
+    assert uids(store.query(query())) == ['1.2', '1.3']
+
+
+def test_complete(store):
+    """The steps an MPPS performed are removed, as the MPPS SCP does."""
+    mpps = Dataset()
+    mpps.PerformedProcedureStepStatus = 'COMPLETED'
+    items = []
+    for study_uid, sps_id in (('1.1', 'A'), ('1.3', 'C'), ('1.9', 'Z')):
+        item = Dataset()
+        item.StudyInstanceUID = study_uid
+        item.ScheduledProcedureStepID = sps_id
+        items.append(item)
+
+    # An unscheduled step has no Study Instance UID
+    items.append(Dataset())
+    mpps.ScheduledStepAttributesSequence = Sequence(items)
+
+    assert store.complete(mpps) == 2
+    assert uids(store.query(query())) == ['1.2']
+    assert store.complete(Dataset()) == 0
+
+
+def test_shared(store, tmpdir):
+    """Another store on the same database sees the changes."""
+    other = WorklistStore(store.db_path)
+    try:
+        generation = other.generation
+        store.remove('1.2', 'B')
+        assert other.generation > generation
+        assert uids(other.query(query())) == ['1.1', '1.3']
+    finally:
+        other.close()
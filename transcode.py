@@ -0,0 +1,329 @@
+"""
+Transcoding of stored SOP Instances for C-STORE sub-operations.
+
+pynetdicom sends a dataset using any accepted presentation context whose
+transfer syntax it can convert to while encoding, which is only possible
+between the uncompressed little endian syntaxes. An instance stored with a
+compressed transfer syntax can't be sent to a peer that only accepted
+uncompressed ones (such as a viewer that proposed Implicit VR Little
+Endian), so its Pixel Data has to be decompressed first.
+
+Decompression is CPU-bound, so it's done by a pool of processes and the
+decompressed instances are kept in a cache directory, limited to
+`max_bytes` by removing the least recently used. A study that's retrieved
+again is then sent straight from the cache. Cached instances that are about
+to be sent are never removed, if the cache is over its limit they're
+removed once they've been read.
+
+pydicom can only decompress Pixel Data, it has no encoders, so an
+uncompressed instance that's requested by a peer that only accepted
+compressed transfer syntaxes is sent as stored (and the sub-operation fails
+as before).
+"""
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import os
+import threading
+
+from pydicom import dcmread
+from pydicom.uid import UID, ExplicitVRLittleEndian
+
+from dataset_loader import read_header, read_instance
+
+
+LOGGER = logging.getLogger('pynetdicom')
+
+# The number of instances being converted ahead of the one being sent
+CONVERT_AHEAD = 4
+
+
+def _decompress(src, dst):
+    """Write the decompressed instance at `src` to `dst`, return its size.
+
+    Runs in a worker process.
+    """
+    ds = dcmread(src)
+    ds.decompress()
+    tmp = dst + '.tmp'
+    ds.save_as(tmp, write_like_original=False)
+    os.replace(tmp, dst)
+
+    return os.path.getsize(dst)
+
+
+def _cache_name(sop_instance_uid, target):
+    """Return the cache file name of an instance converted to `target`.
+
+    The SOP Instance UID comes from the stored file, so it's hashed rather
+    than trusted to be a safe file name.
+    """
+    uid = str(sop_instance_uid).encode('ascii', 'replace')
+    return '{}.{}.dcm'.format(hashlib.sha256(uid).hexdigest(), target)
+
+
+def _is_newer(path, other):
+    """Return ``True`` if the file at `path` is newer than `other`."""
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(other)
+    except OSError:
+        return False
+
+
+def target_syntax(sop_class, transfer_syntax, contexts):
+    """Return the transfer syntax an instance must be converted to.
+
+    Parameters
+    ----------
+    sop_class : str
+        The instance's SOP Class UID.
+    transfer_syntax : str
+        The instance's transfer syntax UID.
+    contexts : list of presentation.PresentationContext
+        The association's accepted presentation contexts.
+
+    Returns
+    -------
+    pydicom.uid.UID or None
+        The transfer syntax to convert to or ``None`` if the instance can be
+        sent as stored (or if it can't be converted to any of the accepted
+        transfer syntaxes).
+    """
+    accepted = [
+        cx.transfer_syntax[0] for cx in contexts
+        if cx.abstract_syntax == sop_class and cx.as_scu
+    ]
+    transfer_syntax = UID(transfer_syntax)
+    for syntax in accepted:
+        if syntax == transfer_syntax:
+            return None
+
+        # pynetdicom converts between these itself
+        if (
+            not syntax.is_compressed
+            and not transfer_syntax.is_compressed
+            and syntax.is_little_endian == transfer_syntax.is_little_endian
+        ):
+            return None
+
+    if not transfer_syntax.is_compressed:
+        return None
+
+    # Decompressed instances are Explicit VR Little Endian, which pynetdicom
+    #   can send with any of the little endian uncompressed syntaxes
+    for syntax in accepted:
+        if not syntax.is_compressed and syntax.is_little_endian:
+            return ExplicitVRLittleEndian
+
+    return None
+
+
+class TranscodeCache(object):
+    """A disk cache of instances converted for sending.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory the converted instances are kept in.
+    max_bytes : int, optional
+        The maximum total size of the cached instances (default 10 GiB).
+    workers : int, optional
+        The number of worker processes, if not used then one per CPU.
+    """
+    def __init__(self, cache_dir, max_bytes=10 * 1024**3, workers=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        # {cache path: size}, least recently used first
+        self._entries = OrderedDict()
+        self._total = 0
+        # {cache path: Future}, for the conversions in progress
+        self._pending = {}
+        # {cache path: number of users}, for the instances about to be sent
+        self._pins = {}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                continue
+
+            stat = entry.stat()
+            entries.append((stat.st_atime, entry.path, stat.st_size))
+
+        for _, path, size in sorted(entries):
+            self._entries[path] = size
+            self._total += size
+
+    def path_for(self, path, contexts):
+        """Return the path of the instance to send in place of `path`.
+
+        The instance at `path` is converted if none of the accepted
+        `contexts` can be used to send it as stored. Blocks until the
+        conversion is complete.
+
+        A cached instance may be removed at any time once returned, use
+        ``dataset_for()`` or ``iter_paths()`` to read it.
+        """
+        cached = self._submit(path, contexts)
+        try:
+            return self._result(path, cached)
+        finally:
+            self._release(cached)
+
+    def iter_paths(self, paths, contexts):
+        """Yield the path of the instance to send for each of `paths`.
+
+        Up to `CONVERT_AHEAD` instances are converted at once ahead of the
+        one being yielded. A yielded path isn't removed from the cache until
+        the next one is requested, so it must be read before then.
+        """
+        pending = deque()
+        try:
+            for path in paths:
+                pending.append((path, self._submit(path, contexts)))
+                if len(pending) > CONVERT_AHEAD:
+                    path, cached = pending[0]
+                    yield self._result(path, cached)
+                    pending.popleft()
+                    self._release(cached)
+
+            while pending:
+                path, cached = pending[0]
+                yield self._result(path, cached)
+                pending.popleft()
+                self._release(cached)
+        finally:
+            # Closed early, so release the rest
+            for _, cached in pending:
+                self._release(cached)
+
+    def dataset_for(self, ds, contexts):
+        """Return the dataset to send in place of the stored dataset `ds`."""
+        target = target_syntax(
+            ds.SOPClassUID, ds.file_meta.TransferSyntaxUID, contexts
+        )
+        fpath = getattr(ds, 'filename', None)
+        if target is None or not isinstance(fpath, str):
+            return ds
+
+        cached = self._submit(fpath, contexts)
+        try:
+            converted = self._result(fpath, cached)
+            if converted == fpath:
+                return ds
+
+            return read_instance(converted)
+        finally:
+            self._release(cached)
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        self._executor.shutdown()
+
+    def _submit(self, path, contexts):
+        """Start converting `path` if it's needed, return the cache path.
+
+        Returns ``None`` if the instance doesn't need converting. The cache
+        path is kept in the cache until passed to ``_release()``.
+        """
+        try:
+            ds = read_header(path, ['SOPClassUID', 'SOPInstanceUID'])
+            target = target_syntax(
+                ds.SOPClassUID, ds.file_meta.TransferSyntaxUID, contexts
+            )
+        except Exception as exc:
+            LOGGER.warning("Unable to read '%s': %s", path, exc)
+            return None
+
+        if target is None:
+            return None
+
+        cached = os.path.join(
+            self.cache_dir, _cache_name(ds.SOPInstanceUID, target)
+        )
+        with self._lock:
+            self._pins[cached] = self._pins.get(cached, 0) + 1
+            if cached in self._pending:
+                return cached
+
+            # The stored instance may have been replaced since it was
+            #   converted
+            if cached in self._entries and _is_newer(cached, path):
+                self._entries.move_to_end(cached)
+                return cached
+
+            self._pending[cached] = self._executor.submit(
+                _decompress, path, cached
+            )
+
+        return cached
+
+    def _result(self, path, cached):
+        """Return the path to send once any conversion has finished."""
+        if cached is None:
+            return path
+
+        with self._lock:
+            future = self._pending.get(cached)
+
+        if future is None:
+            # Keep track of when the cached instance was last used
+            try:
+                os.utime(cached)
+            except OSError:
+                # The conversion failed or it's been evicted since
+                return path
+
+            return cached
+
+        try:
+            size = future.result()
+        except Exception as exc:
+            LOGGER.error("Unable to convert '%s': %s", path, exc)
+            with self._lock:
+                self._pending.pop(cached, None)
+
+            return path
+
+        with self._lock:
+            if self._pending.pop(cached, None) is not None:
+                self._total += size - self._entries.pop(cached, 0)
+                self._entries[cached] = size
+                self._evict()
+
+        return cached
+
+    def _release(self, cached):
+        """Allow the cache path from ``_submit()`` to be removed."""
+        if cached is None:
+            return
+
+        with self._lock:
+            self._pins[cached] -= 1
+            if not self._pins[cached]:
+                del self._pins[cached]
+                # It may have been kept while the cache was over its limit
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used instances until under the limit.
+
+        Instances about to be sent are skipped. Must be called with the lock
+        held.
+        """
+        for cached in list(self._entries):
+            if self._total <= self.max_bytes or len(self._entries) <= 1:
+                return
+
+            if cached in self._pins:
+                continue
+
+            self._total -= self._entries.pop(cached)
+            try:
+                os.remove(cached)
+            except OSError:
+                pass
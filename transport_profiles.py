@@ -0,0 +1,317 @@
+"""
+Transport profiles: the maximum PDU size and socket options to use for an
+association, chosen to suit the peer.
+
+By default pynetdicom offers a maximum PDU length of 16382 bytes, leaves the
+socket buffers at the kernel's defaults and reads from the socket 4096
+bytes at a time, so a large C-STORE or C-GET is sent as tens of thousands
+of small P-DATA-TF PDUs. A ``TransportProfile`` sets:
+
+* `max_pdu`: the maximum PDU length offered to the peer, which is the size
+  of the PDUs the peer sends us
+* `nodelay`: ``TCP_NODELAY``, pynetdicom sends each PDU with a single call
+  so Nagle's algorithm only holds back the end of a PDU, waiting for the
+  peer to acknowledge the start of it
+* `sndbuf` and `rcvbuf`: ``SO_SNDBUF`` and ``SO_RCVBUF``, large enough to
+  cover the bandwidth-delay product of the link. ``None`` leaves the kernel
+  to size them, which on Linux also keeps its automatic tuning
+* `read_chunk`: the most bytes read from the socket at a time
+
+``LAN_BULK`` suits transferring images over a local network, ``WAN`` over a
+link with a long round-trip time and ``LOW_LATENCY`` small requests such as
+queries. A ``TransportTuner`` applies a profile to every association it's
+bound to, either a fixed one or, by default, one chosen for each peer from
+the round-trip times (from ``TCP_INFO``, Linux only) and throughput
+observed on its previous associations. The throughput is measured between
+the first and last P-DATA-TF PDUs, so an association left idle before its
+first request or after its last doesn't make a peer look slow::
+
+    transport = TransportTuner()
+    handlers = [(evt.EVT_C_STORE, handle_store)] + transport.handlers()
+
+As a requestor the maximum PDU length is sent before the connection is
+opened, so use ``TransportTuner.associate()`` rather than
+``AE.associate()``. The socket options are set once the connection has
+been opened, as pynetdicom has no way to set them before.
+"""
+import socket
+import struct
+import threading
+import time
+
+from pynetdicom import evt
+
+from pdv_receiver import pdu_length
+
+
+class TransportProfile(object):
+    """The PDU and socket parameters for an association.
+
+    Parameters
+    ----------
+    name : str
+        The name of the profile.
+    max_pdu : int
+        The maximum PDU length offered to the peer, ``0`` for unlimited.
+    nodelay : bool, optional
+        If ``True`` (default) then set ``TCP_NODELAY``.
+    sndbuf : int, optional
+        The ``SO_SNDBUF`` size in bytes, by default the kernel's.
+    rcvbuf : int, optional
+        The ``SO_RCVBUF`` size in bytes, by default the kernel's.
+    read_chunk : int, optional
+        The most bytes read from the socket at a time (default ``4096``).
+    """
+    def __init__(self, name, max_pdu, nodelay=True, sndbuf=None,
+                 rcvbuf=None, read_chunk=4096):
+        self.name = name
+        self.max_pdu = max_pdu
+        self.nodelay = nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.read_chunk = read_chunk
+
+    def __repr__(self):
+        return '<TransportProfile {}>'.format(self.name)
+
+    def configure(self, sock):
+        """Set the socket options of the :class:`socket.socket` `sock`."""
+        if self.nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+
+
+# Large PDUs and buffers for images on a local network
+LAN_BULK = TransportProfile(
+    'lan-bulk', max_pdu=4 * 1024**2, sndbuf=4 * 1024**2, rcvbuf=4 * 1024**2,
+    read_chunk=1024**2
+)
+
+# Buffers large enough to keep a long, fast link full
+WAN = TransportProfile(
+    'wan', max_pdu=1024**2, sndbuf=16 * 1024**2, rcvbuf=16 * 1024**2,
+    read_chunk=256 * 1024
+)
+
+# Small requests and responses, such as C-ECHO and C-FIND
+LOW_LATENCY = TransportProfile('low-latency', max_pdu=64 * 1024)
+
+PROFILES = {pp.name: pp for pp in (LAN_BULK, WAN, LOW_LATENCY)}
+
+# The Linux struct tcp_info (linux/tcp.h) starts with 8 bytes of u8 fields
+#   (tcpi_state to the window scales) followed by u32 fields, tcpi_rtt (the
+#   smoothed RTT in microseconds) is the 16th of those. The struct has only
+#   been extended at the end, so the offset is the same on every kernel
+_TCPI_RTT = 8 + 15 * 4
+# The size of struct tcp_info up to tcpi_total_retrans, which every kernel
+#   since 2.6 returns in full
+_TCP_INFO_SIZE = 104
+
+# P-DATA-TF
+_P_DATA_TF = 0x04
+
+# A-RELEASE-RQ, A-RELEASE-RP and A-ABORT PDUs, the end of an association
+_END_PDUS = (0x05, 0x06, 0x07)
+
+
+def tcp_rtt(sock):
+    """Return the smoothed round-trip time of `sock` in seconds, if known."""
+    try:
+        info = sock.getsockopt(
+            socket.IPPROTO_TCP, socket.TCP_INFO, _TCP_INFO_SIZE
+        )
+    except (AttributeError, OSError):
+        # Not Linux, or the socket has been closed
+        return None
+
+    # The kernel may return less than asked for
+    if len(info) < _TCPI_RTT + 4:
+        return None
+
+    return struct.unpack_from('I', info, _TCPI_RTT)[0] / 1e6
+
+
+def chunked_recv(assoc_socket, chunk):
+    """Make the ``transport.AssociationSocket`` read `chunk` bytes at a time.
+
+    The same as ``AssociationSocket.recv()``, which reads at most 4096
+    bytes at a time.
+    """
+    def recv(nr_bytes):
+        bytestream = bytearray()
+        sock = assoc_socket.socket
+        while len(bytestream) < nr_bytes:
+            bytes_read = sock.recv(min(chunk, nr_bytes - len(bytestream)))
+            # The connection has been broken
+            if not bytes_read:
+                break
+
+            bytestream.extend(bytes_read)
+
+        return bytestream
+
+    # Only replaced for this socket
+    assoc_socket.recv = recv
+
+
+class _Peer(object):
+    """What's been observed about a peer's connections."""
+    def __init__(self):
+        # Exponentially weighted averages, in seconds and bytes per second
+        self.rtt = None
+        self.throughput = None
+        self.associations = 0
+
+
+class TransportTuner(object):
+    """Applies transport profiles to associations.
+
+    Parameters
+    ----------
+    profile : TransportProfile or str, optional
+        The profile (or the name of the profile) to use for every
+        association, by default a profile is chosen for each peer.
+    default : TransportProfile, optional
+        The profile used for a peer that hasn't been seen before (default
+        ``LAN_BULK``).
+    wan_rtt : float, optional
+        A peer with a round-trip time of at least this many seconds uses
+        ``WAN`` (default ``0.02``).
+    bulk_throughput : float, optional
+        A peer with a throughput of at least this many bytes per second uses
+        ``LAN_BULK``, otherwise ``LOW_LATENCY`` (default 5 MiB/s).
+    smoothing : float, optional
+        The weight given to each new observation (default ``0.3``).
+    """
+    def __init__(self, profile=None, default=LAN_BULK, wan_rtt=0.02,
+                 bulk_throughput=5 * 1024**2, smoothing=0.3):
+        if isinstance(profile, str):
+            profile = PROFILES[profile]
+
+        self.profile = profile
+        self.default = default
+        self.wan_rtt = wan_rtt
+        self.bulk_throughput = bulk_throughput
+        self.smoothing = smoothing
+
+        self._lock = threading.Lock()
+        # {peer address: _Peer}
+        self._peers = {}
+        # {assoc: [peer address, time of the first P-DATA-TF, time of the
+        #   last, P-DATA-TF bytes transferred, RTT]}
+        self._assocs = {}
+
+    def profile_for(self, address):
+        """Return the profile to use with the peer at `address`."""
+        if self.profile is not None:
+            return self.profile
+
+        peer = self._peers.get(address)
+        if peer is None or peer.throughput is None:
+            return self.default
+
+        if peer.rtt is not None and peer.rtt >= self.wan_rtt:
+            return WAN
+
+        if peer.throughput >= self.bulk_throughput:
+            return LAN_BULK
+
+        return LOW_LATENCY
+
+    def stats(self):
+        """Return what's been observed about each peer as a dict."""
+        with self._lock:
+            return {
+                address: {
+                    'rtt': peer.rtt,
+                    'throughput': peer.throughput,
+                    'associations': peer.associations,
+                    'profile': self.profile_for(address).name,
+                }
+                for address, peer in self._peers.items()
+            }
+
+    def associate(self, ae, addr, port, **kwargs):
+        """Request an association using the profile for the peer.
+
+        Takes the same parameters as ``AE.associate()``.
+        """
+        kwargs.setdefault('max_pdu', self.profile_for(addr).max_pdu)
+        kwargs['evt_handlers'] = (
+            list(kwargs.get('evt_handlers') or []) + self.handlers()
+        )
+        return ae.associate(addr, port, **kwargs)
+
+    def handlers(self):
+        """Return the notification event handlers to bind."""
+        return [
+            (evt.EVT_CONN_OPEN, self._on_open),
+            (evt.EVT_CONN_CLOSE, self._on_close),
+            (evt.EVT_DATA_RECV, self._on_data),
+            (evt.EVT_DATA_SENT, self._on_data),
+        ]
+
+    def _on_open(self, event):
+        assoc = event.assoc
+        address = event.address[0]
+        profile = self.profile_for(address)
+        profile.configure(assoc.dul.socket.socket)
+        chunked_recv(assoc.dul.socket, profile.read_chunk)
+        if assoc.is_acceptor:
+            # Sent to the peer in the A-ASSOCIATE-AC
+            assoc.acceptor.maximum_length = profile.max_pdu
+
+        with self._lock:
+            self._assocs[assoc] = [address, None, None, 0, None]
+
+    def _on_data(self, event):
+        state = self._assocs.get(event.assoc)
+        if state is None:
+            return
+
+        data = event.data
+        if data and data[0] == _P_DATA_TF:
+            now = time.monotonic()
+            if state[1] is None:
+                state[1] = now
+
+            state[2] = now
+            state[3] += pdu_length(data)
+        elif data and data[0] in _END_PDUS:
+            # The socket is closed before EVT_CONN_CLOSE, so get the
+            #   round-trip time while it's still open
+            sock = event.assoc.dul.socket.socket
+            state[4] = tcp_rtt(sock) if sock else None
+
+    def _on_close(self, event):
+        with self._lock:
+            state = self._assocs.pop(event.assoc, None)
+
+        if state is None:
+            return
+
+        address, first, last, nr_bytes, rtt = state
+        throughput = None
+        if first is not None:
+            throughput = nr_bytes / max(last - first, 1e-3)
+
+        with self._lock:
+            peer = self._peers.setdefault(address, _Peer())
+            peer.rtt = self._average(peer.rtt, rtt)
+            peer.throughput = self._average(peer.throughput, throughput)
+            peer.associations += 1
+
+    def _average(self, current, value):
+        """Return the weighted average of `current` and `value`."""
+        if value is None:
+            return current
+
+        if current is None:
+            return value
+
+        return current + self.smoothing * (value - current)
@@ -0,0 +1,224 @@
+"""
+A persistent store of the Scheduled Procedure Steps offered by a Modality
+Worklist SCP.
+
+Modalities poll their worklist every few seconds, nearly always with the
+same keys in the Scheduled Procedure Step Sequence: their own *Scheduled
+Station AE Title*, today's *Scheduled Procedure Step Start Date* and their
+*Modality*. Those three keys are stored as indexed columns next to the
+encoded worklist item, so a poll is answered by an index lookup and only
+the items it returns are decoded and checked against the rest of the query.
+
+A step is removed once the MPPS SCP is told it has been COMPLETED. Like
+``archive_index.ArchiveIndex`` every change increments the store's
+``generation``, so cached C-FIND responses can tell when they're stale.
+"""
+from io import BytesIO
+import sqlite3
+import threading
+
+from pynetdicom.dsutils import decode, encode
+
+from matching import SequenceMatch
+
+
+# The Scheduled Procedure Step Sequence keys stored as (column, keyword)
+SPS_KEYS = [
+    ('station_aet', 'ScheduledStationAETitle'),
+    ('start_date', 'ScheduledProcedureStepStartDate'),
+    ('modality', 'Modality'),
+]
+
+_COLUMNS = {keyword: col for col, keyword in SPS_KEYS}
+
+
+def _as_text(value):
+    """Return an element value as the text stored in the database."""
+    if value is None:
+        return ''
+
+    return str(value)
+
+
+class WorklistStore(object):
+    """A SQLite store of Modality Worklist items.
+
+    Each item is stored under its *Study Instance UID* and the *Scheduled
+    Procedure Step ID* of its (single) Scheduled Procedure Step Sequence
+    item.
+
+    Parameters
+    ----------
+    db_path : str
+        The path to the SQLite database, which may be shared with other
+        processes (such as the MPPS SCP).
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS scheduled_steps ('
+                'study_instance_uid TEXT, sps_id TEXT, station_aet TEXT, '
+                'start_date TEXT, modality TEXT, dataset BLOB, '
+                'PRIMARY KEY (study_instance_uid, sps_id))'
+            )
+            # Polls always give the date and nearly always the station
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_sps_station ON scheduled_steps '
+                '(station_aet, start_date, modality)'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_sps_date ON scheduled_steps '
+                '(start_date, modality)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS meta '
+                '(key TEXT PRIMARY KEY, value INTEGER)'
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('generation', 0)"
+            )
+
+    @property
+    def generation(self):
+        """Return the number of changes made to the store."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+
+        return row[0]
+
+    def _changed(self):
+        """Increment the generation, must be called within a transaction."""
+        self._conn.execute(
+            "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+        )
+
+    def add(self, ds):
+        """Add or replace the worklist item `ds`.
+
+        Raises ``ValueError`` if `ds` has no *Study Instance UID*, no
+        Scheduled Procedure Step Sequence item or can't be encoded.
+        """
+        steps = ds.get('ScheduledProcedureStepSequence')
+        if not steps or 'StudyInstanceUID' not in ds:
+            raise ValueError(
+                "A worklist item requires a 'Study Instance UID' and a "
+                "'Scheduled Procedure Step Sequence' item"
+            )
+
+        # Stored as Explicit VR Little Endian
+        data = encode(ds, False, True)
+        if data is None:
+            raise ValueError('Unable to encode the worklist item')
+
+        item = steps[0]
+        values = [_as_text(item.get(keyword)) for _, keyword in SPS_KEYS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO scheduled_steps VALUES '
+                '(?, ?, ?, ?, ?, ?)',
+                [
+                    ds.StudyInstanceUID,
+                    _as_text(item.get('ScheduledProcedureStepID'))
+                ] + values + [data]
+            )
+            self._changed()
+
+    def remove(self, study_instance_uid, sps_id):
+        """Remove a scheduled procedure step.
+
+        Returns ``True`` if the step was in the store.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM scheduled_steps '
+                'WHERE study_instance_uid = ? AND sps_id = ?',
+                (study_instance_uid, _as_text(sps_id))
+            )
+            if cursor.rowcount:
+                self._changed()
+
+        return bool(cursor.rowcount)
+
+    def complete(self, mpps):
+        """Remove the scheduled procedure steps performed by `mpps`.
+
+        Parameters
+        ----------
+        mpps : pydicom.dataset.Dataset
+            The Modality Performed Procedure Step SOP Instance, the steps are
+            taken from its Scheduled Step Attributes Sequence.
+
+        Returns
+        -------
+        int
+            The number of steps removed.
+        """
+        removed = 0
+        for item in mpps.get('ScheduledStepAttributesSequence', []):
+            if 'StudyInstanceUID' not in item:
+                continue
+
+            removed += self.remove(
+                item.StudyInstanceUID, item.get('ScheduledProcedureStepID')
+            )
+
+        return removed
+
+    def query(self, plan):
+        """Yield the worklist items that match `plan`.
+
+        Parameters
+        ----------
+        plan : matching.QueryPlan
+            The compiled Modality Worklist query. The Scheduled Procedure
+            Step Sequence keys that are stored as columns are looked up in
+            the database, any other keys are matched against the decoded
+            items.
+
+        Yields
+        ------
+        pydicom.dataset.Dataset
+            The matching worklist items.
+        """
+        clauses = []
+        check = False
+        for keyword, matcher in plan.matchers:
+            if (
+                keyword != 'ScheduledProcedureStepSequence'
+                or not isinstance(matcher, SequenceMatch)
+            ):
+                check = True
+                continue
+
+            sps_clauses, residual = matcher.plan.split(_COLUMNS)
+            clauses.extend(sps_clauses)
+            check |= bool(residual)
+
+        sql = 'SELECT dataset FROM scheduled_steps'
+        params = []
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(cc for cc, _ in clauses)
+            for _, pp in clauses:
+                params.extend(pp)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        for (data, ) in rows:
+            ds = decode(BytesIO(data), False, True)
+            if check and not plan.matches(ds):
+                continue
+
+            yield ds
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()